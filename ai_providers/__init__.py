@@ -3,10 +3,10 @@
 """
 AI提供商模块
 支持多个AI厂商的统一接口
+具体提供商模块由AIProviderFactory按需导入
 """
 
 from .base import BaseAIProvider
-from .qianwen_provider import QianwenProvider
 from .factory import AIProviderFactory
 
 __all__ = [
@@ -14,3 +14,11 @@ __all__ = [
     'QianwenProvider',
     'AIProviderFactory'
 ]
+
+
+def __getattr__(name):
+    """延迟导出具体提供商类，避免导入包时加载所有提供商模块"""
+    if name == 'QianwenProvider':
+        from .qianwen_provider import QianwenProvider
+        return QianwenProvider
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
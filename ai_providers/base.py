@@ -17,6 +17,8 @@ class AIMessage:
     timestamp: float
     image_data: Optional[str] = None  # Base64编码的图片数据
     image_type: Optional[str] = None  # 图片类型 (jpeg, png, gif)
+    image_id: Optional[str] = None  # 图片ID（图片内容的SHA-256），只有图片ID时提供商通过image_loader读取图片
+    image_bytes: Optional[bytes] = None  # 图片原始字节，发送给提供商时再编码为Base64
 
 @dataclass
 class AIResponse:
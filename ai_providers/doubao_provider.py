@@ -7,6 +7,7 @@ Doubao提供商实现
 支持文生图功能
 """
 
+import asyncio
 import logging
 from .openai_compatible_provider import OpenAICompatibleProvider
 from .base import ImageGenerationRequest, ImageGenerationResponse
@@ -63,14 +64,14 @@ class DoubaoProvider(OpenAICompatibleProvider):
             # 如果提供了输入图片URL，则为图片生成图片模式
             if request.image_data:
                 image_params['extra_body']['image'] = f"data:image/{request.image_type};base64,{request.image_data}"
-                logger.info(f"Doubao图片生成图片模式 - 输入图片: {request.image_data}")
+                logger.info("Doubao图片生成图片模式 - 输入图片Base64长度: %d", len(request.image_data))
             else:
                 logger.info("Doubao纯文本生成图片模式")
 
             logger.info(f"调用Doubao图片生成API - 模型: {self.IMAGE_GENERATION_MODEL}, 提示词: {request.prompt[:50]}...")
 
-            # 调用豆包图片生成API
-            response = self.client.images.generate(**image_params)
+            # 调用豆包图片生成API（同步SDK调用耗时较长，放到线程中执行避免阻塞事件循环）
+            response = await asyncio.to_thread(self.client.images.generate, **image_params)
 
             # 构建响应对象
             if response.data and len(response.data) > 0:
@@ -6,66 +6,102 @@ AI提供商工厂类
 """
 
 import logging
-import inspect
 import importlib
-import pkgutil
-from typing import Dict, Any, Optional, List, Type
+from importlib import metadata
+from typing import Dict, Any, Iterable, Mapping, Optional, List, Type
 
+from metrics import PROVIDER_FALLBACKS
+from tracing import start_span
 from .base import BaseAIProvider
-from .openai_compatible_provider import OpenAICompatibleProvider
 
 logger = logging.getLogger(__name__)
 
+# 内置提供商注册表：提供商名称 -> "模块路径:类名"
+# 只在首次使用某个提供商时才导入对应模块
+PROVIDER_REGISTRY: Dict[str, str] = {
+    'openai': 'ai_providers.openai_provider:OpenAIProvider',
+    'deepseek': 'ai_providers.deepseek_provider:DeepseekProvider',
+    'qianwen': 'ai_providers.qianwen_provider:QianwenProvider',
+    'doubao': 'ai_providers.doubao_provider:DoubaoProvider',
+    'kimi': 'ai_providers.kimi_provider:KimiProvider',
+}
+
+# 第三方提供商的entry point分组，值格式同样为 "模块路径:类名"
+PROVIDER_ENTRY_POINT_GROUP = 'fastapi_ai_chat.providers'
+
+
+def _iter_provider_entry_points():
+    """获取第三方提供商entry point（只读取包元数据，不导入模块）"""
+    try:
+        return metadata.entry_points(group=PROVIDER_ENTRY_POINT_GROUP)
+    except TypeError:
+        # Python 3.8/3.9 不支持group参数
+        return metadata.entry_points().get(PROVIDER_ENTRY_POINT_GROUP, [])
+
 
 class AIProviderFactory:
     """AI提供商工厂类"""
 
     # 提供商实例缓存
     _instances: Dict[str, BaseAIProvider] = {}
-    # 动态发现的提供商类缓存
-    _discovered_providers: Optional[Dict[str, Type[BaseAIProvider]]] = None
+    # 提供商注册表缓存（内置 + entry point），名称 -> "模块路径:类名"
+    _registry: Optional[Dict[str, str]] = None
+    # 已导入的提供商类缓存
+    _provider_classes: Dict[str, Type[BaseAIProvider]] = {}
 
     @classmethod
-    def _discover_providers(cls) -> Dict[str, Type[BaseAIProvider]]:
+    def _get_registry(cls) -> Dict[str, str]:
         """
-        动态发现所有OpenAICompatibleProvider的子类
-        
+        获取提供商注册表，首次调用时合并内置注册表和第三方entry point
+
+        Returns:
+            Dict[str, str]: 提供商名称到 "模块路径:类名" 的映射
+        """
+        if cls._registry is not None:
+            return cls._registry
+
+        registry = dict(PROVIDER_REGISTRY)
+        try:
+            for entry_point in _iter_provider_entry_points():
+                registry[entry_point.name.lower()] = entry_point.value
+                logger.debug(f"发现第三方提供商: {entry_point.name} -> {entry_point.value}")
+        except Exception as e:
+            logger.warning(f"读取第三方提供商entry point失败: {e}")
+
+        cls._registry = registry
+        return registry
+
+    @classmethod
+    def _get_provider_class(cls, provider_name: str) -> Type[BaseAIProvider]:
+        """
+        按需导入并返回提供商类
+
+        Args:
+            provider_name: 提供商名称（小写）
+
         Returns:
-            Dict[str, Type[BaseAIProvider]]: 提供商名称到类的映射
-        """
-        if cls._discovered_providers is not None:
-            return cls._discovered_providers
-            
-        providers = {}
-        
-        # 获取当前包的路径
-        import ai_providers
-        package_path = ai_providers.__path__
-        
-        # 遍历包中的所有模块
-        for importer, modname, ispkg in pkgutil.iter_modules(package_path):
-            if modname.endswith('_provider') and modname != 'openai_compatible_provider':
-                try:
-                    # 动态导入模块
-                    module = importlib.import_module(f'ai_providers.{modname}')
-                    
-                    # 查找模块中所有继承自OpenAICompatibleProvider的类
-                    for name, obj in inspect.getmembers(module, inspect.isclass):
-                        if (issubclass(obj, OpenAICompatibleProvider) and 
-                            obj != OpenAICompatibleProvider and
-                            hasattr(obj, 'PROVIDER_NAME')):
-                            
-                            # 使用类名去掉Provider后缀作为提供商名称
-                            provider_key = name.lower().replace('provider', '')
-                            providers[provider_key] = obj
-                            logger.debug(f"发现提供商: {provider_key} -> {name}")
-                            
-                except Exception as e:
-                    logger.warning(f"导入模块 {modname} 时出错: {e}")
-                    
-        cls._discovered_providers = providers
-        logger.info(f"动态发现 {len(providers)} 个提供商: {list(providers.keys())}")
-        return providers
+            Type[BaseAIProvider]: 提供商类
+
+        Raises:
+            ValueError: 当提供商不存在或不是BaseAIProvider子类时
+        """
+        if provider_name in cls._provider_classes:
+            return cls._provider_classes[provider_name]
+
+        registry = cls._get_registry()
+        if provider_name not in registry:
+            raise ValueError(f"未知的AI提供商: {provider_name}，可用提供商: {list(registry.keys())}")
+
+        module_path, _, class_name = registry[provider_name].partition(':')
+        module = importlib.import_module(module_path)
+        provider_class = getattr(module, class_name)
+
+        if not (isinstance(provider_class, type) and issubclass(provider_class, BaseAIProvider)):
+            raise ValueError(f"提供商类必须继承BaseAIProvider: {registry[provider_name]}")
+
+        cls._provider_classes[provider_name] = provider_class
+        logger.debug(f"加载提供商: {provider_name} -> {class_name}")
+        return provider_class
 
     @classmethod
     def create_provider(cls, provider_name: str, config: Dict[str, Any]) -> BaseAIProvider:
@@ -83,10 +119,7 @@ class AIProviderFactory:
             ValueError: 当提供商不存在时
         """
         provider_name = provider_name.lower()
-        providers = cls._discover_providers()
-
-        if provider_name not in providers:
-            raise ValueError(f"未知的AI提供商: {provider_name}，可用提供商: {list(providers.keys())}")
+        provider_class = cls._get_provider_class(provider_name)
 
         # 检查是否已有实例
         cache_key = f"{provider_name}_{hash(str(sorted(config.items())))}"
@@ -96,7 +129,6 @@ class AIProviderFactory:
 
         try:
             # 创建新实例
-            provider_class = providers[provider_name]
             provider_instance = provider_class(config)
 
             # 缓存实例
@@ -116,8 +148,7 @@ class AIProviderFactory:
         Returns:
             List[str]: 可用提供商名称列表
         """
-        providers = cls._discover_providers()
-        return list(providers.keys())
+        return list(cls._get_registry().keys())
 
     @classmethod
     def register_provider(cls, name: str, provider_class: type):
@@ -131,11 +162,9 @@ class AIProviderFactory:
         if not issubclass(provider_class, BaseAIProvider):
             raise ValueError(f"提供商类必须继承BaseAIProvider")
 
-        # 确保已发现的提供商字典已初始化
-        if cls._discovered_providers is None:
-            cls._discover_providers()
-        
-        cls._discovered_providers[name.lower()] = provider_class
+        name = name.lower()
+        cls._get_registry()[name] = f"{provider_class.__module__}:{provider_class.__qualname__}"
+        cls._provider_classes[name] = provider_class
         logger.info(f"注册新的AI提供商: {name}")
 
     @classmethod
@@ -146,6 +175,23 @@ class AIProviderFactory:
         cls._instances.clear()
         logger.info("AI提供商实例缓存已清除")
 
+    @classmethod
+    def remove_instances(cls, instances: Iterable[BaseAIProvider]) -> int:
+        """
+        从实例缓存中移除指定的提供商实例（重新加载配置后被替换的实例，避免缓存一直持有旧实例）
+
+        Args:
+            instances: 要移除的提供商实例
+
+        Returns:
+            int: 移除的缓存条目数
+        """
+        targets = {id(instance) for instance in instances}
+        stale_keys = [key for key, instance in cls._instances.items() if id(instance) in targets]
+        for key in stale_keys:
+            del cls._instances[key]
+        return len(stale_keys)
+
     @classmethod
     def get_provider_info(cls, provider_name: str) -> Dict[str, Any]:
         """
@@ -158,12 +204,10 @@ class AIProviderFactory:
             Dict[str, Any]: 提供商信息字典，包含名称、模型等
         """
         provider_name = provider_name.lower()
-        providers = cls._discover_providers()
-
-        if provider_name not in providers:
+        if provider_name not in cls._get_registry():
             return {}
 
-        provider_class = providers[provider_name]
+        provider_class = cls._get_provider_class(provider_name)
 
         return {
             'name': provider_name,
@@ -190,27 +234,36 @@ class AIProviderFactory:
 class MultiProviderManager:
     """多提供商管理器"""
 
-    def __init__(self, configs: Dict[str, Dict[str, Any]]):
+    def __init__(self, configs: Mapping[str, Mapping[str, Any]], existing: Optional[Dict[str, BaseAIProvider]] = None):
         """
         初始化多提供商管理器
 
         Args:
             configs: 多个提供商的配置字典
+            existing: 重新加载配置时原管理器中的提供商，配置未变化的直接复用（保留客户端连接池和缓存）
         """
         self.providers: Dict[str, BaseAIProvider] = {}
         self.default_provider: Optional[str] = None
+        existing = existing or {}
 
-        # 初始化所有提供商
+        # 初始化所有提供商（配置中的provider字段可指定实际创建的提供商类型，如replay）
         for provider_name, config in configs.items():
             try:
-                provider = AIProviderFactory.create_provider(provider_name, config)
+                reused = existing.get(provider_name)
+                if reused is not None and reused.config == config:
+                    provider = reused
+                else:
+                    provider = AIProviderFactory.create_provider(config.get('provider', provider_name), config)
                 self.providers[provider_name] = provider
 
                 # 设置第一个成功初始化的提供商为默认提供商
                 if self.default_provider is None:
                     self.default_provider = provider_name
 
-                logger.info(f"多提供商管理器: {provider_name}提供商初始化成功")
+                if provider is reused:
+                    logger.info(f"多提供商管理器: {provider_name}提供商配置未变化，复用原实例")
+                else:
+                    logger.info(f"多提供商管理器: {provider_name}提供商初始化成功")
 
             except Exception as e:
                 logger.warning(f"多提供商管理器: {provider_name}提供商初始化失败: {e}")
@@ -306,12 +359,16 @@ class MultiProviderManager:
 
         # 依次尝试提供商
         last_error = None
+        failed_provider = None
         for provider_name in providers_to_try:
+            if failed_provider:
+                PROVIDER_FALLBACKS.labels(from_provider=failed_provider, to_provider=provider_name).inc()
             try:
                 provider = self.providers[provider_name]
                 logger.info(f"尝试使用{provider_name}提供商生成响应")
 
-                response = await provider.generate_response(messages, **kwargs)
+                with start_span("ai_manager.attempt", provider=provider_name, fallback=failed_provider is not None):
+                    response = await provider.generate_response(messages, **kwargs)
 
                 # 检查响应是否成功
                 if response.finish_reason != 'error':
@@ -319,16 +376,48 @@ class MultiProviderManager:
                     return response
                 else:
                     logger.warning(f"{provider_name}提供商返回错误响应，尝试下一个提供商")
+                    failed_provider = provider_name
 
             except Exception as e:
                 logger.warning(f"{provider_name}提供商生成响应失败: {e}")
                 last_error = e
+                failed_provider = provider_name
                 continue
 
         # 所有提供商都失败
         logger.error(f"所有AI提供商都无法生成响应，最后错误: {last_error}")
         raise Exception(f"所有AI提供商都无法生成响应: {last_error}")
 
+    async def generate_response(
+            self,
+            messages: List,
+            provider: str = None,
+            model: str = None,
+            **kwargs
+    ):
+        """
+        使用指定提供商生成响应（不回退到其他提供商，指定的模型只对该提供商有效）
+
+        Args:
+            messages: 消息列表
+            provider: 指定提供商
+            model: 指定模型
+            **kwargs: 其他参数
+
+        Returns:
+            响应结果
+        """
+        provider_name = provider if provider and provider in self.providers else self.default_provider
+
+        if not provider_name or provider_name not in self.providers:
+            raise Exception("没有可用的AI提供商")
+
+        if model:
+            kwargs['model'] = model
+
+        with start_span("ai_manager.generate", provider=provider_name, model=model or "default"):
+            return await self.providers[provider_name].generate_response(messages, **kwargs)
+
     async def generate_streaming_response(
             self,
             messages: List,
@@ -355,18 +444,19 @@ class MultiProviderManager:
             raise Exception("没有可用的AI提供商")
 
         provider_instance = self.providers[provider_name]
-        logger.info(f"使用{provider_name}提供商生成流式响应，模型: {model or '默认'}")
+        logger.info("使用%s提供商生成流式响应，模型: %s", provider_name, model or '默认')
 
         # 如果指定了模型，添加到kwargs中
         if model:
             kwargs['model'] = model
 
-        try:
-            async for chunk in provider_instance.generate_streaming_response(messages, **kwargs):
-                yield chunk
-        except Exception as e:
-            logger.error(f"{provider_name}提供商生成流式响应失败: {e}")
-            raise
+        with start_span("ai_manager.stream", provider=provider_name, model=model or "default"):
+            try:
+                async for chunk in provider_instance.generate_streaming_response(messages, **kwargs):
+                    yield chunk
+            except Exception as e:
+                logger.error(f"{provider_name}提供商生成流式响应失败: {e}")
+                raise
 
     def get_provider_status(self) -> Dict[str, Dict[str, Any]]:
         """
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+视觉图片预处理模块
+发送给视觉模型前将图片缩放到提供商可用的最大分辨率、重新编码并去除元数据，
+处理在进程池中执行，结果按图片哈希缓存，多轮对话中同一张图片只处理一次
+"""
+
+import asyncio
+import base64
+import hashlib
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 默认进程池大小与缓存条目数
+DEFAULT_MAX_WORKERS = 2
+DEFAULT_CACHE_SIZE = 128
+
+
+def preprocess_image_data(image_bytes: bytes, max_dimension: int, quality: int) -> Tuple[str, str]:
+    """
+    缩放并重新编码图片（同步函数，在子进程中执行）
+
+    重新编码只保留像素数据，EXIF等元数据会被去除；
+    带透明通道的图片编码为PNG，其余编码为JPEG
+
+    Args:
+        image_bytes: 原始图片字节
+        max_dimension: 最长边的最大像素数
+        quality: JPEG质量
+
+    Returns:
+        Tuple[str, str]: Base64编码的处理后图片和MIME类型
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(BytesIO(image_bytes)) as source:
+        # 元数据会被去除，先按EXIF方向旋转图片
+        image = ImageOps.exif_transpose(source)
+        if max(image.size) > max_dimension:
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        output = BytesIO()
+        if has_alpha:
+            image.save(output, format='PNG', optimize=True)
+            mime_type = 'image/png'
+        else:
+            image.convert('RGB').save(output, format='JPEG', quality=quality, optimize=True)
+            mime_type = 'image/jpeg'
+
+    return base64.b64encode(output.getvalue()).decode('ascii'), mime_type
+
+
+class ImagePreprocessor:
+    """图片预处理器：进程池执行 + 按图片哈希的LRU缓存"""
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS, cache_size: int = DEFAULT_CACHE_SIZE):
+        """
+        初始化图片预处理器
+
+        Args:
+            max_workers: 进程池大小
+            cache_size: 缓存的处理结果条目数
+        """
+        self.max_workers = max_workers
+        self.cache_size = cache_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._cache: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """获取进程池（首次使用时创建，使用spawn避免fork带走事件循环和连接状态）"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    @staticmethod
+    def _cache_key(image_bytes: bytes, image_id: Optional[str], max_dimension: int, quality: int) -> str:
+        # 图片ID本身就是内容哈希，已知时无需再次计算
+        digest = image_id or hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+        return f"{digest}:{max_dimension}:{quality}"
+
+    async def process(
+        self,
+        image_bytes: bytes,
+        image_type: Optional[str],
+        max_dimension: int,
+        quality: int,
+        image_id: Optional[str] = None
+    ) -> Tuple[str, str]:
+        """
+        预处理图片，命中缓存时直接返回
+
+        Args:
+            image_bytes: 原始图片字节
+            image_type: 原始图片MIME类型
+            max_dimension: 最长边的最大像素数
+            quality: JPEG质量
+            image_id: 图片ID（内容哈希），用作缓存键
+
+        Returns:
+            Tuple[str, str]: Base64编码的图片和MIME类型，处理失败时返回原图
+        """
+        key = self._cache_key(image_bytes, image_id, max_dimension, quality)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            return cached
+
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(
+                self._get_executor(), preprocess_image_data, image_bytes, max_dimension, quality
+            )
+        except BrokenProcessPool as e:
+            # 子进程异常退出后进程池不可再用，丢弃后下次重新创建
+            logger.warning(f"图片预处理进程池不可用，使用原图: {e}")
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            return base64.b64encode(image_bytes).decode('ascii'), image_type
+        except Exception as e:
+            logger.warning(f"图片预处理失败，使用原图: {e}")
+            return base64.b64encode(image_bytes).decode('ascii'), image_type
+
+        logger.debug(f"图片预处理完成 - 原始大小: {len(image_bytes)}, 处理后Base64大小: {len(result[0])}")
+        self._cache[key] = result
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def shutdown(self):
+        """关闭进程池并清空缓存"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._cache.clear()
+
+
+# 全局图片预处理器
+_preprocessor: Optional[ImagePreprocessor] = None
+
+
+def get_image_preprocessor() -> ImagePreprocessor:
+    """获取全局图片预处理器"""
+    global _preprocessor
+    if _preprocessor is None:
+        _preprocessor = ImagePreprocessor()
+    return _preprocessor
+
+
+def configure_image_preprocessor(max_workers: int, cache_size: int) -> ImagePreprocessor:
+    """
+    按应用配置重建全局图片预处理器
+
+    Args:
+        max_workers: 进程池大小
+        cache_size: 缓存条目数
+
+    Returns:
+        ImagePreprocessor: 新的全局图片预处理器
+    """
+    global _preprocessor
+    if _preprocessor is not None:
+        _preprocessor.shutdown()
+    _preprocessor = ImagePreprocessor(max_workers=max_workers, cache_size=cache_size)
+    return _preprocessor
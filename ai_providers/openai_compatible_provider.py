@@ -6,10 +6,15 @@ OpenAI兼容提供商基类
 消除重复代码，简化配置
 """
 
+import base64
+import hashlib
 import logging
-from typing import List, Dict, Any, AsyncGenerator
-from openai import OpenAI
+from collections import OrderedDict
+from dataclasses import replace
+from typing import List, Dict, Any, AsyncGenerator, Awaitable, Callable, Optional, Tuple
+from tracing import get_current_span, start_span
 from .base import BaseAIProvider, AIMessage, AIResponse
+from .image_preprocessor import get_image_preprocessor
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +29,12 @@ class OpenAICompatibleProvider(BaseAIProvider):
     DEFAULT_MODEL = None
     PROVIDER_NAME = None
     AVAILABLE_MODELS = []
+    # 视觉模型可用的最大图片边长（像素），超过时发送前缩放
+    MAX_IMAGE_DIMENSION = 2048
+    # 图片重新编码为JPEG时的质量
+    IMAGE_QUALITY = 85
+    # 缓存的多模态消息格式化结果条目数（每条持有预处理后的图片Base64和拼接好的data URL）
+    MESSAGE_CACHE_SIZE = 64
 
     def __init__(self, config: Dict[str, Any]):
         """
@@ -34,6 +45,11 @@ class OpenAICompatibleProvider(BaseAIProvider):
         """
         super().__init__(config)
         self.client = None
+        # 对话请求使用异步客户端，流式响应不阻塞事件循环；同步客户端保留给图片生成等接口
+        self.async_client = None
+        # 多模态消息的格式化结果: 消息键 -> 请求中的消息字典，跨轮次复用
+        self._message_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._message_cache_size = self.get_config_value('message_cache_size') or self.MESSAGE_CACHE_SIZE
         self._initialize_client()
 
     def _initialize_client(self):
@@ -47,14 +63,22 @@ class OpenAICompatibleProvider(BaseAIProvider):
                 self.client = None
                 return
 
+            # openai SDK导入较慢，在创建客户端时再导入
+            from openai import AsyncOpenAI, OpenAI
+
             self.client = OpenAI(
                 api_key=api_key,
                 base_url=self.get_config_value('base_url', self.DEFAULT_BASE_URL)
             )
+            self.async_client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=self.get_config_value('base_url', self.DEFAULT_BASE_URL)
+            )
             logger.info(f"{self.get_provider_display_name()}客户端初始化成功 - 基础URL: {self.get_config_value('base_url', self.DEFAULT_BASE_URL)}")
         except Exception as e:
             logger.error(f"{self.get_provider_display_name()}客户端初始化失败: {e}")
             self.client = None
+            self.async_client = None
 
     def get_provider_display_name(self) -> str:
         """
@@ -77,32 +101,31 @@ class OpenAICompatibleProvider(BaseAIProvider):
             AIResponse: AI响应对象
         """
         try:
-            # 格式化消息
+            # 预处理图片并格式化消息
+            with start_span("provider.preprocess_images", provider=self.provider_name):
+                messages = await self.preprocess_images(messages, kwargs.get('image_loader'))
             system_prompt = kwargs.get('system_prompt')
             formatted_messages = self.format_messages(messages, system_prompt)
 
             # 构建请求参数
             request_params = self._build_request_params(formatted_messages, **kwargs)
 
-            logger.info(f"调用{self.get_provider_display_name()}API - 模型: {request_params['model']}, 消息数: {len(formatted_messages)}")
+            logger.info("调用%sAPI - 模型: %s, 消息数: %d", self.get_provider_display_name(), request_params['model'], len(formatted_messages))
 
             # 调用API
-            response = self.client.chat.completions.create(**request_params)
+            with start_span("provider.request", provider=self.provider_name, model=request_params['model']):
+                response = await self.async_client.chat.completions.create(**request_params)
 
             # 构建响应对象
             ai_response = AIResponse(
                 content=response.choices[0].message.content,
                 model=response.model,
                 provider=self.provider_name,
-                usage={
-                    'prompt_tokens': response.usage.prompt_tokens if response.usage else 0,
-                    'completion_tokens': response.usage.completion_tokens if response.usage else 0,
-                    'total_tokens': response.usage.total_tokens if response.usage else 0
-                },
+                usage=self._parse_usage(response.usage),
                 finish_reason=response.choices[0].finish_reason
             )
 
-            logger.info(f"{self.get_provider_display_name()}响应生成成功 - 响应长度: {len(ai_response.content)}")
+            logger.info("%s响应生成成功 - 响应长度: %d", self.get_provider_display_name(), len(ai_response.content))
             return ai_response
 
         except Exception as e:
@@ -130,42 +153,175 @@ class OpenAICompatibleProvider(BaseAIProvider):
             str: 流式响应内容片段
         """
         try:
-            # 格式化消息
+            # 预处理图片并格式化消息
+            with start_span("provider.preprocess_images", provider=self.provider_name):
+                messages = await self.preprocess_images(messages, kwargs.get('image_loader'))
             system_prompt = kwargs.get('system_prompt')
             formatted_messages = self.format_messages(messages, system_prompt)
 
             # 构建请求参数
             request_params = self._build_request_params(formatted_messages, stream=True, **kwargs)
 
-            logger.info(f"调用{self.get_provider_display_name()}流式API - 模型: {request_params['model']}, 消息数: {len(formatted_messages)}")
+            logger.info("调用%s流式API - 模型: %s, 消息数: %d", self.get_provider_display_name(), request_params['model'], len(formatted_messages))
 
-            # 调用流式API
-            response = self.client.chat.completions.create(**request_params)
+            # 调用流式API（返回时已建立连接并收到响应头）
+            with start_span("provider.connect", provider=self.provider_name, model=request_params['model']):
+                response = await self.async_client.chat.completions.create(**request_params)
 
+            # 首个片段事件记录在调用方（MultiProviderManager）的span上
+            stream_span = get_current_span()
             chunk_count = 0
+            usage = None
             import json
-            for chunk in response:
-                if hasattr(chunk.choices[0].delta, 'reasoning_content') and chunk.choices[0].delta.reasoning_content:
-                    content = chunk.choices[0].delta.reasoning_content
-                    chunk_count += 1
-                    # 返回带类型标识的数据，区分深度思考内容
-                    yield f"data: {json.dumps({'type': 'reasoning', 'content': content})}\n\n"
-                elif hasattr(chunk.choices[0].delta, 'content') and chunk.choices[0].delta.content:
-                    content = chunk.choices[0].delta.content
-                    chunk_count += 1
-                    # 返回带类型标识的数据，区分普通内容
-                    yield f"data: {json.dumps({'type': 'content', 'content': content})}\n\n"
-
-            logger.info(f"{self.get_provider_display_name()}流式响应完成 - 块数: {chunk_count}")
+            # 调用方提前结束（客户端断开或取消）时关闭上游连接
+            async with response:
+                async for chunk in response:
+                    if chunk_count == 0 and stream_span is not None:
+                        stream_span.add_event("provider_first_chunk")
+                    # 用量在最后一个片段中返回（include_usage时该片段choices为空，Kimi放在choice中）
+                    chunk_usage = chunk.usage or (getattr(chunk.choices[0], 'usage', None) if chunk.choices else None)
+                    if chunk_usage:
+                        usage = self._parse_usage(chunk_usage)
+                    if not chunk.choices:
+                        continue
+                    if hasattr(chunk.choices[0].delta, 'reasoning_content') and chunk.choices[0].delta.reasoning_content:
+                        content = chunk.choices[0].delta.reasoning_content
+                        chunk_count += 1
+                        # 返回带类型标识的数据，区分深度思考内容
+                        yield f"data: {json.dumps({'type': 'reasoning', 'content': content})}\n\n"
+                    elif hasattr(chunk.choices[0].delta, 'content') and chunk.choices[0].delta.content:
+                        content = chunk.choices[0].delta.content
+                        chunk_count += 1
+                        # 返回带类型标识的数据，区分普通内容
+                        yield f"data: {json.dumps({'type': 'content', 'content': content})}\n\n"
+
+            if usage:
+                yield f"data: {json.dumps({'type': 'usage', 'usage': usage})}\n\n"
+
+            logger.info("%s流式响应完成 - 块数: %d", self.get_provider_display_name(), chunk_count)
 
         except Exception as e:
             logger.error(f"{self.get_provider_display_name()}流式响应失败: {e}")
+            stream_span = get_current_span()
+            if stream_span is not None:
+                stream_span.record_exception(e)
             yield f"抱歉，{self.get_provider_display_name()}流式服务暂时不可用：{str(e)}\n\n"
 
+    @staticmethod
+    def _message_cache_key(msg: AIMessage) -> Optional[str]:
+        """
+        计算多模态消息的缓存键，纯文本消息返回None
+
+        图片ID本身是内容哈希；历史中以Base64保存、没有图片ID的图片以消息时间戳和数据长度标识，
+        避免每轮重新哈希整张图片
+
+        Args:
+            msg: 消息
+
+        Returns:
+            Optional[str]: 缓存键
+        """
+        if msg.image_id:
+            image_key = msg.image_id
+        elif msg.image_data or msg.image_bytes:
+            image_key = f"{msg.timestamp}:{len(msg.image_data or msg.image_bytes)}"
+        else:
+            return None
+        return hashlib.blake2b(f"{msg.role}\0{image_key}\0{msg.content}".encode('utf-8'), digest_size=16).hexdigest()
+
+    async def preprocess_images(
+        self,
+        messages: List[AIMessage],
+        image_loader: Optional[Callable[[str], Awaitable[Optional[bytes]]]] = None
+    ) -> List[AIMessage]:
+        """
+        缩放、重新编码消息中的图片，减小发送给视觉模型的请求体
+
+        格式化结果已缓存的消息不再读取和处理图片，直接从缓存取出处理后的图片数据带在消息上
+        （格式化前缓存项可能已被并发请求淘汰，不能依赖它届时仍在缓存中），每轮只处理新增的图片消息
+
+        Args:
+            messages: 消息列表
+            image_loader: 按图片ID读取原始字节的协程函数，用于只带图片ID的消息
+
+        Returns:
+            List[AIMessage]: 图片已预处理的消息列表（原消息对象不会被修改）
+        """
+        if not any(msg.image_bytes or msg.image_data or msg.image_id for msg in messages):
+            return messages
+
+        preprocessor = get_image_preprocessor()
+        max_dimension = self.get_config_value('image_max_dimension') or self.MAX_IMAGE_DIMENSION
+        processed_messages = []
+        for msg in messages:
+            key = self._message_cache_key(msg)
+            cached = self._message_cache.get(key) if key is not None else None
+            if cached is not None:
+                self._message_cache.move_to_end(key)
+                image_data, image_type = self._split_image_url(cached)
+                msg = replace(msg, image_data=image_data, image_type=image_type, image_bytes=None)
+            elif key is not None:
+                # 兼容历史消息中以Base64保存的图片
+                if msg.image_bytes:
+                    image_bytes = msg.image_bytes
+                elif msg.image_data:
+                    image_bytes = base64.b64decode(msg.image_data)
+                else:
+                    image_bytes = await image_loader(msg.image_id) if image_loader else None
+                if image_bytes:
+                    image_data, image_type = await preprocessor.process(
+                        image_bytes, msg.image_type, max_dimension, self.IMAGE_QUALITY, image_id=msg.image_id
+                    )
+                    msg = replace(msg, image_data=image_data, image_type=image_type, image_bytes=None)
+            processed_messages.append(msg)
+        return processed_messages
+
+    @staticmethod
+    def _split_image_url(formatted: Dict[str, Any]) -> Tuple[str, str]:
+        """从缓存的格式化消息中取回图片数据和类型（data:{类型};base64,{数据}）"""
+        url = formatted["content"][0]["image_url"]["url"]
+        header, _, image_data = url.partition(",")
+        return image_data, header[len("data:"):-len(";base64")]
+
+    def _format_message(self, msg: AIMessage) -> Dict[str, Any]:
+        """格式化带图片的消息，结果按消息键缓存"""
+        key = self._message_cache_key(msg)
+        cached = self._message_cache.get(key)
+        if cached is not None:
+            self._message_cache.move_to_end(key)
+            return cached
+        if not msg.image_data:
+            # 图片已过期或读取失败，只发送文本，不缓存以便图片恢复后重新处理
+            return {"role": msg.role, "content": msg.content}
+
+        formatted = {
+            "role": msg.role,
+            "content": [
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{msg.image_type};base64,{msg.image_data}"
+                    }
+                },
+                {
+                    "type": "text",
+                    "text": msg.content
+                },
+            ]
+        }
+        self._message_cache[key] = formatted
+        while len(self._message_cache) > self._message_cache_size:
+            self._message_cache.popitem(last=False)
+        return formatted
+
     def format_messages(self, messages: List[AIMessage], system_prompt: str = None) -> List[Dict[str, Any]]:
         """
         格式化消息为提供商特定格式，支持多模态内容
 
+        相同的输入总是生成字节相同的请求体（系统提示在最前，历史消息按原顺序且字段顺序固定），
+        使提供商的提示词前缀缓存可以命中。多模态消息的格式化结果（含拼接好的data URL）跨轮次复用，
+        返回的消息字典可能被多次请求共享，调用方不应修改
+
         Args:
             messages: 消息列表
             system_prompt: 系统提示词
@@ -185,25 +341,8 @@ class OpenAICompatibleProvider(BaseAIProvider):
         # 添加历史消息
         for msg in messages:
             if msg.role in ["user", "assistant"]:
-                # 检查是否包含图片数据
-                if msg.image_data:
-                    # 多模态消息格式
-                    content = [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:{msg.image_type};base64,{msg.image_data}"
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": msg.content
-                        },
-                    ]
-                    formatted_messages.append({
-                        "role": msg.role,
-                        "content": content
-                    })
+                if msg.image_id or msg.image_data or msg.image_bytes:
+                    formatted_messages.append(self._format_message(msg))
                 else:
                     # 纯文本消息格式
                     formatted_messages.append({
@@ -235,9 +374,44 @@ class OpenAICompatibleProvider(BaseAIProvider):
 
         if stream:
             request_params['stream'] = True
+            # 流式响应默认不返回用量，需要单独请求
+            request_params['stream_options'] = {'include_usage': True}
 
         return request_params
 
+    @staticmethod
+    def _parse_usage(usage: Any) -> Dict[str, int]:
+        """
+        解析用量，统一提取各提供商的前缀缓存命中token数
+
+        DeepSeek返回prompt_cache_hit_tokens，OpenAI/通义千问/豆包返回prompt_tokens_details.cached_tokens，
+        Kimi返回cached_tokens
+
+        Args:
+            usage: SDK返回的用量对象或字典，可能为None
+
+        Returns:
+            Dict[str, int]: prompt_tokens、completion_tokens、total_tokens、cached_tokens
+        """
+        def field(obj: Any, name: str) -> Any:
+            # SDK未声明的字段（如Kimi choice中的usage）以dict形式保留
+            if obj is None:
+                return None
+            return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+        cached_tokens = field(usage, 'prompt_cache_hit_tokens')
+        if cached_tokens is None:
+            cached_tokens = field(field(usage, 'prompt_tokens_details'), 'cached_tokens')
+        if cached_tokens is None:
+            cached_tokens = field(usage, 'cached_tokens')
+
+        return {
+            'prompt_tokens': field(usage, 'prompt_tokens') or 0,
+            'completion_tokens': field(usage, 'completion_tokens') or 0,
+            'total_tokens': field(usage, 'total_tokens') or 0,
+            'cached_tokens': cached_tokens or 0
+        }
+
     def generate_image(self, request: 'ImageGenerationRequest') -> 'ImageGenerationResponse':
         """
         生成图片（默认实现，子类需要重写）
@@ -283,5 +457,6 @@ class OpenAICompatibleProvider(BaseAIProvider):
         Returns:
             List[str]: 可用模型列表
         """
-        logger.info(f"获取{self.get_provider_display_name()}可用模型成功 - 模型数: {len(self.AVAILABLE_MODELS)}")
+        # 每次请求/providers都会调用，只在DEBUG级别记录
+        logger.debug("获取%s可用模型成功 - 模型数: %d", self.get_provider_display_name(), len(self.AVAILABLE_MODELS))
         return self.AVAILABLE_MODELS.copy()
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+录制/回放提供商
+在OpenAI SDK客户端这一层录制和回放：实例由真实提供商类派生，消息格式化、图片预处理、
+消息缓存和SDK片段解析都照常执行，只把 async_client / client 换成读写夹具的客户端。
+录制模式下转发给真实客户端，把SDK返回的对象及其间隔写入夹具文件；
+回放模式下从夹具文件还原SDK对象，按原始间隔或缩放后的间隔返回，无需网络即可复现线上的延迟特征
+
+通过 AIProviderFactory.register_provider('replay', ReplayProvider) 注册后使用
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from functools import partial
+from types import SimpleNamespace
+from typing import List, Dict, Any, Callable, Optional, Type
+
+from .openai_compatible_provider import OpenAICompatibleProvider
+
+logger = logging.getLogger(__name__)
+
+# 夹具文件格式版本（2: 记录SDK返回的对象，而不是提供商输出的SSE片段）
+FIXTURE_VERSION = 2
+
+# 真实提供商类 -> 派生的录制/回放类
+_REPLAY_CLASSES: Dict[type, type] = {}
+
+
+def _fixture_request(value: Any) -> Any:
+    """把请求参数转换为可JSON序列化的内容，data URL（Base64图片）以摘要代替，避免夹具文件过大"""
+    if isinstance(value, str) and value.startswith('data:'):
+        return f"data:sha256:{hashlib.sha256(value.encode('utf-8')).hexdigest()[:16]}"
+    if isinstance(value, dict):
+        return {key: _fixture_request(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_fixture_request(item) for item in value]
+    return value
+
+
+class _RecordingStream:
+    """包装SDK流式响应：转发片段的同时记录片段内容和间隔，完整读完后回调写入夹具"""
+
+    def __init__(self, stream: Any, on_complete: Callable[[List[List[Any]]], None]):
+        self._stream = stream
+        self._iterator = stream.__aiter__()
+        self._on_complete = on_complete
+        self._chunks: List[List[Any]] = []
+        self._last = time.perf_counter()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._stream.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            chunk = await self._iterator.__anext__()
+        except StopAsyncIteration:
+            self._on_complete(self._chunks)
+            raise
+        # 每个片段记录距上一个片段的间隔（毫秒），第一个片段从收到响应头开始计算
+        now = time.perf_counter()
+        self._chunks.append([round((now - self._last) * 1000, 3), chunk.to_dict()])
+        self._last = now
+        return chunk
+
+
+class _ReplayStream:
+    """按夹具中的间隔逐个还原SDK流式片段"""
+
+    def __init__(self, chunks: List[List[Any]], sleep: Callable[[float], Any]):
+        self._chunks = iter(chunks)
+        self._sleep = sleep
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        from openai.types.chat import ChatCompletionChunk
+
+        try:
+            delay_ms, data = next(self._chunks)
+        except StopIteration:
+            raise StopAsyncIteration from None
+        await self._sleep(delay_ms)
+        # 与SDK解析响应的方式一致（不校验），未声明的字段（如reasoning_content）同样保留
+        return ChatCompletionChunk.construct(**data)
+
+
+class ReplayProvider(OpenAICompatibleProvider):
+    """
+    录制/回放提供商
+
+    创建时按 upstream 派生出真实提供商类的子类（如 DeepseekProvider），只替换SDK客户端
+
+    配置项（其余配置项与被包装的提供商相同）:
+        mode: record（录制）或 replay（回放）
+        name: 对外使用的提供商名称，同时是夹具子目录名
+        upstream: 被包装的真实提供商名称，默认与name相同
+        fixture_dir: 夹具根目录
+        time_scale: 回放时间隔的缩放系数，1为原始节奏，0为不等待
+        strict: 回放时找不到完全匹配的夹具是否报错，否则按顺序轮流使用同类夹具
+    """
+
+    def __new__(cls, config: Dict[str, Any]):
+        if cls is ReplayProvider:
+            # 延迟导入，避免与factory循环导入
+            from .factory import AIProviderFactory
+            upstream = (config.get('upstream') or config.get('name') or '').lower()
+            cls = cls.for_upstream(AIProviderFactory._get_provider_class(upstream))
+        return super().__new__(cls)
+
+    @classmethod
+    def for_upstream(cls, upstream_class: Type[OpenAICompatibleProvider]) -> type:
+        """
+        获取真实提供商类对应的录制/回放类
+
+        Args:
+            upstream_class: 真实提供商类
+
+        Returns:
+            type: 同时继承ReplayProvider和真实提供商类的子类
+
+        Raises:
+            ValueError: 真实提供商不是OpenAI兼容提供商时
+        """
+        if not issubclass(upstream_class, OpenAICompatibleProvider):
+            raise ValueError(f"录制/回放只支持OpenAI兼容提供商: {upstream_class.__name__}")
+        if upstream_class not in _REPLAY_CLASSES:
+            _REPLAY_CLASSES[upstream_class] = type(f"Replay{upstream_class.__name__}", (ReplayProvider, upstream_class), {'__module__': __name__})
+        return _REPLAY_CLASSES[upstream_class]
+
+    def __init__(self, config: Dict[str, Any]):
+        """
+        初始化录制/回放提供商
+
+        Args:
+            config: 提供商配置字典
+        """
+        self.mode = config.get('mode', 'replay')
+        if self.mode not in ('record', 'replay'):
+            raise ValueError(f"未知的录制/回放模式: {self.mode}")
+
+        name = config.get('name') or config.get('upstream') or 'replay'
+        self.fixture_dir = os.path.join(config.get('fixture_dir', os.path.join('fixtures', 'replay')), name)
+        self.time_scale = float(config.get('time_scale', 1.0))
+        self.strict = bool(config.get('strict', False))
+
+        # 回放用的夹具缓存: 类型 -> {键: 夹具}，以及轮流使用的游标
+        self._fixtures: Optional[Dict[str, Dict[str, Dict[str, Any]]]] = None
+        self._cursors: Dict[str, int] = {}
+
+        super().__init__(config)
+        # 派生类名为Replay<真实类名>，对外仍使用真实提供商名称
+        self.provider_name = name
+
+    def _initialize_client(self):
+        """
+        初始化读写夹具的客户端：录制模式下包装真实SDK客户端，回放模式下不创建真实客户端
+        """
+        if self.mode == 'record':
+            super()._initialize_client()
+            if self.async_client is None:
+                return
+            os.makedirs(self.fixture_dir, exist_ok=True)
+            async_client, client = self.async_client, self.client
+        else:
+            async_client = client = None
+
+        self.async_client = SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=partial(self._create_chat_completion, async_client)))
+        )
+        self.client = SimpleNamespace(images=SimpleNamespace(generate=partial(self._generate_images, client)))
+        logger.info(f"{self.get_provider_display_name()}录制/回放客户端初始化成功 - 模式: {self.mode}, 夹具目录: {self.fixture_dir}")
+
+    @staticmethod
+    def fixture_key(kind: str, payload: Dict[str, Any]) -> str:
+        """
+        计算请求的夹具键
+
+        Args:
+            kind: 夹具类型（stream、response、image）
+            payload: 可JSON序列化的请求内容
+
+        Returns:
+            str: 请求内容的SHA-256前16位
+        """
+        canonical = json.dumps({'kind': kind, **payload}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+    def _write_fixture(self, kind: str, key: str, request: Dict[str, Any], data: Dict[str, Any]):
+        """写入夹具文件（先写临时文件再替换，避免回放读到半个文件）"""
+        fixture = {
+            'version': FIXTURE_VERSION,
+            'provider': self.provider_name,
+            'kind': kind,
+            'key': key,
+            'recorded_at': time.time(),
+            'request': request,
+            **data
+        }
+        path = os.path.join(self.fixture_dir, f"{kind}-{key}.json")
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(fixture, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+        logger.info("录制夹具 - 提供商: %s, 类型: %s, 键: %s", self.provider_name, kind, key)
+
+    def _load_fixtures(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """首次回放时加载全部夹具"""
+        if self._fixtures is not None:
+            return self._fixtures
+
+        fixtures: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        if os.path.isdir(self.fixture_dir):
+            for filename in sorted(os.listdir(self.fixture_dir)):
+                if not filename.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(self.fixture_dir, filename), encoding='utf-8') as f:
+                        fixture = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"夹具文件读取失败，已跳过: {filename}, 错误: {e}")
+                    continue
+                if fixture.get('version') != FIXTURE_VERSION:
+                    logger.warning(f"夹具版本不兼容，已跳过: {filename}")
+                    continue
+                fixtures.setdefault(fixture['kind'], {})[fixture['key']] = fixture
+
+        self._fixtures = fixtures
+        logger.info(f"加载{self.provider_name}回放夹具: " + ", ".join(f"{kind} {len(items)}个" for kind, items in fixtures.items()))
+        return fixtures
+
+    def _find_fixture(self, kind: str, key: str) -> Dict[str, Any]:
+        """
+        查找回放夹具：优先完全匹配，非严格模式下按顺序轮流使用同类夹具
+
+        Raises:
+            LookupError: 找不到可用夹具时
+        """
+        candidates = self._load_fixtures().get(kind, {})
+        if key in candidates:
+            return candidates[key]
+        if self.strict or not candidates:
+            raise LookupError(f"没有匹配的{kind}夹具: {key}（目录: {self.fixture_dir}）")
+
+        keys = list(candidates)
+        cursor = self._cursors.get(kind, 0)
+        self._cursors[kind] = cursor + 1
+        return candidates[keys[cursor % len(keys)]]
+
+    def _scaled_delay(self, delay_ms: float) -> float:
+        """按缩放系数换算等待秒数"""
+        return delay_ms * self.time_scale / 1000 if self.time_scale > 0 else 0
+
+    async def _sleep(self, delay_ms: float):
+        """按缩放系数等待，系数为0时只让出事件循环"""
+        await asyncio.sleep(self._scaled_delay(delay_ms))
+
+    async def _create_chat_completion(self, upstream: Any, **params) -> Any:
+        """
+        替代 async_client.chat.completions.create：录制时转发给真实客户端，回放时从夹具还原
+
+        Args:
+            upstream: 真实的AsyncOpenAI客户端，回放模式下为None
+            **params: 提供商构建好的请求参数
+
+        Returns:
+            流式请求返回可异步迭代的片段流，否则返回ChatCompletion
+
+        Raises:
+            LookupError: 回放时找不到可用夹具
+        """
+        kind = 'stream' if params.get('stream') else 'response'
+        request = _fixture_request(params)
+        key = self.fixture_key(kind, request)
+
+        if self.mode == 'record':
+            started = time.perf_counter()
+            response = await upstream.chat.completions.create(**params)
+            latency_ms = round((time.perf_counter() - started) * 1000, 3)
+            if kind == 'response':
+                self._write_fixture(kind, key, request, {'latency_ms': latency_ms, 'response': response.to_dict()})
+                return response
+            # 流式请求的latency_ms为建立连接到收到响应头的耗时，首个片段的间隔即首token延迟
+            return _RecordingStream(response, lambda chunks: self._write_fixture(
+                kind, key, request, {'latency_ms': latency_ms, 'chunks': chunks}
+            ))
+
+        fixture = self._find_fixture(kind, key)
+        await self._sleep(fixture['latency_ms'])
+        if kind == 'stream':
+            return _ReplayStream(fixture['chunks'], self._sleep)
+
+        from openai.types.chat import ChatCompletion
+        return ChatCompletion.construct(**fixture['response'])
+
+    def _generate_images(self, upstream: Any, **params) -> Any:
+        """
+        替代 client.images.generate（同步接口，由调用方放到线程中执行）
+
+        Args:
+            upstream: 真实的OpenAI客户端，回放模式下为None
+            **params: 提供商构建好的图片生成参数
+
+        Returns:
+            ImagesResponse: 图片生成响应
+
+        Raises:
+            LookupError: 回放时找不到可用夹具
+        """
+        request = _fixture_request(params)
+        key = self.fixture_key('image', request)
+
+        if self.mode == 'record':
+            started = time.perf_counter()
+            response = upstream.images.generate(**params)
+            self._write_fixture('image', key, request, {
+                'latency_ms': round((time.perf_counter() - started) * 1000, 3),
+                'response': response.to_dict()
+            })
+            return response
+
+        from openai.types import ImagesResponse
+        fixture = self._find_fixture('image', key)
+        time.sleep(self._scaled_delay(fixture['latency_ms']))
+        return ImagesResponse.construct(**fixture['response'])
+
+    def validate_config(self) -> bool:
+        """
+        验证配置是否有效
+
+        Returns:
+            bool: 录制模式下取决于真实提供商的配置，回放模式下还要求夹具目录存在
+        """
+        if self.mode == 'replay' and not os.path.isdir(self.fixture_dir):
+            logger.error(f"{self.get_provider_display_name()}回放夹具目录不存在: {self.fixture_dir}")
+            return False
+        return super().validate_config()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+/chat/stream 压测脚本
+启动本地模拟OpenAI服务器和应用服务器（提供商BASE_URL指向模拟服务器），
+N个并发模拟用户各自进行多轮对话，统计吞吐量、首token延迟分位数，
+以及服务器进程（含worker子进程）每个流的CPU时间和内存占用
+
+CPU和内存通过 /proc 读取，仅支持Linux
+
+用法:
+    python benchmarks/bench_chat_load.py --users 50 --turns 5 --ttft-ms 300 --token-delay-ms 20 --tokens 100
+    python benchmarks/bench_chat_load.py --users 200 --mode prod --workers 4 --rate-limit-rate 0.05
+    python benchmarks/bench_chat_load.py --users 50 --replay-dir fixtures/replay --replay-time-scale 1
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+
+from bench_server_modes import PROJECT_ROOT, start_server, wait_until_ready
+from mock_openai_server import add_mock_arguments, mock_arguments_to_cli
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def _process_tree(root_pid: int) -> list:
+    """获取进程及其所有子孙进程的PID"""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+
+    pids, pending = [], [root_pid]
+    while pending:
+        pid = pending.pop()
+        pids.append(pid)
+        pending.extend(children.get(pid, []))
+    return pids
+
+
+def read_usage(root_pid: int) -> tuple:
+    """读取进程树的累计CPU时间（秒）和常驻内存（字节）"""
+    cpu_seconds, rss_bytes = 0.0, 0
+    for pid in _process_tree(root_pid):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{pid}/statm") as f:
+                rss_pages = int(f.read().split()[1])
+        except OSError:
+            continue
+        # fields从state开始，utime/stime为第12、13项
+        cpu_seconds += (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+        rss_bytes += rss_pages * _PAGE_SIZE
+    return cpu_seconds, rss_bytes
+
+
+async def run_turn(client: httpx.AsyncClient, url: str, user_id: str, session_id: str) -> dict:
+    """完成一轮流式对话，返回首token延迟、耗时、token数和是否出错"""
+    result = {"ttft": None, "duration": None, "tokens": 0, "error": False}
+    started = time.perf_counter()
+    payload = {"user_id": user_id, "session_id": session_id, "message": "请介绍一下你自己", "provider": "deepseek"}
+    try:
+        async with client.stream("POST", url, json=payload) as response:
+            if response.status_code != 200:
+                result["error"] = True
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                if not line.startswith("data: "):
+                    # 提供商错误以纯文本返回
+                    result["error"] = True
+                    continue
+                chunk_type = json.loads(line[6:]).get("type")
+                if chunk_type in ("content", "reasoning"):
+                    result["tokens"] += 1
+                    if result["ttft"] is None:
+                        result["ttft"] = time.perf_counter() - started
+                elif chunk_type == "error":
+                    result["error"] = True
+    except httpx.HTTPError:
+        result["error"] = True
+    result["duration"] = time.perf_counter() - started
+    return result
+
+
+async def run_load(base_url: str, users: int, turns: int, server_pid: int) -> dict:
+    """并发运行模拟用户，同时采样服务器资源占用"""
+    url = f"{base_url}/chat/stream"
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    results = []
+    peak_rss = 0
+    done = asyncio.Event()
+
+    async def sample_memory():
+        nonlocal peak_rss
+        while not done.is_set():
+            peak_rss = max(peak_rss, read_usage(server_pid)[1])
+            await asyncio.sleep(0.2)
+
+    async with httpx.AsyncClient(limits=limits, timeout=300) as client:
+        async def user(index: int):
+            session_id = str(uuid.uuid4())
+            for _ in range(turns):
+                results.append(await run_turn(client, url, f"load-user-{index}", session_id))
+
+        cpu_before, rss_before = read_usage(server_pid)
+        sampler = asyncio.create_task(sample_memory())
+        started = time.perf_counter()
+        await asyncio.gather(*(user(index) for index in range(users)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await sampler
+        cpu_after, _ = read_usage(server_pid)
+
+    return {
+        "results": results,
+        "elapsed": elapsed,
+        "cpu_seconds": cpu_after - cpu_before,
+        "rss_before": rss_before,
+        "peak_rss": max(peak_rss, rss_before)
+    }
+
+
+def print_report(stats: dict, users: int):
+    results = stats["results"]
+    succeeded = [result for result in results if not result["error"]]
+    ttfts = [result["ttft"] * 1000 for result in succeeded if result["ttft"] is not None]
+    durations = [result["duration"] * 1000 for result in succeeded]
+    tokens = sum(result["tokens"] for result in results)
+    elapsed = stats["elapsed"]
+
+    print(f"流数: {len(results)}（失败 {len(results) - len(succeeded)}），并发用户: {users}，耗时: {elapsed:.2f}s")
+    print(f"吞吐量: {len(results) / elapsed:.1f} 流/s，{tokens / elapsed:.0f} token/s")
+    print(f"首token延迟(ms)  p50: {percentile(ttfts, 0.5):.0f}  p90: {percentile(ttfts, 0.9):.0f}  p99: {percentile(ttfts, 0.99):.0f}")
+    print(f"流总耗时(ms)     p50: {percentile(durations, 0.5):.0f}  p90: {percentile(durations, 0.9):.0f}  p99: {percentile(durations, 0.99):.0f}")
+    print(f"服务器CPU: {stats['cpu_seconds']:.2f}s，每个流 {stats['cpu_seconds'] * 1000 / max(1, len(results)):.2f}ms")
+    print(
+        f"服务器内存: 空闲 {stats['rss_before'] / 1024 ** 2:.1f}MB，峰值 {stats['peak_rss'] / 1024 ** 2:.1f}MB，"
+        f"每个并发流 {(stats['peak_rss'] - stats['rss_before']) / 1024 / users:.1f}KB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/chat/stream 压测")
+    parser.add_argument("--users", type=int, default=50, help="并发模拟用户数")
+    parser.add_argument("--turns", type=int, default=5, help="每个用户的对话轮数")
+    parser.add_argument("--mode", choices=["dev", "prod"], default="prod", help="应用服务器运行模式")
+    parser.add_argument("--workers", type=int, default=None, help="prod模式的worker数")
+    parser.add_argument("--port", type=int, default=18100, help="应用服务器端口")
+    parser.add_argument("--mock-port", type=int, default=19100, help="模拟服务器端口")
+    parser.add_argument("--replay-dir", default=None, help="从录制的夹具目录回放deepseek提供商，不启动模拟服务器")
+    parser.add_argument("--replay-time-scale", type=float, default=1.0, help="回放片段间隔的缩放系数")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    processes = []
+    if args.replay_dir:
+        # 应用服务器子进程继承环境变量，从夹具回放提供商响应
+        os.environ.update({
+            "REPLAY_MODE": "replay",
+            "REPLAY_FIXTURE_DIR": os.path.abspath(args.replay_dir),
+            "REPLAY_TIME_SCALE": str(args.replay_time_scale),
+            "DEFAULT_AI_PROVIDER": "deepseek",
+        })
+    else:
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(PROJECT_ROOT, "benchmarks", "mock_openai_server.py"),
+             "--port", str(args.mock_port), *mock_arguments_to_cli(args)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        ))
+        # 应用服务器子进程继承环境变量，把deepseek提供商指向模拟服务器
+        os.environ.update({
+            "DEEPSEEK_API_KEY": "mock-key",
+            "DEEPSEEK_BASE_URL": f"http://127.0.0.1:{args.mock_port}/v1",
+            "DEFAULT_AI_PROVIDER": "deepseek",
+        })
+    app_process = start_server(args.mode, args.port, args.workers)
+    processes.insert(0, app_process)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        if not args.replay_dir:
+            wait_until_ready(f"http://127.0.0.1:{args.mock_port}/v1/models")
+        wait_until_ready(f"{base_url}/api")
+        stats = asyncio.run(run_load(base_url, args.users, args.turns, app_process.pid))
+        print_report(stats, args.users)
+    finally:
+        for process in processes:
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    main()
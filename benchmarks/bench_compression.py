@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+响应压缩基准测试
+对典型的大JSON响应（长对话历史、带Base64图片的上传结果、生成图片结果）分别用gzip和brotli的
+多个级别压缩，输出压缩率、节省的字节数和压缩耗时（CPU时间），并通过ASGI调用 /chat/history
+对比开启压缩中间件前后的单请求耗时
+
+用法:
+    python benchmarks/bench_compression.py
+    python benchmarks/bench_compression.py --history 2000 --image-kb 1024 --output compression_results.json
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DEEPSEEK_API_KEY", "benchmark")
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from compression import DYNAMIC_LEVELS, SUPPORTED_ENCODINGS, compress  # noqa: E402
+from middlewares import CompressionMiddleware  # noqa: E402
+
+# 每种编码测试的压缩级别
+LEVELS = {"gzip": (1, 6, 9), "br": (1, 4, 6, 11)}
+SAMPLE_TEXT = "FastAPI是一个现代、快速的Web框架，用于基于标准Python类型提示构建API。下面是示例代码：\n```python\nprint('hello')\n```\n"
+SAMPLE_SENTENCES = (
+    "FastAPI是一个现代、快速的Web框架，用于基于标准Python类型提示构建API。",
+    "Redis的列表类型适合保存按时间排序的对话消息，LRANGE可以按范围读取。",
+    "Use asyncio.gather to run independent coroutines concurrently and collect their results.",
+    "下面是一个示例：\n```python\nasync def handler(request):\n    return {'ok': True}\n```",
+    "流式响应使用Server-Sent Events，每个片段以data:开头、以空行结尾。",
+    "The quick brown fox jumps over the lazy dog while the model streams tokens.",
+    "如果上游返回429，可以按Retry-After等待后重试，或者切换到其他提供商。",
+    "图片在发送给视觉模型前会缩放并重新编码，去除EXIF等元数据。",
+)
+
+
+def build_message_text(rng: random.Random, index: int, sentences: int) -> str:
+    """随机组合句子并混入数字，避免重复文本让压缩率失真"""
+    parts = [f"第{index}条消息："]
+    for _ in range(sentences):
+        parts.append(rng.choice(SAMPLE_SENTENCES))
+        parts.append(f"（参考编号 {rng.getrandbits(32):08x}，耗时 {rng.uniform(0, 500):.2f}ms）")
+    return "".join(parts)
+
+
+def build_image_base64(size_kb: int) -> str:
+    """生成接近目标大小的PNG图片的Base64（带噪声的渐变，接近真实照片的可压缩程度）"""
+    from PIL import Image
+
+    side = max(16, int((size_kb * 1024 / 3) ** 0.5))
+    noise = Image.frombytes("L", (side, side), os.urandom(side * side))
+    image = Image.merge("RGB", (Image.linear_gradient("L").resize((side, side)), noise, Image.linear_gradient("L").resize((side, side)).rotate(90)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def build_payloads(history_size: int, image_kb: int) -> dict:
+    """构造与接口返回格式一致的典型响应体"""
+    image_b64 = build_image_base64(image_kb)
+    rng = random.Random(0)
+    history = {
+        "session_id": "bench-session",
+        "messages": [
+            {
+                "role": "user" if index % 2 == 0 else "assistant",
+                "content": build_message_text(rng, index, 1 if index % 2 == 0 else 6),
+                "timestamp": 1760000000.0 + index,
+                "image_id": None,
+            }
+            for index in range(history_size)
+        ],
+    }
+    upload = {
+        "success": True,
+        "message": "图片上传成功",
+        "data": {"image_id": "0" * 32, "filename": "photo.png", "content_type": "image/png",
+                 "size": len(image_b64) * 3 // 4, "base64_data": image_b64},
+    }
+    generate = {
+        "success": True,
+        "message": "图片生成成功",
+        "data": {"image_url": "/generated-images/abc.png", "image_b64": image_b64, "prompt": SAMPLE_TEXT, "size": "1024x1024"},
+        "provider": "openai",
+        "timestamp": 1760000000.0,
+    }
+    return {
+        name: json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        for name, payload in (("chat_history", history), ("upload_image", upload), ("generate_image", generate))
+    }
+
+
+def measure(body: bytes, encoding: str, level: int, min_time: float) -> dict:
+    """重复压缩直到累计时间超过min_time，取CPU时间中位数"""
+    durations = []
+    compressed = b""
+    total = 0.0
+    while total < min_time or len(durations) < 3:
+        started = time.process_time()
+        compressed = compress(body, encoding, level)
+        elapsed = time.process_time() - started
+        durations.append(elapsed)
+        total += elapsed
+        if len(durations) >= 1000:
+            break
+    median = statistics.median(durations)
+    return {
+        "encoding": encoding,
+        "level": level,
+        "original_bytes": len(body),
+        "compressed_bytes": len(compressed),
+        "saved_percent": round((1 - len(compressed) / len(body)) * 100, 1),
+        "cpu_ms": round(median * 1000, 3),
+        "mb_per_second": round(len(body) / median / 1024 / 1024, 1) if median else None,
+    }
+
+
+async def measure_endpoint(history_size: int, requests: int) -> dict:
+    """通过ASGI请求 /chat/history，对比不压缩和压缩时的耗时与传输字节数"""
+    from fastapi.testclient import TestClient
+
+    results = {}
+    rng = random.Random(0)
+    with TestClient(main.app):
+        for index in range(history_size):
+            await main.save_message_to_redis("bench-user", "bench-session", main.ChatMessage(
+                role="user" if index % 2 == 0 else "assistant",
+                content=build_message_text(rng, index, 1 if index % 2 == 0 else 6),
+                timestamp=time.time()
+            ))
+
+        # 应用本身可能已启用压缩中间件，基准直接包装内层路由，分别测试不压缩和压缩
+        cases = {"identity": main.app.router}
+        for encoding in SUPPORTED_ENCODINGS:
+            cases[encoding] = CompressionMiddleware(main.app.router)
+        for name, asgi_app in cases.items():
+            transport = httpx.ASGITransport(app=asgi_app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                headers = {"Accept-Encoding": name}
+                params = {"user_id": "bench-user", "session_id": "bench-session"}
+                durations, size = [], 0
+                for _ in range(requests):
+                    started = time.perf_counter()
+                    response = await client.get("/chat/history", params=params, headers=headers)
+                    durations.append(time.perf_counter() - started)
+                    size = len(response.content) if name == "identity" else int(response.headers.get("content-length", 0))
+                results[name] = {"median_ms": round(statistics.median(durations) * 1000, 3), "response_bytes": size}
+    return results
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="响应压缩基准测试")
+    parser.add_argument("--history", type=int, default=1000, help="对话历史消息数")
+    parser.add_argument("--image-kb", type=int, default=512, help="Base64图片的原始大小（KB）")
+    parser.add_argument("--min-time", type=float, default=0.3, help="每个用例的最短累计CPU时间（秒）")
+    parser.add_argument("--requests", type=int, default=50, help="接口对比的请求数")
+    parser.add_argument("--output", default=None, help="结果JSON输出路径")
+    args = parser.parse_args()
+
+    payloads = build_payloads(args.history, args.image_kb)
+    results = {"payloads": {}, "endpoint": None, "dynamic_levels": DYNAMIC_LEVELS}
+    print(f"{'响应':<16}{'编码':<6}{'级别':>4}{'原始字节':>12}{'压缩后':>12}{'节省':>8}{'CPU ms':>10}{'MB/s':>9}")
+    for name, body in payloads.items():
+        rows = []
+        for encoding in SUPPORTED_ENCODINGS:
+            for level in LEVELS[encoding]:
+                row = measure(body, encoding, level, args.min_time)
+                rows.append(row)
+                marker = " *" if DYNAMIC_LEVELS[encoding] == level else ""
+                print(f"{name:<16}{encoding:<6}{level:>4}{row['original_bytes']:>12}{row['compressed_bytes']:>12}"
+                      f"{row['saved_percent']:>7}%{row['cpu_ms']:>10}{row['mb_per_second']:>9}{marker}")
+        results["payloads"][name] = rows
+    print("* 为中间件使用的级别")
+
+    results["endpoint"] = asyncio.run(measure_endpoint(args.history, args.requests))
+    print(f"\nGET /chat/history（{args.history}条消息，{args.requests}次请求中位数）:")
+    for name, row in results["endpoint"].items():
+        print(f"  {name:<9} {row['median_ms']:>9} ms {row['response_bytes']:>12} bytes")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+日志开销基准测试
+在进程内用假提供商执行完整的流式聊天流程（保存消息、读取历史、流式输出、保存回复），
+对比同步FileHandler（原配置）与队列异步+JSON+采样（当前配置）下每轮对话的耗时。
+主要指标是请求线程的CPU时间（time.thread_time），即日志在请求路径上增加的开销；
+后台写日志线程的工作不计入。两轮对话之间留出空闲时间，模拟真实服务中等待网络的间隙
+
+用法:
+    python benchmarks/bench_logging.py --turns 2000 --chunks 50
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DEEPSEEK_API_KEY", "benchmark")
+
+import main  # noqa: E402
+from ai_providers.factory import MultiProviderManager  # noqa: E402
+from logging_setup import TEXT_LOG_FORMAT, setup_logging  # noqa: E402
+
+
+class FakeProvider:
+    """按固定块数输出内容的假提供商，日志与真实提供商一致"""
+
+    def __init__(self, chunks: int):
+        self.chunks = chunks
+        self.logger = logging.getLogger("ai_providers.openai_compatible_provider")
+
+    async def generate_streaming_response(self, messages, **kwargs):
+        self.logger.info("调用%s流式API - 模型: %s, 消息数: %d", "Fake", "fake-model", len(messages))
+        for index in range(self.chunks):
+            yield f"data: {json.dumps({'type': 'content', 'content': f'片段{index}'}, ensure_ascii=False)}\n\n"
+        self.logger.info("%s流式响应完成 - 块数: %d", "Fake", self.chunks)
+
+
+def reset_root_logger():
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+        handler.close()
+
+
+def setup_sync_logging(log_file: str):
+    """原配置：basicConfig + 同步StreamHandler/FileHandler，调用线程内完成格式化和写入"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format=TEXT_LOG_FORMAT,
+        handlers=[logging.StreamHandler(), logging.FileHandler(log_file, encoding='utf-8')],
+        force=True
+    )
+
+
+async def run_turns(turns: int, idle_ms: float) -> list:
+    cpu_times = []
+    for index in range(turns):
+        started = time.thread_time()
+        async for _ in main.generate_streaming_response(
+            user_id="bench", session_id=f"session-{index:08d}", user_message="你好，请介绍一下你自己"
+        ):
+            pass
+        cpu_times.append((time.thread_time() - started) * 1000)
+        await asyncio.sleep(idle_ms / 1000)
+    return cpu_times
+
+
+def summarize(name: str, cpu_times: list, log_file: str, baseline: float):
+    ordered = sorted(cpu_times)
+    lines = 0
+    if os.path.exists(log_file):
+        with open(log_file, encoding="utf-8") as f:
+            lines = sum(1 for _ in f)
+    mean = statistics.mean(cpu_times)
+    print(
+        f"{name:<24} 请求线程CPU 平均: {mean:.3f}ms  p99: {ordered[int(len(ordered) * 0.99)]:.3f}ms  "
+        f"日志开销: {mean - baseline:+.3f}ms/轮  日志行数: {lines}"
+    )
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="日志开销基准测试")
+    parser.add_argument("--turns", type=int, default=2000, help="对话轮数")
+    parser.add_argument("--chunks", type=int, default=50, help="每轮流式输出的块数")
+    parser.add_argument("--idle-ms", type=float, default=2.0, help="两轮对话之间的空闲时间（毫秒）")
+    args = parser.parse_args()
+
+    manager = MultiProviderManager({})
+    manager.providers["fake"] = FakeProvider(args.chunks)
+    manager.default_provider = "fake"
+    main.ai_manager = manager
+
+    # 控制台输出重定向到空设备，只衡量日志处理本身的开销
+    sys.stderr = open(os.devnull, "w")
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scenarios = [
+            ("关闭日志（基线）", lambda path: logging.basicConfig(level=logging.WARNING, handlers=[logging.NullHandler()], force=True)),
+            ("同步FileHandler", lambda path: setup_sync_logging(path)),
+            ("队列+JSON", lambda path: setup_logging(logging.INFO, path, "json")),
+            ("队列+JSON+存储日志采样", lambda path: setup_logging(logging.INFO, path, "json", "main.storage=0.1")),
+        ]
+        for name, configure in scenarios:
+            log_file = os.path.join(tmp_dir, f"{len(results)}.log")
+            main.MEMORY_STORAGE["conversations"].clear()
+            main.MEMORY_STORAGE["sessions"].clear()
+            listener = configure(log_file)
+            asyncio.run(run_turns(50, args.idle_ms))  # 预热
+            durations = asyncio.run(run_turns(args.turns, args.idle_ms))
+            if listener:
+                listener.stop()
+            reset_root_logger()
+            results.append((name, durations, log_file))
+
+        sys.stderr = sys.__stderr__
+        print(f"对话轮数: {args.turns}, 每轮块数: {args.chunks}")
+        baseline = statistics.mean(results[0][1])
+        for name, durations, log_file in results:
+            summarize(name, durations, log_file, baseline)
+
+
+if __name__ == "__main__":
+    main_benchmark()
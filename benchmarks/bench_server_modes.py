@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务器启动模式对比基准测试
+分别以dev模式（单进程热重载）和prod模式（多worker）启动start_server.py，
+对比启动耗时与 /api 接口吞吐量
+
+用法:
+    python benchmarks/bench_server_modes.py --requests 5000 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_server(mode: str, port: int, workers: int = None) -> subprocess.Popen:
+    """以指定模式启动服务器子进程"""
+    cmd = [sys.executable, "start_server.py", "--mode", mode]
+    if workers:
+        cmd += ["--workers", str(workers)]
+    env = dict(os.environ, PORT=str(port), DEBUG="false", LOG_LEVEL="WARNING")
+    # 基准测试不调用上游，只需让配置校验通过
+    env.setdefault("DEEPSEEK_API_KEY", "benchmark-dummy-key")
+    return subprocess.Popen(cmd, cwd=PROJECT_ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_until_ready(url: str, timeout: float = 60.0) -> float:
+    """轮询直到服务可用，返回启动耗时（秒）"""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            if httpx.get(url, timeout=0.5).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"服务在{timeout}秒内未就绪: {url}")
+
+
+async def measure_throughput(url: str, total: int, concurrency: int) -> float:
+    """并发请求指定次数，返回每秒请求数"""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        queue = asyncio.Queue()
+        for _ in range(total):
+            queue.put_nowait(None)
+
+        async def worker():
+            while not queue.empty():
+                queue.get_nowait()
+                response = await client.get(url)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return total / (time.perf_counter() - started)
+
+
+def run_mode(mode: str, port: int, args) -> dict:
+    """启动一个模式并完成测量"""
+    url = f"http://127.0.0.1:{port}/api"
+    process = start_server(mode, port, args.workers if mode == "prod" else None)
+    try:
+        startup = wait_until_ready(url)
+        rps = asyncio.run(measure_throughput(url, args.requests, args.concurrency))
+        return {"mode": mode, "startup_seconds": startup, "requests_per_second": rps}
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比dev与prod启动模式")
+    parser.add_argument("--requests", type=int, default=5000, help="每个模式的请求总数")
+    parser.add_argument("--concurrency", type=int, default=64, help="并发连接数")
+    parser.add_argument("--workers", type=int, default=None, help="prod模式的worker数")
+    parser.add_argument("--port", type=int, default=18000, help="起始端口")
+    args = parser.parse_args()
+
+    results = [
+        run_mode("dev", args.port, args),
+        run_mode("prod", args.port + 1, args),
+    ]
+
+    print(f"{'模式':<6}{'启动耗时(s)':>14}{'吞吐量(req/s)':>16}")
+    for result in results:
+        print(f"{result['mode']:<6}{result['startup_seconds']:>14.2f}{result['requests_per_second']:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
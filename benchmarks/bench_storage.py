@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+存储与序列化微基准测试
+覆盖 save_message_to_redis、get_conversation_history、get_user_sessions、format_messages
+以及SSE片段的编码/解析，分别在内存存储、Redis（本地Redis或 redis_standin.py 替身）
+和启用消息写缓冲的Redis（redis_writebehind）上运行，
+历史消息数从10到10000，区分带图片和不带图片。结果保存为JSON并可与基线对比，
+中位数超过基线容差时以非0退出码结束
+
+用法:
+    python benchmarks/bench_storage.py --output storage_results.json
+    python benchmarks/bench_storage.py --baseline benchmarks/baselines/storage.json
+    python benchmarks/bench_storage.py --save-baseline benchmarks/baselines/storage.json
+    python benchmarks/bench_storage.py --redis-url redis://localhost:6379/15   # 使用真实Redis（会清空该库）
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DEEPSEEK_API_KEY", "benchmark")
+
+import main  # noqa: E402
+from ai_providers.base import AIMessage  # noqa: E402
+from ai_providers.deepseek_provider import DeepseekProvider  # noqa: E402
+from message_writer import MessageWriteBuffer  # noqa: E402
+from metrics import InstrumentedRedis  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+USER_ID = "bench-user"
+SESSION_ID = "bench-session-0000"
+# 约30KB的伪图片Base64，带图片的用例中每条用户消息都引用它
+IMAGE_B64 = base64.b64encode(os.urandom(22 * 1024)).decode("ascii")
+IMAGE_ID = "0" * 64
+
+
+def measure(func, min_time: float, max_reps: int) -> dict:
+    """反复执行func直到累计min_time秒（至少5次），返回每次耗时的统计（微秒）"""
+    samples = []
+    total = 0.0
+    while (total < min_time or len(samples) < 5) and len(samples) < max_reps:
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        samples.append(elapsed * 1e6)
+        total += elapsed
+    samples.sort()
+    return {
+        "median_us": round(statistics.median(samples), 3),
+        "p95_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "reps": len(samples)
+    }
+
+
+def make_message_data(index: int, images: bool) -> dict:
+    role = "user" if index % 2 == 0 else "assistant"
+    return {
+        "role": role,
+        "content": f"第{index}条消息：" + "这是一段用于基准测试的对话内容。" * 4,
+        "timestamp": 1700000000.0 + index,
+        "image_data": None,
+        "image_type": "image/jpeg" if images and role == "user" else None,
+        "image_id": IMAGE_ID if images and role == "user" else None
+    }
+
+
+def use_backend(backend: str, redis_client):
+    """切换main模块使用的存储后端并清空数据"""
+    main.MEMORY_STORAGE["conversations"].clear()
+    main.MEMORY_STORAGE["sessions"].clear()
+    if backend.startswith("redis"):
+        redis_client.flushdb()
+        main.redis_client, main.REDIS_AVAILABLE = redis_client, True
+    else:
+        main.redis_client, main.REDIS_AVAILABLE = None, False
+
+
+def populate_history(backend: str, redis_client, size: int, images: bool):
+    messages = [make_message_data(index, images) for index in range(size)]
+    if backend.startswith("redis"):
+        key = main.get_conversation_key(USER_ID, SESSION_ID)
+        for start in range(0, size, 1000):
+            pipe = redis_client.pipeline(transaction=False)
+            for message in messages[start:start + 1000]:
+                pipe.lpush(key, json.dumps(message))
+            pipe.execute()
+    else:
+        main.MEMORY_STORAGE["conversations"].setdefault(USER_ID, {})[SESSION_ID] = messages
+
+
+def populate_sessions(backend: str, redis_client, size: int):
+    sessions = {
+        f"session-{index:06d}": {
+            "session_id": f"session-{index:06d}",
+            "last_message": "这是一段用于基准测试的对话内容。",
+            "last_timestamp": 1700000000.0 + index
+        }
+        for index in range(size)
+    }
+    if backend.startswith("redis"):
+        key = main.get_user_sessions_key(USER_ID)
+        items = list(sessions.items())
+        for start in range(0, size, 1000):
+            redis_client.hset(key, mapping={sid: json.dumps(info) for sid, info in items[start:start + 1000]})
+    else:
+        main.MEMORY_STORAGE["sessions"][USER_ID] = sessions
+
+
+def create_write_buffer(redis_client) -> MessageWriteBuffer:
+    """按应用配置创建消息写缓冲区"""
+    return MessageWriteBuffer(
+        redis_client,
+        conversation_key=main.get_conversation_key,
+        sessions_key=main.get_user_sessions_key,
+        conversation_expire=main.config.CONVERSATION_EXPIRE_TIME,
+        session_expire=main.config.SESSION_EXPIRE_TIME,
+        flush_delay=main.config.MESSAGE_FLUSH_DELAY,
+        max_batch=main.config.MESSAGE_FLUSH_BATCH,
+        max_pending=main.config.MESSAGE_WRITE_MAX_PENDING
+    )
+
+
+def bench_storage_backend(backend: str, redis_client, loop, sizes, args) -> dict:
+    results = {}
+    run = loop.run_until_complete
+
+    def reset_backend():
+        # 写缓冲区中上一个用例的消息先写完，避免清空数据后才写入Redis
+        if main.message_writer:
+            run(main.message_writer.stop())
+            main.message_writer = None
+        use_backend(backend, redis_client)
+        if backend == "redis_writebehind":
+            main.message_writer = create_write_buffer(redis_client)
+            run(main.message_writer.start())
+
+    try:
+        for size in sizes:
+            for images in (False, True):
+                variant = "img" if images else "text"
+                reset_backend()
+                populate_history(backend, redis_client, size, images)
+
+                message_data = make_message_data(size, images)
+                message = main.ChatMessage(
+                    role="user", content=message_data["content"], timestamp=message_data["timestamp"],
+                    image_type=message_data["image_type"], image_id=message_data["image_id"]
+                )
+                # 保存会让历史增长，保存用例放在读取用例之后
+                results[f"get_history/{backend}/{size}/{variant}"] = measure(
+                    lambda: run(main.get_conversation_history(USER_ID, SESSION_ID)), args.min_time, args.max_reps
+                )
+                results[f"save_message/{backend}/{size}/{variant}"] = measure(
+                    lambda: run(main.save_message_to_redis(USER_ID, SESSION_ID, message)), args.min_time, args.max_reps
+                )
+
+            reset_backend()
+            populate_sessions(backend, redis_client, size)
+            results[f"get_user_sessions/{backend}/{size}/text"] = measure(
+                lambda: run(main.get_user_sessions(user_id=USER_ID)), args.min_time, args.max_reps
+            )
+    finally:
+        if main.message_writer:
+            run(main.message_writer.stop())
+            main.message_writer = None
+    return results
+
+
+def bench_serialization(sizes, args) -> dict:
+    results = {}
+    provider = DeepseekProvider({"api_key": "benchmark", "model": "deepseek-chat"})
+    for size in sizes:
+        for images in (False, True):
+            variant = "img" if images else "text"
+            messages = []
+            for index in range(size):
+                data = make_message_data(index, images)
+                messages.append(AIMessage(
+                    role=data["role"], content=data["content"], timestamp=data["timestamp"],
+                    image_type=data["image_type"], image_data=IMAGE_B64 if data["image_id"] else None
+                ))
+            results[f"format_messages/-/{size}/{variant}"] = measure(
+                lambda: provider.format_messages(messages, "你是一个有用的助手"), args.min_time, args.max_reps
+            )
+
+        # SSE：提供商编码片段 + 主流程解析片段，size为一次回复的片段数
+        def encode_decode():
+            content = ""
+            for index in range(size):
+                chunk = f"data: {json.dumps({'type': 'content', 'content': f'词{index} '})}\n\n"
+                chunk_data = json.loads(chunk[6:].strip())
+                if chunk_data.get('type') == 'content':
+                    content += chunk_data['content']
+            return content
+
+        results[f"sse_chunks/-/{size}/text"] = measure(encode_decode, args.min_time, args.max_reps)
+    return results
+
+
+def start_redis_standin() -> tuple:
+    """启动Redis替身子进程，返回 (进程, 端口)"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "redis_standin.py"), "--port", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    for _ in range(100):
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                return process, port
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("Redis替身启动失败")
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta_us: float) -> list:
+    """对比基线，返回回归的用例列表"""
+    regressions = []
+    print(f"\n{'用例':<44}{'基线(us)':>12}{'当前(us)':>12}{'变化':>9}")
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<44}{'-':>12}{current['median_us']:>12.1f}{'新增':>9}")
+            continue
+        change = current["median_us"] / base["median_us"] - 1 if base["median_us"] else 0.0
+        regressed = change > tolerance and current["median_us"] - base["median_us"] > min_delta_us
+        marker = "  <-- 回归" if regressed else ""
+        print(f"{name:<44}{base['median_us']:>12.1f}{current['median_us']:>12.1f}{change:>+9.1%}{marker}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="存储与序列化微基准测试")
+    parser.add_argument("--sizes", default="10,100,1000,10000", help="历史消息数（逗号分隔）")
+    parser.add_argument("--backends", default="memory,redis,redis_writebehind", help="存储后端（逗号分隔）")
+    parser.add_argument("--redis-url", default=None, help="使用真实Redis（会清空该库），默认启动本地替身")
+    parser.add_argument("--min-time", type=float, default=0.2, help="每个用例的最短累计运行时间（秒）")
+    parser.add_argument("--max-reps", type=int, default=2000, help="每个用例的最多执行次数")
+    parser.add_argument("--output", default=None, help="结果JSON输出路径")
+    parser.add_argument("--baseline", default=None, help="对比的基线JSON")
+    parser.add_argument("--save-baseline", default=None, help="把本次结果保存为基线")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="中位数允许超出基线的比例")
+    parser.add_argument("--min-delta-us", type=float, default=5.0, help="小于该绝对差值（微秒）的变化不算回归")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, force=True)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    backends = args.backends.split(",")
+
+    standin = None
+    redis_client = None
+    if any(backend.startswith("redis") for backend in backends):
+        if args.redis_url:
+            redis_client = InstrumentedRedis.from_url(args.redis_url, decode_responses=True)
+        else:
+            standin, port = start_redis_standin()
+            redis_client = InstrumentedRedis(host="127.0.0.1", port=port, decode_responses=True)
+
+    loop = asyncio.new_event_loop()
+    results = {}
+    try:
+        for backend in backends:
+            results.update(bench_storage_backend(backend, redis_client, loop, sizes, args))
+        results.update(bench_serialization(sizes, args))
+    finally:
+        loop.close()
+        if standin is not None:
+            standin.terminate()
+            standin.wait()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "redis": args.redis_url or "redis_standin",
+        },
+        "results": results
+    }
+    for path in (args.output, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_us)
+        if regressions:
+            print(f"\n{len(regressions)} 个用例超出基线 {args.tolerance:.0%}")
+            sys.exit(1)
+        print("\n未发现回归")
+    else:
+        print(f"{'用例':<44}{'中位数(us)':>12}{'p95(us)':>12}{'次数':>8}")
+        for name, result in results.items():
+            print(f"{name:<44}{result['median_us']:>12.1f}{result['p95_us']:>12.1f}{result['reps']:>8}")
+
+
+if __name__ == "__main__":
+    main_benchmark()
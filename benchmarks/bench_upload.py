@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+并发图片上传基准测试
+启动服务器后并发上传大图片，同时持续请求 /api 测量事件循环被阻塞的程度
+
+用法:
+    python benchmarks/bench_upload.py --uploads 40 --concurrency 8 --image-mb 8
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import signal
+import statistics
+import subprocess
+import time
+
+import httpx
+from PIL import Image
+
+from bench_server_modes import start_server, wait_until_ready
+
+
+def build_image(target_mb: float) -> bytes:
+    """生成接近目标大小的PNG图片（随机像素难以压缩）"""
+    side = int((target_mb * 1024 * 1024 / 3) ** 0.5)
+    image = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+async def run_benchmark(base_url: str, image: bytes, uploads: int, concurrency: int) -> dict:
+    """并发上传并采样 /api 延迟"""
+    upload_latencies, ping_latencies = [], []
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def upload():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/upload/image", files={"file": ("bench.png", image, "image/png")})
+                response.raise_for_status()
+                upload_latencies.append(time.perf_counter() - started)
+
+        async def ping():
+            while not done.is_set():
+                started = time.perf_counter()
+                await client.get("/api")
+                ping_latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(0.01)
+
+        pinger = asyncio.create_task(ping())
+        started = time.perf_counter()
+        await asyncio.gather(*(upload() for _ in range(uploads)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await pinger
+
+    return {
+        "uploads_per_second": uploads / elapsed,
+        "upload_p50": statistics.median(upload_latencies),
+        "upload_p99": percentile(upload_latencies, 0.99),
+        "ping_p50": statistics.median(ping_latencies),
+        "ping_p99": percentile(ping_latencies, 0.99),
+        "ping_max": max(ping_latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发图片上传基准测试")
+    parser.add_argument("--uploads", type=int, default=40, help="上传总次数")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发上传数")
+    parser.add_argument("--image-mb", type=float, default=8, help="测试图片大小（MB）")
+    parser.add_argument("--port", type=int, default=18010, help="服务端口")
+    args = parser.parse_args()
+
+    image = build_image(args.image_mb)
+    process = start_server("prod", args.port, workers=1)
+    try:
+        base_url = f"http://127.0.0.1:{args.port}"
+        wait_until_ready(f"{base_url}/api")
+        result = asyncio.run(run_benchmark(base_url, image, args.uploads, args.concurrency))
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    print(f"图片大小: {len(image) / (1024 * 1024):.2f}MB, 上传数: {args.uploads}, 并发: {args.concurrency}")
+    print(f"上传吞吐: {result['uploads_per_second']:.2f}/s, 上传延迟 p50/p99: {result['upload_p50'] * 1000:.0f}/{result['upload_p99'] * 1000:.0f}ms")
+    print(f"/api延迟 p50/p99/max: {result['ping_p50'] * 1000:.1f}/{result['ping_p99'] * 1000:.1f}/{result['ping_max'] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
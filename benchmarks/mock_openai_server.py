@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟OpenAI兼容API服务器
+实现 chat/completions（支持SSE流式与reasoning_content，用量中模拟提示词前缀缓存命中）和 images/generations 接口，
+可配置首token延迟、token间隔、错误率和429限流注入，用于不消耗上游额度的压测
+
+用法:
+    python benchmarks/mock_openai_server.py --port 9100 --ttft-ms 300 --token-delay-ms 20 --tokens 200
+
+应用侧将提供商的BASE_URL指向该服务器，例如:
+    DEEPSEEK_BASE_URL=http://127.0.0.1:9100/v1 DEEPSEEK_API_KEY=mock python start_server.py
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 1x1像素PNG，作为图片生成接口的返回
+_PIXEL_PNG_B64 = (
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+)
+
+
+@dataclass
+class MockSettings:
+    """模拟服务器行为配置"""
+    ttft_ms: float = 300.0  # 首个token前的等待时间
+    token_delay_ms: float = 20.0  # token之间的间隔
+    tokens: int = 100  # 每次回复的内容token数
+    reasoning_tokens: int = 0  # 回复前输出的reasoning_content token数
+    error_rate: float = 0.0  # 返回500的概率
+    rate_limit_rate: float = 0.0  # 返回429的概率
+    image_delay_ms: float = 1000.0  # 图片生成耗时
+
+
+settings = MockSettings()
+app = FastAPI(title="Mock OpenAI-compatible API")
+
+# 模拟提供商的提示词前缀缓存：记录见过的消息前缀摘要
+_seen_prefixes = set()
+_MAX_SEEN_PREFIXES = 100000
+
+
+def _error_response(status_code: int, message: str, error_type: str) -> JSONResponse:
+    headers = {"retry-after": "1"} if status_code == 429 else None
+    return JSONResponse(
+        status_code=status_code,
+        content={"error": {"message": message, "type": error_type, "code": str(status_code)}},
+        headers=headers
+    )
+
+
+def _injected_error() -> Optional[JSONResponse]:
+    """按配置的概率注入429或500错误"""
+    roll = random.random()
+    if roll < settings.rate_limit_rate:
+        return _error_response(429, "Rate limit reached (mock)", "rate_limit_error")
+    if roll < settings.rate_limit_rate + settings.error_rate:
+        return _error_response(500, "Internal server error (mock)", "server_error")
+    return None
+
+
+def _message_chars(message) -> int:
+    content = message.get("content")
+    if isinstance(content, list):
+        content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return len(content or "")
+
+
+def _count_prompt_tokens(messages) -> int:
+    """粗略估算提示词token数（按字符数/4）"""
+    return max(1, sum(_message_chars(message) for message in messages) // 4)
+
+
+def _count_cached_tokens(messages) -> int:
+    """按整条消息模拟前缀缓存：返回此前请求中出现过的最长消息前缀的token数"""
+    digest = hashlib.sha256()
+    chars, cached_chars, prefixes = 0, 0, []
+    for message in messages:
+        digest.update(json.dumps(message, sort_keys=True, ensure_ascii=False).encode())
+        chars += _message_chars(message)
+        prefix = digest.copy().hexdigest()
+        if prefix in _seen_prefixes:
+            cached_chars = chars
+        prefixes.append(prefix)
+    if len(_seen_prefixes) > _MAX_SEEN_PREFIXES:
+        _seen_prefixes.clear()
+    _seen_prefixes.update(prefixes)
+    return cached_chars // 4
+
+
+def _usage(prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> dict:
+    """DeepSeek格式的用量（含前缀缓存命中/未命中token数）"""
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_cache_hit_tokens": cached_tokens,
+        "prompt_cache_miss_tokens": prompt_tokens - cached_tokens
+    }
+
+
+def _chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+    data = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _stream_completion(completion_id: str, model: str, prompt_tokens: int, cached_tokens: int, include_usage: bool):
+    await asyncio.sleep(settings.ttft_ms / 1000)
+    yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+
+    for index in range(settings.reasoning_tokens):
+        if index:
+            await asyncio.sleep(settings.token_delay_ms / 1000)
+        yield _chunk(completion_id, model, {"reasoning_content": f"思考{index} "})
+
+    for index in range(settings.tokens):
+        if index or settings.reasoning_tokens:
+            await asyncio.sleep(settings.token_delay_ms / 1000)
+        yield _chunk(completion_id, model, {"content": f"词{index} "})
+
+    yield _chunk(completion_id, model, {}, finish_reason="stop")
+    if include_usage:
+        completion_tokens = settings.tokens + settings.reasoning_tokens
+        usage = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [],
+            "usage": _usage(prompt_tokens, cached_tokens, completion_tokens)
+        }
+        yield f"data: {json.dumps(usage)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    """模拟Chat Completions接口"""
+    body = await request.json()
+    error = _injected_error()
+    if error is not None:
+        return error
+
+    model = body.get("model", "mock-model")
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    prompt_tokens = _count_prompt_tokens(body.get("messages", []))
+    cached_tokens = min(prompt_tokens, _count_cached_tokens(body.get("messages", [])))
+
+    if body.get("stream"):
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+        return StreamingResponse(
+            _stream_completion(completion_id, model, prompt_tokens, cached_tokens, include_usage),
+            media_type="text/event-stream"
+        )
+
+    await asyncio.sleep((settings.ttft_ms + settings.token_delay_ms * settings.tokens) / 1000)
+    message = {"role": "assistant", "content": "".join(f"词{index} " for index in range(settings.tokens))}
+    if settings.reasoning_tokens:
+        message["reasoning_content"] = "".join(f"思考{index} " for index in range(settings.reasoning_tokens))
+    completion_tokens = settings.tokens + settings.reasoning_tokens
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+        "usage": _usage(prompt_tokens, cached_tokens, completion_tokens)
+    }
+
+
+@app.post("/v1/images/generations")
+async def image_generations(request: Request):
+    """模拟图片生成接口"""
+    body = await request.json()
+    error = _injected_error()
+    if error is not None:
+        return error
+
+    await asyncio.sleep(settings.image_delay_ms / 1000)
+    if body.get("response_format") == "b64_json":
+        item = {"b64_json": _PIXEL_PNG_B64, "revised_prompt": body.get("prompt")}
+    else:
+        item = {"url": f"data:image/png;base64,{_PIXEL_PNG_B64}", "revised_prompt": body.get("prompt")}
+    return {"created": int(time.time()), "data": [item]}
+
+
+@app.get("/v1/models")
+async def list_models():
+    """模拟模型列表接口"""
+    return {"object": "list", "data": [{"id": "mock-model", "object": "model", "owned_by": "mock"}]}
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    """添加模拟服务器行为参数（压测脚本复用）"""
+    parser.add_argument("--ttft-ms", type=float, default=MockSettings.ttft_ms, help="首个token延迟（毫秒）")
+    parser.add_argument("--token-delay-ms", type=float, default=MockSettings.token_delay_ms, help="token间隔（毫秒）")
+    parser.add_argument("--tokens", type=int, default=MockSettings.tokens, help="每次回复的内容token数")
+    parser.add_argument("--reasoning-tokens", type=int, default=MockSettings.reasoning_tokens, help="reasoning_content token数")
+    parser.add_argument("--error-rate", type=float, default=MockSettings.error_rate, help="返回500的概率")
+    parser.add_argument("--rate-limit-rate", type=float, default=MockSettings.rate_limit_rate, help="返回429的概率")
+    parser.add_argument("--image-delay-ms", type=float, default=MockSettings.image_delay_ms, help="图片生成耗时（毫秒）")
+
+
+def mock_arguments_to_cli(args: argparse.Namespace) -> list:
+    """把解析后的模拟参数转换回命令行参数，用于启动子进程"""
+    return [
+        "--ttft-ms", str(args.ttft_ms),
+        "--token-delay-ms", str(args.token_delay_ms),
+        "--tokens", str(args.tokens),
+        "--reasoning-tokens", str(args.reasoning_tokens),
+        "--error-rate", str(args.error_rate),
+        "--rate-limit-rate", str(args.rate_limit_rate),
+        "--image-delay-ms", str(args.image_delay_ms),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟OpenAI兼容API服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    settings.ttft_ms = args.ttft_ms
+    settings.token_delay_ms = args.token_delay_ms
+    settings.tokens = args.tokens
+    settings.reasoning_tokens = args.reasoning_tokens
+    settings.error_rate = args.error_rate
+    settings.rate_limit_rate = args.rate_limit_rate
+    settings.image_delay_ms = args.image_delay_ms
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
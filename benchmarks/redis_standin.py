@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地Redis替身服务器
+实现RESP2协议和应用用到的命令子集（列表、哈希、字符串、过期、MULTI/EXEC/WATCH），
+没有安装Redis的环境中基准测试仍能走redis-py真实的序列化和socket路径。
+过期时间只记录不执行，数据全部在内存中
+
+用法:
+    python benchmarks/redis_standin.py --port 16379
+"""
+
+import argparse
+import asyncio
+import fnmatch
+from typing import Any, Dict, List
+
+
+class CommandError(Exception):
+    """命令执行错误，以RESP错误返回"""
+
+
+class RedisStandin:
+    """命令实现"""
+
+    def __init__(self):
+        self.data: Dict[bytes, Any] = {}
+        self.ttls: Dict[bytes, int] = {}
+
+    def execute(self, args: List[bytes]) -> Any:
+        name = args[0].decode().upper()
+        handler = getattr(self, f"cmd_{name.lower()}", None)
+        if handler is None:
+            raise CommandError(f"ERR unknown command '{name}'")
+        return handler(*args[1:])
+
+    def _get(self, key: bytes, kind: type):
+        value = self.data.get(key)
+        if value is not None and not isinstance(value, kind):
+            raise CommandError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    # 连接
+    def cmd_ping(self, *args):
+        return args[0] if args else "PONG"
+
+    def cmd_echo(self, message):
+        return message
+
+    def cmd_select(self, db):
+        return "OK"
+
+    def cmd_client(self, *args):
+        return "OK"
+
+    def cmd_flushdb(self, *args):
+        self.data.clear()
+        self.ttls.clear()
+        return "OK"
+
+    # 通用
+    def cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            if self.data.pop(key, None) is not None:
+                removed += 1
+            self.ttls.pop(key, None)
+        return removed
+
+    def cmd_exists(self, *keys):
+        return sum(1 for key in keys if key in self.data)
+
+    def cmd_expire(self, key, seconds):
+        if key not in self.data:
+            return 0
+        self.ttls[key] = int(seconds)
+        return 1
+
+    def cmd_ttl(self, key):
+        if key not in self.data:
+            return -2
+        return self.ttls.get(key, -1)
+
+    def cmd_keys(self, pattern):
+        return [key for key in self.data if fnmatch.fnmatchcase(key.decode(), pattern.decode())]
+
+    # 字符串
+    def cmd_get(self, key):
+        return self._get(key, bytes)
+
+    def cmd_set(self, key, value, *options):
+        self.data[key] = value
+        self.ttls.pop(key, None)
+        options = [option.upper() for option in options]
+        if b"EX" in options:
+            self.ttls[key] = int(options[options.index(b"EX") + 1])
+        return "OK"
+
+    def cmd_incrby(self, key, amount):
+        value = int(self._get(key, bytes) or 0) + int(amount)
+        self.data[key] = str(value).encode()
+        return value
+
+    def cmd_incr(self, key):
+        return self.cmd_incrby(key, b"1")
+
+    # 列表
+    def cmd_lpush(self, key, *values):
+        items = self._get(key, list)
+        if items is None:
+            items = self.data[key] = []
+        for value in values:
+            items.insert(0, value)
+        return len(items)
+
+    def cmd_rpush(self, key, *values):
+        items = self._get(key, list)
+        if items is None:
+            items = self.data[key] = []
+        items.extend(values)
+        return len(items)
+
+    def cmd_llen(self, key):
+        return len(self._get(key, list) or [])
+
+    @staticmethod
+    def _slice(length: int, start: int, stop: int) -> slice:
+        start = max(0, length + start if start < 0 else start)
+        stop = length + stop if stop < 0 else stop
+        return slice(start, stop + 1)
+
+    def cmd_lrange(self, key, start, stop):
+        items = self._get(key, list) or []
+        return items[self._slice(len(items), int(start), int(stop))]
+
+    def cmd_ltrim(self, key, start, stop):
+        items = self._get(key, list)
+        if items is not None:
+            items[:] = items[self._slice(len(items), int(start), int(stop))]
+        return "OK"
+
+    # 哈希
+    def cmd_hset(self, key, *pairs):
+        if not pairs or len(pairs) % 2:
+            raise CommandError("ERR wrong number of arguments for 'hset' command")
+        fields = self._get(key, dict)
+        if fields is None:
+            fields = self.data[key] = {}
+        added = 0
+        for index in range(0, len(pairs), 2):
+            added += pairs[index] not in fields
+            fields[pairs[index]] = pairs[index + 1]
+        return added
+
+    def cmd_hget(self, key, field):
+        return (self._get(key, dict) or {}).get(field)
+
+    def cmd_hmget(self, key, *fields):
+        values = self._get(key, dict) or {}
+        return [values.get(field) for field in fields]
+
+    def cmd_hgetall(self, key):
+        result = []
+        for field, value in (self._get(key, dict) or {}).items():
+            result.extend((field, value))
+        return result
+
+    def cmd_hdel(self, key, *fields):
+        values = self._get(key, dict) or {}
+        return sum(1 for field in fields if values.pop(field, None) is not None)
+
+    def cmd_hlen(self, key):
+        return len(self._get(key, dict) or {})
+
+    def cmd_hincrby(self, key, field, amount):
+        fields = self._get(key, dict)
+        if fields is None:
+            fields = self.data[key] = {}
+        value = int(fields.get(field, b"0")) + int(amount)
+        fields[field] = str(value).encode()
+        return value
+
+
+def encode(value: Any) -> bytes:
+    """把Python值编码为RESP2"""
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, CommandError):
+        return f"-{value}\r\n".encode()
+    if isinstance(value, str):
+        return f"+{value}\r\n".encode()
+    if isinstance(value, bool):
+        return f":{int(value)}\r\n".encode()
+    if isinstance(value, int):
+        return f":{value}\r\n".encode()
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(encode(item) for item in value)
+    raise TypeError(f"无法编码的类型: {type(value)}")
+
+
+async def read_command(reader: asyncio.StreamReader) -> List[bytes]:
+    """读取一条RESP数组命令"""
+    header = await reader.readline()
+    if not header:
+        raise ConnectionError
+    if not header.startswith(b"*"):
+        # 内联命令
+        return header.strip().split()
+    args = []
+    for _ in range(int(header[1:])):
+        length = int((await reader.readline())[1:])
+        args.append((await reader.readexactly(length + 2))[:-2])
+    return args
+
+
+async def handle_client(store: RedisStandin, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    queued = None  # MULTI之后排队的命令
+    try:
+        while True:
+            args = await read_command(reader)
+            if not args:
+                continue
+            name = args[0].upper()
+            if name == b"MULTI":
+                queued = []
+                reply = "OK"
+            elif name == b"EXEC":
+                replies = []
+                for command in queued or []:
+                    try:
+                        replies.append(store.execute(command))
+                    except CommandError as e:
+                        replies.append(e)
+                queued = None
+                reply = replies
+            elif name in (b"WATCH", b"UNWATCH"):
+                # 单线程执行且事务之间没有交错，被监视的键不会在EXEC前被其他连接修改
+                reply = "OK"
+            elif name == b"DISCARD":
+                queued = None
+                reply = "OK"
+            elif queued is not None:
+                queued.append(args)
+                reply = "QUEUED"
+            else:
+                try:
+                    reply = store.execute(args)
+                except CommandError as e:
+                    reply = e
+            writer.write(encode(reply))
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int):
+    store = RedisStandin()
+    server = await asyncio.start_server(lambda r, w: handle_client(store, r, w), host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地Redis替身服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=16379)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
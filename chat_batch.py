@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量对话模块
+一次提交多条提示词，按提供商限制并发执行（所有批次共享同一组限制，避免多个批次叠加压垮上游），
+每条完成后立即返回结果，并附带排队耗时、执行耗时和失败原因
+"""
+
+import time
+import asyncio
+import logging
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# 单条结果状态
+BATCH_ITEM_SUCCEEDED = "succeeded"
+BATCH_ITEM_FAILED = "failed"
+
+
+class ChatBatchRunner:
+    """批量对话执行器：每条提示词一个协程 + 按提供商的并发限制 + 按完成顺序输出"""
+
+    def __init__(
+        self,
+        handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        provider_concurrency: int = 4,
+        item_timeout: float = 120.0
+    ):
+        """
+        初始化批量对话执行器
+
+        Args:
+            handler: 执行单条提示词的协程函数，参数为条目（必须包含provider），返回结果字段
+            provider_concurrency: 每个提供商同时执行的条目数上限
+            item_timeout: 单条执行超时时间（秒，不含排队时间）
+        """
+        self.handler = handler
+        self.provider_concurrency = provider_concurrency
+        self.item_timeout = item_timeout
+        self._provider_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _get_provider_semaphore(self, provider: str) -> asyncio.Semaphore:
+        if provider not in self._provider_semaphores:
+            self._provider_semaphores[provider] = asyncio.Semaphore(self.provider_concurrency)
+        return self._provider_semaphores[provider]
+
+    async def _run_item(self, index: int, item: Dict[str, Any]) -> Dict[str, Any]:
+        queued_at = time.perf_counter()
+        result = {"type": "result", "index": index, "id": item.get("id"), "provider": item["provider"]}
+        async with self._get_provider_semaphore(item["provider"]):
+            started_at = time.perf_counter()
+            try:
+                result.update(await asyncio.wait_for(self.handler(item), timeout=self.item_timeout))
+                result["status"] = BATCH_ITEM_SUCCEEDED
+            except asyncio.TimeoutError:
+                result.update(status=BATCH_ITEM_FAILED, error=f"执行超时（{self.item_timeout:g}秒）")
+            except Exception as e:
+                result.update(status=BATCH_ITEM_FAILED, error=str(e))
+            finished_at = time.perf_counter()
+        result["queue_ms"] = round((started_at - queued_at) * 1000, 1)
+        result["latency_ms"] = round((finished_at - started_at) * 1000, 1)
+        return result
+
+    async def run(self, items: List[Dict[str, Any]]) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        执行一批条目，按完成顺序逐条输出结果，最后输出汇总
+
+        调用方停止迭代（如客户端断开）时取消尚未完成的条目
+
+        Args:
+            items: 条目列表，每个条目必须包含provider
+
+        Yields:
+            Dict[str, Any]: 单条结果（type为result），最后一条为汇总（type为summary）
+        """
+        started = time.perf_counter()
+        tasks = [
+            asyncio.create_task(self._run_item(index, item), name=f"chat-batch-item-{index}")
+            for index, item in enumerate(items)
+        ]
+        failed = 0
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                failed += result["status"] == BATCH_ITEM_FAILED
+                yield result
+        finally:
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+                logger.warning(f"批量对话提前结束，已取消 {len(pending)} 条未完成的条目")
+
+        elapsed = time.perf_counter() - started
+        logger.info("批量对话完成 - 条目数: %d, 失败: %d, 耗时: %.0fms", len(items), failed, elapsed * 1000)
+        yield {
+            "type": "summary",
+            "total": len(items),
+            "succeeded": len(items) - failed,
+            "failed": failed,
+            "elapsed_ms": round(elapsed * 1000, 1)
+        }
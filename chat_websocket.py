@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WebSocket聊天传输模块
+一个连接上同时进行多个会话的流式对话：客户端为每次对话指定request_id，服务端把流式片段
+按request_id转发，客户端可以随时取消某个请求。所有发送经过一个有界队列由单个协程写出，
+客户端读取慢时反压到各个流
+
+客户端消息:
+    {"type": "chat", "request_id": "...", "user_id": "...", "session_id": "...", "message": "...", ...}
+    {"type": "cancel", "request_id": "..."}
+    {"type": "ping"}
+
+服务端消息:
+    {"request_id": "...", "data": {...}}  data与 /chat/stream 的SSE事件相同（content、reasoning、end、error），
+    取消后为 {"type": "cancelled"}；与具体请求无关的消息request_id为null
+"""
+
+import json
+import asyncio
+import logging
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Set
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+logger = logging.getLogger(__name__)
+
+
+def encode_frame(request_id: Optional[str], data: Dict[str, Any]) -> str:
+    """编码一条服务端消息"""
+    return json.dumps({"request_id": request_id, "data": data}, ensure_ascii=False)
+
+
+def encode_chunk(request_id_json: str, chunk: str) -> str:
+    """
+    把 /chat/stream 的SSE片段转换为WebSocket消息，直接嵌入片段中的JSON，不重新解析
+
+    Args:
+        request_id_json: JSON编码后的request_id
+        chunk: SSE片段（"data: {...}\\n\\n"），提供商出错时可能是纯文本
+
+    Returns:
+        str: WebSocket消息
+    """
+    if chunk.startswith("data: "):
+        return f'{{"request_id":{request_id_json},"data":{chunk[6:].rstrip()}}}'
+    return f'{{"request_id":{request_id_json},"data":{json.dumps({"type": "error", "content": chunk.strip()}, ensure_ascii=False)}}}'
+
+
+class ChatWebSocketSession:
+    """一个WebSocket连接上的多路复用对话"""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        open_stream: Callable[[Dict[str, Any]], Awaitable[AsyncIterator[str]]],
+        max_streams: int = 8,
+        send_queue_size: int = 256
+    ):
+        """
+        初始化WebSocket对话
+
+        Args:
+            websocket: 已接受的WebSocket连接
+            open_stream: 校验chat消息并返回SSE片段流的协程函数，校验失败时抛出异常（HTTPException的detail作为错误信息）
+            max_streams: 同时进行的请求数上限
+            send_queue_size: 待发送消息队列长度
+        """
+        self.websocket = websocket
+        self.open_stream = open_stream
+        self.max_streams = max_streams
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=send_queue_size)
+        self._streams: Dict[str, asyncio.Task] = {}
+        # 已开始执行的请求（任务在首次运行前被取消时协程不会执行，需要由接收方发送cancelled）
+        self._started: Set[str] = set()
+        self._closing = False
+
+    async def run(self):
+        """处理客户端消息直到连接断开，断开时取消所有进行中的请求"""
+        sender = asyncio.create_task(self._sender(), name="chat-ws-sender")
+        try:
+            while True:
+                try:
+                    text = await self.websocket.receive_text()
+                except WebSocketDisconnect:
+                    break
+                await self._handle(text)
+        finally:
+            self._closing = True
+            streams = list(self._streams.values())
+            for task in streams:
+                task.cancel()
+            await asyncio.gather(*streams, return_exceptions=True)
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+            if streams:
+                logger.info(f"WebSocket连接断开，已取消 {len(streams)} 个进行中的请求")
+
+    async def _sender(self):
+        while True:
+            text = await self._outbox.get()
+            try:
+                await self.websocket.send_text(text)
+            except Exception as e:
+                # 连接已断开，接收循环随后会退出
+                logger.debug("WebSocket发送失败: %s", e)
+                return
+
+    async def _handle(self, text: str):
+        try:
+            message = json.loads(text)
+            message_type = message.get("type")
+            request_id = message.get("request_id")
+        except (ValueError, AttributeError):
+            await self._outbox.put(encode_frame(None, {"type": "error", "content": "消息必须是JSON对象"}))
+            return
+
+        if message_type == "ping":
+            await self._outbox.put(encode_frame(None, {"type": "pong"}))
+            return
+
+        if not isinstance(request_id, str) or not request_id:
+            await self._outbox.put(encode_frame(None, {"type": "error", "content": "缺少request_id"}))
+            return
+
+        if message_type == "cancel":
+            task = self._streams.get(request_id)
+            if task is not None:
+                if request_id not in self._started:
+                    await self._outbox.put(encode_frame(request_id, {"type": "cancelled"}))
+                task.cancel()
+            return
+
+        if message_type != "chat":
+            await self._outbox.put(encode_frame(request_id, {"type": "error", "content": f"不支持的消息类型: {message_type}"}))
+        elif request_id in self._streams:
+            await self._outbox.put(encode_frame(request_id, {"type": "error", "content": "request_id正在使用中"}))
+        elif len(self._streams) >= self.max_streams:
+            await self._outbox.put(encode_frame(request_id, {"type": "error", "content": f"同时进行的请求数不能超过{self.max_streams}"}))
+        else:
+            task = asyncio.create_task(self._run_stream(request_id, message), name=f"chat-ws-{request_id[:16]}")
+            self._streams[request_id] = task
+            task.add_done_callback(lambda _: (self._streams.pop(request_id, None), self._started.discard(request_id)))
+
+    async def _run_stream(self, request_id: str, message: Dict[str, Any]):
+        self._started.add(request_id)
+        request_id_json = json.dumps(request_id, ensure_ascii=False)
+        try:
+            try:
+                stream = await self.open_stream(message)
+            except Exception as e:
+                await self._outbox.put(encode_frame(request_id, {"type": "error", "content": str(getattr(e, "detail", None) or e)}))
+                return
+
+            # aclosing保证取消时流的finally（指标、用量记录）立即执行
+            async with aclosing(stream):
+                async for chunk in stream:
+                    if chunk:
+                        await self._outbox.put(encode_chunk(request_id_json, chunk))
+        except asyncio.CancelledError:
+            if self._closing:
+                raise
+            # 客户端取消：在本任务内发送，保证cancelled是该请求的最后一条消息
+            await self._outbox.put(encode_frame(request_id, {"type": "cancelled"}))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP响应压缩模块
+按Accept-Encoding协商压缩编码（brotli优先于gzip），未安装brotli时只使用gzip
+"""
+
+import gzip
+from typing import Dict, Iterable, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 服务端支持的编码，按优先级排列
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+# 动态响应使用的压缩级别（兼顾压缩率和CPU耗时，预压缩的静态资源使用最高级别）
+DYNAMIC_LEVELS = {"br": 4, "gzip": 6}
+# 值得压缩的内容类型
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/x-javascript",
+    "application/x-ndjson",
+    "image/svg+xml",
+)
+
+
+def is_compressible(media_type: Optional[str]) -> bool:
+    """判断内容类型是否值得压缩（图片等已压缩格式不再压缩）"""
+    return bool(media_type) and media_type.split(";")[0].strip().lower().startswith(COMPRESSIBLE_TYPES)
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """
+    解析Accept-Encoding请求头
+
+    Args:
+        header: 请求头的值，如 "br;q=1.0, gzip;q=0.8, *;q=0.1"
+
+    Returns:
+        Dict[str, float]: 编码（小写）到q值的映射
+    """
+    result = {}
+    if not header:
+        return result
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        result[name] = q
+    return result
+
+
+def choose_encoding(accept_encoding: Optional[str], available: Iterable[str] = SUPPORTED_ENCODINGS) -> Optional[str]:
+    """
+    在可用编码中选择客户端接受的编码
+
+    q值高者优先，q值相同时按available的顺序；q=0表示拒绝
+
+    Args:
+        accept_encoding: Accept-Encoding请求头的值
+        available: 可用的编码，按服务端优先级排列
+
+    Returns:
+        Optional[str]: 选中的编码，没有可用编码时返回None（不压缩）
+    """
+    accepted = parse_accept_encoding(accept_encoding)
+    if not accepted:
+        return None
+    wildcard = accepted.get("*", 0.0)
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = accepted.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """
+    按指定编码压缩数据
+
+    Args:
+        data: 原始数据
+        encoding: br或gzip
+        level: 压缩级别（brotli为0-11，gzip为1-9），为None时使用最高级别（适合预压缩）
+
+    Returns:
+        bytes: 压缩后的数据
+    """
+    if encoding == "br":
+        if brotli is None:
+            raise ValueError("未安装brotli，不支持br编码")
+        return brotli.compress(data, quality=11 if level is None else level)
+    if encoding == "gzip":
+        # mtime固定为0，相同内容的压缩结果相同
+        return gzip.compress(data, compresslevel=9 if level is None else level, mtime=0)
+    raise ValueError(f"不支持的压缩编码: {encoding}")
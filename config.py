@@ -6,12 +6,49 @@
 """
 
 import os
+import time
 import logging
-from typing import Optional, List
-from dotenv import load_dotenv
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Mapping, Optional, List, Tuple
+from dotenv import dotenv_values, find_dotenv, load_dotenv
+
+# 进程启动时已存在的环境变量优先于.env文件，重新加载配置时保持同样的优先级。
+# 启动脚本（如多worker的主进程）加载.env后，worker继承的环境变量中已包含.env中的变量，
+# 因此在首次加载前把真正的进程环境变量名记录到环境变量中，由子进程沿用
+_PROCESS_ENV_KEYS_VAR = 'CONFIG_PROCESS_ENV_KEYS'
+if _PROCESS_ENV_KEYS_VAR in os.environ:
+    _PROCESS_ENV_KEYS = frozenset(filter(None, os.environ[_PROCESS_ENV_KEYS_VAR].split(',')))
+else:
+    _PROCESS_ENV_KEYS = frozenset(os.environ)
+    os.environ[_PROCESS_ENV_KEYS_VAR] = ','.join(sorted(_PROCESS_ENV_KEYS))
+# 指定了CONFIG_RELOAD_FILE时从该文件加载，否则查找.env
+_DOTENV_PATH = os.getenv('CONFIG_RELOAD_FILE') or find_dotenv()
 
 # 加载环境变量
-load_dotenv()
+load_dotenv(_DOTENV_PATH)
+
+
+def _freeze(value: Any) -> Any:
+    """把配置字典（含嵌套字典）转换为只读映射"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    return value
+
+
+@dataclass(frozen=True)
+class ProviderConfigSnapshot:
+    """AI提供商配置快照：加载时计算一次，只读，重新加载配置时整体替换"""
+    version: int
+    configs: Mapping[str, Mapping[str, Any]]  # 已配置API Key的提供商配置（录制/回放时为包装后的配置）
+    default_provider: str  # 生效的默认提供商（配置的默认提供商不可用时为第一个已配置的提供商）
+    loaded_at: float
+
+    @property
+    def configured_providers(self) -> List[str]:
+        """已配置的提供商名称列表"""
+        return list(self.configs)
+
 
 class Config:
     """应用配置类"""
@@ -34,6 +71,10 @@ class Config:
     # AI提供商配置
     DEFAULT_AI_PROVIDER: str = os.getenv('DEFAULT_AI_PROVIDER', 'deepseek')
 
+    # 配置热加载：修改该文件或向进程发送SIGHUP时重新读取提供商配置（API Key、地址、模型等）和默认提供商
+    CONFIG_RELOAD_FILE: str = _DOTENV_PATH or '.env'
+    CONFIG_RELOAD_INTERVAL: float = float(os.getenv('CONFIG_RELOAD_INTERVAL', 0))  # 检查文件修改的间隔（秒），0表示只响应SIGHUP（多worker部署时需大于0）
+
     # AI提供商默认配置
     _DEFAULT_AI_CONFIG = {
         'max_tokens': 1000,
@@ -80,7 +121,8 @@ class Config:
             'base_url': os.getenv(f'{provider_upper}_BASE_URL', provider_defaults.get('base_url', '')),
             'model': os.getenv(f'{provider_upper}_MODEL', provider_defaults.get('model', '')),
             'max_tokens': int(os.getenv(f'{provider_upper}_MAX_TOKENS', cls._DEFAULT_AI_CONFIG['max_tokens'])),
-            'temperature': float(os.getenv(f'{provider_upper}_TEMPERATURE', cls._DEFAULT_AI_CONFIG['temperature']))
+            'temperature': float(os.getenv(f'{provider_upper}_TEMPERATURE', cls._DEFAULT_AI_CONFIG['temperature'])),
+            'image_max_dimension': int(os.getenv(f'{provider_upper}_IMAGE_MAX_DIMENSION', 0))  # 0表示使用提供商默认值
         }
 
     # AI提供商配置 - 动态生成
@@ -89,6 +131,10 @@ class Config:
         """获取所有AI提供商配置"""
         return {provider: cls._build_provider_config(provider) for provider in cls._AI_PROVIDERS_INFO.keys()}
 
+    # 当前的提供商配置快照，以及上次从配置文件读取的变量名
+    _snapshot: Optional[ProviderConfigSnapshot] = None
+    _dotenv_keys: frozenset = frozenset(dotenv_values(_DOTENV_PATH)) if _DOTENV_PATH else frozenset()
+
     # 延迟初始化AI提供商配置
     @property
     def AI_PROVIDERS_CONFIG(self) -> dict:
@@ -98,17 +144,99 @@ class Config:
 
     # 对话配置
     MAX_HISTORY_MESSAGES: int = int(os.getenv('MAX_HISTORY_MESSAGES', 20))  # 最大历史消息数
+    # 历史窗口起点按该条数对齐移动，窗口不再每轮滑动，提示词前缀保持稳定以命中提供商缓存；
+    # 发送的历史消息数在 MAX_HISTORY_MESSAGES-PROMPT_WINDOW_STEP+1 到 MAX_HISTORY_MESSAGES 之间，1表示逐条滑动
+    PROMPT_WINDOW_STEP: int = int(os.getenv('PROMPT_WINDOW_STEP', 1))
+    # 会话绑定首次使用的提供商，未指定提供商的后续请求继续使用该提供商
+    SESSION_PROVIDER_AFFINITY: bool = os.getenv('SESSION_PROVIDER_AFFINITY', 'True').lower() == 'true'
     MAX_MESSAGE_LENGTH: int = int(os.getenv('MAX_MESSAGE_LENGTH', 50))  # 会话列表中显示的最大消息长度
 
+    # 对话压缩配置：较早的消息在后台合并为滚动摘要，上下文发送 摘要 + 最近消息
+    COMPACTION_ENABLED: bool = os.getenv('COMPACTION_ENABLED', 'False').lower() == 'true'
+    COMPACTION_THRESHOLD: int = int(os.getenv('COMPACTION_THRESHOLD', 30))  # 未被摘要覆盖的消息数超过该值时触发压缩（不超过历史窗口大小-1）
+    COMPACTION_KEEP_RECENT: int = int(os.getenv('COMPACTION_KEEP_RECENT', 10))  # 压缩时保留原文的最近消息数
+    COMPACTION_PROVIDER: str = os.getenv('COMPACTION_PROVIDER', '')  # 生成摘要的提供商，空表示默认提供商
+    COMPACTION_MODEL: str = os.getenv('COMPACTION_MODEL', '')  # 生成摘要的模型（建议使用低成本模型），空表示提供商默认模型
+    COMPACTION_MAX_TOKENS: int = int(os.getenv('COMPACTION_MAX_TOKENS', 500))  # 摘要最大token数
+
+    # token用量账本配置
+    USAGE_FLUSH_INTERVAL: float = float(os.getenv('USAGE_FLUSH_INTERVAL', 1.0))  # 用量批量写入Redis的间隔（秒）
+    USAGE_RETENTION_DAYS: int = int(os.getenv('USAGE_RETENTION_DAYS', 90))  # 用量数据保留天数
+    USAGE_DAILY_TOKEN_QUOTA: int = int(os.getenv('USAGE_DAILY_TOKEN_QUOTA', 0))  # 每个用户每天（UTC）的token上限，0表示不限制
+
+    # 批量对话配置
+    BATCH_MAX_ITEMS: int = int(os.getenv('BATCH_MAX_ITEMS', 500))  # 单次批量请求的最大条目数
+    BATCH_PROVIDER_CONCURRENCY: int = int(os.getenv('BATCH_PROVIDER_CONCURRENCY', 4))  # 每个提供商同时执行的条目数（所有批次共享）
+    BATCH_ITEM_TIMEOUT: float = float(os.getenv('BATCH_ITEM_TIMEOUT', 120))  # 单条执行超时时间（秒，不含排队）
+
+    # WebSocket聊天配置
+    WS_MAX_STREAMS: int = int(os.getenv('WS_MAX_STREAMS', 8))  # 每个连接同时进行的请求数上限
+    WS_SEND_QUEUE_SIZE: int = int(os.getenv('WS_SEND_QUEUE_SIZE', 256))  # 每个连接待发送的消息数上限，超出时反压到各个流
+
+    # 图片上传配置
+    MAX_UPLOAD_SIZE: int = int(os.getenv('MAX_UPLOAD_SIZE', 10 * 1024 * 1024))  # 单张图片最大字节数（10MB）
+    IMAGE_WORKERS: int = int(os.getenv('IMAGE_WORKERS', 4))  # 图片校验/编码线程池大小
+    IMAGE_MAX_CONCURRENCY: int = int(os.getenv('IMAGE_MAX_CONCURRENCY', 8))  # 同时处理的图片数上限（限制内存占用）
+    IMAGE_PREPROCESS_WORKERS: int = int(os.getenv('IMAGE_PREPROCESS_WORKERS', 2))  # 视觉图片预处理进程池大小
+    IMAGE_PREPROCESS_CACHE_SIZE: int = int(os.getenv('IMAGE_PREPROCESS_CACHE_SIZE', 128))  # 预处理结果缓存条目数
+
+    # 图片生成任务队列配置
+    IMAGE_JOB_WORKERS: int = int(os.getenv('IMAGE_JOB_WORKERS', 4))  # 处理任务的worker协程数
+    IMAGE_JOB_PROVIDER_CONCURRENCY: int = int(os.getenv('IMAGE_JOB_PROVIDER_CONCURRENCY', 2))  # 每个提供商同时执行的任务数
+    IMAGE_JOB_QUEUE_SIZE: int = int(os.getenv('IMAGE_JOB_QUEUE_SIZE', 100))  # 排队任务数上限
+    IMAGE_JOB_TTL: int = int(os.getenv('IMAGE_JOB_TTL', 3600))  # 任务状态保留时间（秒）
+
+    # 生成图片缓存配置
+    GENERATED_IMAGE_CACHE_DIR: str = os.getenv('GENERATED_IMAGE_CACHE_DIR', os.path.join('cache', 'generated_images'))
+    GENERATED_IMAGE_CACHE_MAX_BYTES: int = int(os.getenv('GENERATED_IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024))  # 缓存总大小上限（512MB）
+
+    # 消息写缓冲配置（Redis存储时生效）
+    MESSAGE_WRITE_BEHIND: bool = os.getenv('MESSAGE_WRITE_BEHIND', 'True').lower() == 'true'  # 消息先放入进程内缓冲区，由后台任务批量写入Redis
+    MESSAGE_FLUSH_DELAY: float = float(os.getenv('MESSAGE_FLUSH_DELAY', 0.005))  # 收到消息后等待多久再写入，合并同一时段的消息（秒）
+    MESSAGE_FLUSH_BATCH: int = int(os.getenv('MESSAGE_FLUSH_BATCH', 500))  # 单个pipeline最多写入的消息数
+    MESSAGE_WRITE_MAX_PENDING: int = int(os.getenv('MESSAGE_WRITE_MAX_PENDING', 10000))  # 缓冲区消息数上限，达到后同步写入
+
+    # 响应压缩配置
+    COMPRESSION_ENABLED: bool = os.getenv('COMPRESSION_ENABLED', 'True').lower() == 'true'  # 按Accept-Encoding压缩JSON响应
+    COMPRESSION_MIN_SIZE: int = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))  # 小于该大小（字节）的响应不压缩
+    COMPRESSION_OFFLOAD_SIZE: int = int(os.getenv('COMPRESSION_OFFLOAD_SIZE', 64 * 1024))  # 不小于该大小（字节）的响应在线程池中压缩
+
+    # 静态资源配置
+    STATIC_BUILD_DIR: str = os.getenv('STATIC_BUILD_DIR', os.path.join('cache', 'static'))  # 预压缩静态资源的构建输出目录
+
     # 日志配置
     LOG_LEVEL: str = os.getenv('LOG_LEVEL', 'DEBUG' if DEBUG else 'INFO')
     LOG_DIR: str = os.getenv('LOG_DIR', 'logs')
     LOG_FILE: str = os.getenv('LOG_FILE', 'app.log')
+    LOG_FILE_FORMAT: str = os.getenv('LOG_FILE_FORMAT', 'json')  # 文件日志格式: json（结构化）或 text
+    LOG_QUEUE_SIZE: int = int(os.getenv('LOG_QUEUE_SIZE', 10000))  # 日志队列容量，队列满时丢弃新日志
+    # 热点路径日志采样率，格式 "logger名称=采样率,..."，只作用于INFO及以下级别
+    LOG_SAMPLING: str = os.getenv('LOG_SAMPLING', 'main.storage=0.1')
+
+    # 链路追踪配置
+    TRACING_EXPORTER: str = os.getenv('TRACING_EXPORTER', 'none')  # none、stdout、file 或自定义导出器 "模块路径:类名"
+    TRACING_FILE: str = os.getenv('TRACING_FILE', 'traces.jsonl')  # file导出器的输出文件（位于LOG_DIR下）
+    TRACING_SAMPLE_RATE: float = float(os.getenv('TRACING_SAMPLE_RATE', 1.0))  # 新trace的采样率
+
+    # 录制/回放配置（用于无网络环境下复现提供商延迟的性能测试）
+    REPLAY_MODE: str = os.getenv('REPLAY_MODE', '')  # 空表示关闭，record（录制真实提供商）或 replay（从夹具回放）
+    REPLAY_FIXTURE_DIR: str = os.getenv('REPLAY_FIXTURE_DIR', os.path.join('fixtures', 'replay'))
+    REPLAY_TIME_SCALE: float = float(os.getenv('REPLAY_TIME_SCALE', 1.0))  # 回放片段间隔的缩放系数，0表示不等待
+    REPLAY_STRICT: bool = os.getenv('REPLAY_STRICT', 'False').lower() == 'true'  # 回放时要求请求与夹具完全匹配
 
     # 服务器配置
     HOST: str = os.getenv('HOST', '0.0.0.0')
     PORT: int = int(os.getenv('PORT', 8000))
 
+    # 服务器运行模式: dev（单进程热重载）或 prod（多worker生产模式）
+    SERVER_MODE: str = os.getenv('SERVER_MODE', 'dev')
+    # 生产模式配置
+    WORKERS: int = int(os.getenv('WORKERS', 0))  # worker进程数，0表示按CPU核数自动计算
+    BACKLOG: int = int(os.getenv('BACKLOG', 2048))  # 监听socket的等待连接队列长度
+    KEEP_ALIVE_TIMEOUT: int = int(os.getenv('KEEP_ALIVE_TIMEOUT', 15))  # HTTP keep-alive空闲超时（秒）
+    GRACEFUL_SHUTDOWN_TIMEOUT: int = int(os.getenv('GRACEFUL_SHUTDOWN_TIMEOUT', 60))  # SIGTERM后等待进行中的流式响应完成的最长时间（秒）
+    MAX_REQUESTS_PER_WORKER: int = int(os.getenv('MAX_REQUESTS_PER_WORKER', 10000))  # worker处理多少请求后回收重启，0表示不回收
+
     @classmethod
     def get_redis_config(cls) -> dict:
         """获取Redis连接配置"""
@@ -125,10 +253,112 @@ class Config:
         return config
 
     @classmethod
-    def get_all_ai_configs(cls) -> dict:
-        """获取所有已配置API Key的AI提供商配置"""
+    def _build_all_ai_configs(cls) -> dict:
+        """读取环境变量，构建所有已配置API Key的AI提供商配置（开启录制/回放时返回包装后的配置）"""
         configs = cls._get_ai_providers_config()
-        return {name: config for name, config in configs.items() if config.get('api_key')}
+        configured = {name: config for name, config in configs.items() if config.get('api_key')}
+        if cls.REPLAY_MODE:
+            return cls._get_replay_configs(configured)
+        return configured
+
+    @classmethod
+    def _build_snapshot(cls, version: int) -> ProviderConfigSnapshot:
+        """
+        按当前的类属性生成提供商配置快照
+
+        Args:
+            version: 快照版本号，每次重新加载后加1
+
+        Returns:
+            ProviderConfigSnapshot: 不可变的配置快照，默认提供商未配置时取第一个可用的提供商
+        """
+        configs = cls._build_all_ai_configs()
+        default_provider = cls.DEFAULT_AI_PROVIDER if cls.DEFAULT_AI_PROVIDER in configs else next(iter(configs), '')
+        return ProviderConfigSnapshot(
+            version=version,
+            configs=_freeze(configs),
+            default_provider=default_provider,
+            loaded_at=time.time()
+        )
+
+    @classmethod
+    def get_snapshot(cls) -> ProviderConfigSnapshot:
+        """获取当前的提供商配置快照（首次调用时生成）"""
+        if cls._snapshot is None:
+            cls._snapshot = cls._build_snapshot(1)
+        return cls._snapshot
+
+    @classmethod
+    def _reload_env_file(cls):
+        """重新读取配置文件中的环境变量，进程启动时已存在的环境变量不会被覆盖"""
+        values = dotenv_values(cls.CONFIG_RELOAD_FILE) if os.path.isfile(cls.CONFIG_RELOAD_FILE) else {}
+        for key in cls._dotenv_keys - values.keys():
+            if key not in _PROCESS_ENV_KEYS:
+                os.environ.pop(key, None)
+        for key, value in values.items():
+            if key not in _PROCESS_ENV_KEYS and value is not None:
+                os.environ[key] = value
+        cls._dotenv_keys = frozenset(values)
+
+    @classmethod
+    def reload_snapshot(cls) -> Tuple[ProviderConfigSnapshot, bool]:
+        """
+        重新读取配置文件和环境变量，生成新的提供商配置快照
+
+        Returns:
+            Tuple[ProviderConfigSnapshot, bool]: (当前快照, 配置是否有变化)
+
+        Raises:
+            ValueError: 新配置中没有任何可用的提供商（继续使用原快照）
+        """
+        cls._reload_env_file()
+        cls.DEFAULT_AI_PROVIDER = os.getenv('DEFAULT_AI_PROVIDER', 'deepseek')
+        current = cls.get_snapshot()
+        snapshot = cls._build_snapshot(current.version + 1)
+        if snapshot.configs == current.configs and snapshot.default_provider == current.default_provider:
+            cls.DEFAULT_AI_PROVIDER = current.default_provider
+            return current, False
+        if not snapshot.configs:
+            cls.DEFAULT_AI_PROVIDER = current.default_provider
+            raise ValueError("新配置中没有配置任何AI提供商的API密钥")
+
+        cls._snapshot = snapshot
+        cls.DEFAULT_AI_PROVIDER = snapshot.default_provider
+        return snapshot, True
+
+    @classmethod
+    def get_all_ai_configs(cls) -> Mapping[str, Mapping[str, Any]]:
+        """获取所有已配置API Key的AI提供商配置（当前快照，只读）"""
+        return cls.get_snapshot().configs
+
+    @classmethod
+    def _get_replay_configs(cls, configured: dict) -> dict:
+        """构建录制/回放提供商配置：录制时包装已配置的提供商，回放时使用夹具目录下的提供商"""
+        if cls.REPLAY_MODE == 'record':
+            names = list(configured.keys())
+        elif os.path.isdir(cls.REPLAY_FIXTURE_DIR):
+            names = sorted(name for name in os.listdir(cls.REPLAY_FIXTURE_DIR)
+                           if os.path.isdir(os.path.join(cls.REPLAY_FIXTURE_DIR, name)))
+        else:
+            names = []
+
+        replay_configs = {}
+        for name in names:
+            provider_config = configured.get(name) or cls._build_provider_config(name)
+            replay_configs[name] = {
+                # 其余配置项与真实提供商相同，请求参数的构建方式不变
+                **provider_config,
+                'provider': 'replay',
+                'mode': cls.REPLAY_MODE,
+                'name': name,
+                'upstream': name,
+                'fixture_dir': cls.REPLAY_FIXTURE_DIR,
+                'time_scale': cls.REPLAY_TIME_SCALE,
+                'strict': cls.REPLAY_STRICT,
+                # 回放时不需要真实密钥，非空即可通过配置校验
+                'api_key': provider_config['api_key'] if cls.REPLAY_MODE == 'record' else 'replay'
+            }
+        return replay_configs
 
     @classmethod
     def get_log_level(cls) -> int:
@@ -145,28 +375,39 @@ class Config:
     @classmethod
     def validate_config(cls) -> None:
         """验证必需的配置项"""
-        # 检查是否至少配置了一个AI提供商
-        providers_configured = cls.get_configured_providers()
+        snapshot = cls.get_snapshot()
 
-        if not providers_configured:
+        # 检查是否至少配置了一个AI提供商
+        if not snapshot.configs:
             raise ValueError("至少需要配置一个AI提供商的API密钥")
 
-        # 检查默认提供商是否已配置
-        if cls.DEFAULT_AI_PROVIDER not in providers_configured:
-            # 如果默认提供商未配置，使用第一个已配置的提供商
-            cls.DEFAULT_AI_PROVIDER = providers_configured[0]
+        # 检查默认提供商是否已配置，未配置时快照中使用第一个已配置的提供商
+        if cls.DEFAULT_AI_PROVIDER != snapshot.default_provider:
+            cls.DEFAULT_AI_PROVIDER = snapshot.default_provider
             print(f"警告: 默认AI提供商未配置或无效，自动设置为: {cls.DEFAULT_AI_PROVIDER}")
 
     @classmethod
     def get_configured_providers(cls) -> List[str]:
         """获取已配置API Key的AI提供商列表"""
-        return list(cls.get_all_ai_configs().keys())
+        return cls.get_snapshot().configured_providers
+
+    @classmethod
+    def get_worker_count(cls) -> int:
+        """获取生产模式的worker进程数（未配置时按CPU核数计算）"""
+        if cls.WORKERS > 0:
+            return cls.WORKERS
+        return os.cpu_count() or 1
 
     @classmethod
     def get_log_file_path(cls) -> str:
         """获取日志文件完整路径"""
         return os.path.join(cls.LOG_DIR, cls.LOG_FILE)
 
+    @classmethod
+    def get_tracing_file_path(cls) -> str:
+        """获取链路追踪文件完整路径"""
+        return os.path.join(cls.LOG_DIR, cls.TRACING_FILE)
+
     @classmethod
     def get_provider_icon(cls, provider: str) -> str:
         """获取提供商图标"""
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+配置热加载模块
+定期检查配置文件的修改时间，文件变化时调用重新加载函数；同时响应SIGHUP信号。
+多worker部署（start_server.py --mode prod）时需设置 CONFIG_RELOAD_INTERVAL，由每个worker各自检查文件：
+发给uvicorn主进程的SIGHUP会重启所有worker而不是热加载，SIGHUP只在单进程时或直接发给某个worker进程时热加载
+"""
+
+import os
+import signal
+import asyncio
+import logging
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigReloader:
+    """配置热加载触发器：文件修改检查 + SIGHUP"""
+
+    def __init__(self, reload: Callable[[str], bool], path: str, interval: float = 0):
+        """
+        初始化配置热加载触发器
+
+        Args:
+            reload: 重新加载配置的函数，参数为触发原因，返回配置是否有变化
+            path: 监视的配置文件路径
+            interval: 检查文件修改的间隔（秒），0表示不检查文件，只响应SIGHUP
+        """
+        self.reload = reload
+        self.path = path
+        self.interval = interval
+        self._watch_task: Optional[asyncio.Task] = None
+        self._signal_installed = False
+
+    def _get_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def _trigger(self, reason: str):
+        try:
+            self.reload(reason)
+        except Exception as e:
+            logger.error(f"重新加载配置失败（{reason}）: {e}")
+
+    async def start(self):
+        """安装SIGHUP处理并启动文件检查任务"""
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, self._trigger, "SIGHUP")
+            self._signal_installed = True
+        except (AttributeError, NotImplementedError, RuntimeError, ValueError) as e:
+            # Windows没有SIGHUP，非主线程的事件循环不能安装信号处理
+            logger.debug("未安装SIGHUP配置重新加载: %s", e)
+
+        if self.interval > 0:
+            self._watch_task = asyncio.create_task(self._watch(), name="config-reload-watch")
+            logger.info(f"配置热加载已启用 - 文件: {self.path}, 检查间隔: {self.interval}秒")
+
+    async def stop(self):
+        """移除SIGHUP处理并停止文件检查任务"""
+        if self._signal_installed:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+            self._signal_installed = False
+        if self._watch_task:
+            self._watch_task.cancel()
+            await asyncio.gather(self._watch_task, return_exceptions=True)
+            self._watch_task = None
+
+    async def _watch(self):
+        last_mtime = self._get_mtime()
+        while True:
+            await asyncio.sleep(self.interval)
+            mtime = self._get_mtime()
+            if mtime != last_mtime:
+                last_mtime = mtime
+                self._trigger(f"配置文件变化: {self.path}")
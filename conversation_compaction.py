@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+对话压缩模块
+会话中未被摘要覆盖的消息超过阈值后，在后台用低成本模型把较早的消息合并进滚动摘要；
+构建上下文时发送 摘要 + 最近的消息。摘要记录覆盖到第几条消息及该消息的时间戳，
+每次只摘要新增的部分，历史被清除或改变后旧摘要自动失效
+"""
+
+import json
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def get_conversation_summary_key(user_id: str, session_id: str) -> str:
+    """获取对话摘要在Redis中的键名"""
+    return f"conversation_summary:{user_id}:{session_id}"
+
+
+class SummaryStore:
+    """摘要存储：Redis可用时使用Redis，否则使用内存"""
+
+    def __init__(self, redis_client=None, ttl: int = 7 * 24 * 3600):
+        """
+        初始化摘要存储
+
+        Args:
+            redis_client: Redis客户端（decode_responses=True），为None时使用内存存储
+            ttl: 摘要过期时间（秒），与对话历史一致
+        """
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self._memory: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def get(self, user_id: str, session_id: str) -> Optional[Dict[str, Any]]:
+        """读取摘要，不存在时返回None"""
+        if self.redis_client:
+            data = self.redis_client.get(get_conversation_summary_key(user_id, session_id))
+            return json.loads(data) if data else None
+        return self._memory.get((user_id, session_id))
+
+    def save(self, user_id: str, session_id: str, summary: Dict[str, Any]):
+        """保存摘要"""
+        if self.redis_client:
+            self.redis_client.set(get_conversation_summary_key(user_id, session_id), json.dumps(summary), ex=self.ttl)
+        else:
+            self._memory[(user_id, session_id)] = summary
+
+    def delete(self, user_id: str, session_id: str):
+        """删除摘要（会话删除或历史清除时调用）"""
+        if self.redis_client:
+            self.redis_client.delete(get_conversation_summary_key(user_id, session_id))
+        else:
+            self._memory.pop((user_id, session_id), None)
+
+
+class ConversationCompactor:
+    """对话压缩器：判断是否需要压缩、在后台生成增量摘要、组装 摘要 + 最近消息"""
+
+    def __init__(
+        self,
+        summarizer: Callable[[str, Optional[str], List[Dict[str, Any]]], Awaitable[str]],
+        history_loader: Callable[[str, str], Awaitable[List[Dict[str, Any]]]],
+        store: SummaryStore,
+        threshold: int = 30,
+        keep_recent: int = 10,
+        max_context: Optional[int] = None
+    ):
+        """
+        初始化对话压缩器
+
+        Args:
+            summarizer: 生成摘要的协程函数，参数为用户ID、已有摘要（可能为None）和需要并入摘要的消息
+            history_loader: 读取完整对话历史的协程函数
+            store: 摘要存储
+            threshold: 未被摘要覆盖的消息数超过该值时触发压缩
+            keep_recent: 压缩时保留原文的最近消息数
+            max_context: 历史窗口最少能发送的消息数，未覆盖的消息超出窗口时会被截掉（既不在摘要中也不发送），
+                因此实际阈值不超过 max_context-1（为下一条用户消息留出位置）；为None时不限制
+        """
+        if max_context is not None:
+            threshold = min(threshold, max_context - 1)
+        if keep_recent >= threshold:
+            raise ValueError(f"保留的最近消息数({keep_recent})必须小于压缩阈值({threshold}，不超过历史窗口大小-1)")
+        self.summarizer = summarizer
+        self.history_loader = history_loader
+        self.store = store
+        self.threshold = threshold
+        self.keep_recent = keep_recent
+        self._tasks: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    @staticmethod
+    def _is_fresh(summary: Dict[str, Any], history: List[Dict[str, Any]]) -> bool:
+        """摘要覆盖的最后一条消息仍在历史中的相同位置时摘要有效"""
+        covered = summary.get("covered", 0)
+        return 0 < covered <= len(history) and history[covered - 1].get("timestamp") == summary.get("last_timestamp")
+
+    def get_summary(self, user_id: str, session_id: str, history: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        获取与当前历史匹配的摘要
+
+        Args:
+            user_id: 用户ID
+            session_id: 会话ID
+            history: 完整对话历史
+
+        Returns:
+            Optional[Dict[str, Any]]: 有效的摘要，没有或已失效时返回None
+        """
+        if len(history) <= self.keep_recent:
+            return None
+        summary = self.store.get(user_id, session_id)
+        if summary and self._is_fresh(summary, history):
+            return summary
+        return None
+
+    def build_context(self, history: List[Dict[str, Any]], summary: Optional[Dict[str, Any]]) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        """
+        组装上下文
+
+        Args:
+            history: 完整对话历史
+            summary: get_summary返回的摘要
+
+        Returns:
+            Tuple[Optional[str], List[Dict[str, Any]]]: (摘要文本, 摘要未覆盖的消息)
+        """
+        if summary is None:
+            return None, history
+        return summary["summary"], history[summary["covered"]:]
+
+    def schedule(self, user_id: str, session_id: str, history_length: int, summary: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        未被摘要覆盖的消息超过阈值时启动后台压缩，同一会话同时只有一个压缩任务
+
+        Args:
+            user_id: 用户ID
+            session_id: 会话ID
+            history_length: 当前历史消息数
+            summary: 当前有效的摘要
+
+        Returns:
+            bool: 是否启动了压缩任务
+        """
+        covered = summary["covered"] if summary else 0
+        if history_length - covered <= self.threshold:
+            return False
+
+        task_key = (user_id, session_id)
+        if task_key in self._tasks:
+            return False
+        task = asyncio.create_task(self._compact(user_id, session_id), name=f"compaction-{session_id[:8]}")
+        self._tasks[task_key] = task
+        task.add_done_callback(lambda _: self._tasks.pop(task_key, None))
+        return True
+
+    async def _compact(self, user_id: str, session_id: str):
+        try:
+            history = await self.history_loader(user_id, session_id)
+            summary = self.store.get(user_id, session_id)
+            if summary and not self._is_fresh(summary, history):
+                logger.info("对话摘要已失效，重新生成 - 用户: %s, 会话: %.8s...", user_id, session_id)
+                summary = None
+
+            start = summary["covered"] if summary else 0
+            end = len(history) - self.keep_recent
+            if end - start <= 0:
+                return
+
+            started = time.perf_counter()
+            text = await self.summarizer(user_id, summary["summary"] if summary else None, history[start:end])
+            if not text:
+                logger.warning(f"对话压缩未生成摘要 - 用户: {user_id}, 会话: {session_id[:8]}...")
+                return
+
+            self.store.save(user_id, session_id, {
+                "summary": text,
+                "covered": end,
+                "last_timestamp": history[end - 1].get("timestamp"),
+                "updated_at": time.time()
+            })
+            logger.info(
+                "对话压缩完成 - 用户: %s, 会话: %.8s..., 新摘要消息: %d, 累计覆盖: %d, 摘要长度: %d, 耗时: %.0fms",
+                user_id, session_id, end - start, end, len(text), (time.perf_counter() - started) * 1000
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"对话压缩失败 - 用户: {user_id}, 会话: {session_id[:8]}..., 错误: {e}")
+
+    async def stop(self):
+        """取消进行中的压缩任务（未完成的摘要下次触发时重新生成）"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
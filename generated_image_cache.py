@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生成图片缓存模块
+相同的图片生成请求（提示词、尺寸、质量、提供商及参考图片）直接返回已生成的图片；
+图片以文件保存在本地目录，按总大小预算进行LRU淘汰
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 图片文件头与MIME类型、扩展名的对应关系
+_IMAGE_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png", "png"),
+    (b"\xff\xd8\xff", "image/jpeg", "jpg"),
+    (b"GIF8", "image/gif", "gif"),
+]
+
+
+def detect_image_format(image_bytes: bytes) -> tuple:
+    """根据文件头识别图片的MIME类型和扩展名"""
+    for signature, content_type, extension in _IMAGE_SIGNATURES:
+        if image_bytes.startswith(signature):
+            return content_type, extension
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp", "webp"
+    return "application/octet-stream", "bin"
+
+
+def make_cache_key(request: Dict[str, Any], reference_image: Optional[bytes] = None) -> str:
+    """
+    根据规范化后的请求参数和参考图片内容计算缓存键
+
+    Args:
+        request: 影响生成结果的请求参数
+        reference_image: 参考图片原始字节（图生图模式）
+
+    Returns:
+        str: 缓存键
+    """
+    normalized = {
+        key: value.strip() if isinstance(value, str) else value
+        for key, value in request.items()
+    }
+    digest = hashlib.sha256(json.dumps(normalized, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    if reference_image:
+        digest.update(hashlib.sha256(reference_image).digest())
+    return digest.hexdigest()
+
+
+class GeneratedImageCache:
+    """生成图片缓存：本地目录存储 + 总大小预算 + LRU淘汰"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        """
+        初始化生成图片缓存，扫描目录重建索引
+
+        Args:
+            directory: 缓存目录
+            max_bytes: 缓存总大小上限（字节）
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # {key: (文件大小, 文件名)}，按最近使用时间排序
+        self._index: "OrderedDict[str, tuple]" = OrderedDict()
+        self._total_bytes = 0
+        # 缓存读写在线程池中执行，需要加锁
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load_index(self):
+        """按元数据文件的修改时间（即最近使用时间）重建LRU索引"""
+        entries = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".json"):
+                continue
+            key = filename[:-5]
+            try:
+                with open(self._meta_path(key), encoding="utf-8") as f:
+                    meta = json.load(f)
+                entries.append((os.path.getmtime(self._meta_path(key)), key, meta["size"], meta["filename"]))
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"忽略损坏的生成图片缓存条目 {key}: {e}")
+
+        for _, key, size, filename in sorted(entries):
+            self._index[key] = (size, filename)
+            self._total_bytes += size
+        logger.info(f"生成图片缓存已加载 - 条目数: {len(self._index)}, 总大小: {self._total_bytes} bytes")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        查询缓存，命中时刷新LRU顺序
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            Optional[Dict[str, Any]]: 缓存元数据，未命中时返回None
+        """
+        with self._lock:
+            # 多worker进程共享缓存目录，其他进程写入的条目不在本进程索引中
+            if key not in self._index and not os.path.exists(self._meta_path(key)):
+                self.misses += 1
+                return None
+
+            try:
+                with open(self._meta_path(key), encoding="utf-8") as f:
+                    meta = json.load(f)
+                os.utime(self._meta_path(key))  # 记录最近使用时间，重启后恢复LRU顺序
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取生成图片缓存失败 {key}: {e}")
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            if key not in self._index:
+                self._index[key] = (meta["size"], meta["filename"])
+                self._total_bytes += meta["size"]
+            self._index.move_to_end(key)
+            self.hits += 1
+            return meta
+
+    def put(self, key: str, image_bytes: bytes, meta: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        保存生成的图片，超出大小预算时淘汰最久未使用的条目
+
+        Args:
+            key: 缓存键
+            image_bytes: 图片原始字节
+            meta: 额外元数据（如修订后的提示词）
+
+        Returns:
+            Dict[str, Any]: 缓存元数据
+        """
+        content_type, extension = detect_image_format(image_bytes)
+        meta = {
+            **meta,
+            "key": key,
+            "filename": f"{key}.{extension}",
+            "content_type": content_type,
+            "size": len(image_bytes),
+            "created_at": time.time()
+        }
+
+        with self._lock:
+            file_path = os.path.join(self.directory, meta["filename"])
+            tmp_path = f"{file_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(image_bytes)
+            os.replace(tmp_path, file_path)
+            with open(self._meta_path(key), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+
+            if key in self._index:
+                self._total_bytes -= self._index[key][0]
+            self._index[key] = (len(image_bytes), meta["filename"])
+            self._index.move_to_end(key)
+            self._total_bytes += len(image_bytes)
+
+            while self._total_bytes > self.max_bytes and len(self._index) > 1:
+                oldest_key = next(iter(self._index))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+        return meta
+
+    def get_file_path(self, filename: str) -> Optional[str]:
+        """获取缓存图片文件路径，文件名不合法或不存在时返回None"""
+        if os.path.basename(filename) != filename or filename.endswith((".json", ".tmp")):
+            return None
+        file_path = os.path.join(self.directory, filename)
+        return file_path if os.path.isfile(file_path) else None
+
+    def _remove(self, key: str):
+        """删除缓存条目（调用方需持有锁）"""
+        size, filename = self._index.pop(key, (0, None))
+        self._total_bytes -= size
+        for path in (self._meta_path(key), os.path.join(self.directory, filename) if filename else None):
+            if path and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning(f"删除生成图片缓存文件失败 {path}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._index),
+            "total_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片生成任务队列模块
+提交任务立即返回任务ID，由固定数量的worker协程处理，并按提供商限制并发
+（worker只取所属提供商还有空闲名额的任务，某个提供商的慢任务不会占满所有worker）；
+任务状态保存在Redis（多worker进程共享）或内存中，并设置过期时间
+"""
+
+import json
+import time
+import uuid
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED)
+
+
+class JobQueueFullError(Exception):
+    """任务队列已满"""
+
+
+def get_image_job_key(job_id: str) -> str:
+    """获取图片生成任务在Redis中的键名"""
+    return f"image_job:{job_id}"
+
+
+class ImageJobStore:
+    """任务状态存储：Redis可用时使用Redis，否则使用内存（带过期时间）"""
+
+    def __init__(self, redis_client=None, ttl: int = 3600):
+        """
+        初始化任务状态存储
+
+        Args:
+            redis_client: Redis客户端（decode_responses=True），为None时使用内存存储
+            ttl: 任务状态过期时间（秒）
+        """
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self._memory: Dict[str, tuple] = {}  # {job_id: (expire_at, job)}
+
+    def save(self, job: Dict[str, Any]):
+        """保存任务状态"""
+        if self.redis_client:
+            self.redis_client.set(get_image_job_key(job["job_id"]), json.dumps(job), ex=self.ttl)
+        else:
+            self._purge_expired()
+            self._memory[job["job_id"]] = (time.time() + self.ttl, job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """读取任务状态，不存在或已过期时返回None"""
+        if self.redis_client:
+            data = self.redis_client.get(get_image_job_key(job_id))
+            return json.loads(data) if data else None
+
+        entry = self._memory.get(job_id)
+        if entry is None or entry[0] < time.time():
+            return None
+        return entry[1]
+
+    def _purge_expired(self):
+        now = time.time()
+        for job_id in [job_id for job_id, (expire_at, _) in self._memory.items() if expire_at < now]:
+            del self._memory[job_id]
+
+
+class ImageJobManager:
+    """图片生成任务管理器：有界排队 + worker协程池 + 按提供商的并发限制"""
+
+    def __init__(
+        self,
+        handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        store: ImageJobStore,
+        workers: int = 4,
+        provider_concurrency: int = 2,
+        queue_size: int = 100
+    ):
+        """
+        初始化任务管理器
+
+        Args:
+            handler: 执行任务的协程函数，参数为任务请求，返回任务结果
+            store: 任务状态存储
+            workers: worker协程数
+            provider_concurrency: 每个提供商同时执行的任务数上限
+            queue_size: 排队任务数上限
+        """
+        self.handler = handler
+        self.store = store
+        self.workers = workers
+        self.provider_concurrency = provider_concurrency
+        self.queue_size = queue_size
+        # 按提交顺序排队的任务: (任务ID, 任务请求)
+        self._queue: Deque[Tuple[str, Dict[str, Any]]] = deque()
+        # 有新任务或有提供商释放名额时唤醒worker
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker_tasks = []
+        # 各提供商正在执行的任务数
+        self._provider_running: Dict[str, int] = {}
+        # 本进程内任务状态变化通知，用于SSE及时推送
+        self._events: Dict[str, asyncio.Event] = {}
+
+    async def start(self):
+        """启动worker协程"""
+        self._wakeup = asyncio.Event()
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(index), name=f"image-job-worker-{index}")
+            for index in range(self.workers)
+        ]
+        logger.info(f"图片生成任务队列已启动 - worker数: {self.workers}, 每提供商并发: {self.provider_concurrency}")
+
+    async def stop(self):
+        """停止worker协程，未完成的任务标记为失败"""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+        while self._queue:
+            job_id, _ = self._queue.popleft()
+            self._update(job_id, status=JOB_FAILED, error="服务关闭，任务未执行", finished_at=time.time())
+        logger.info("图片生成任务队列已停止")
+
+    def submit(self, provider: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        提交图片生成任务
+
+        Args:
+            provider: 提供商名称（用于并发限制）
+            request: 任务请求参数
+
+        Returns:
+            Dict[str, Any]: 任务状态
+
+        Raises:
+            JobQueueFullError: 排队任务数已达上限
+        """
+        job = {
+            "job_id": str(uuid.uuid4()),
+            "status": JOB_QUEUED,
+            "provider": provider,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None
+        }
+
+        if len(self._queue) >= self.queue_size:
+            raise JobQueueFullError(f"图片生成任务队列已满（{self.queue_size}）")
+        self._queue.append((job["job_id"], {**request, "provider": provider}))
+        self._wakeup.set()
+
+        self.store.save(job)
+        self._events[job["job_id"]] = asyncio.Event()
+        logger.info(f"图片生成任务已提交 - 任务: {job['job_id']}, 提供商: {provider}, 排队数: {len(self._queue)}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务状态"""
+        return self.store.get(job_id)
+
+    async def wait_for_change(self, job_id: str, timeout: float):
+        """等待本进程内的任务状态变化（其他进程提交的任务只能依赖超时后重新读取）"""
+        event = self._events.get(job_id)
+        if event is None:
+            await asyncio.sleep(timeout)
+            return
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        event.clear()
+
+    def _update(self, job_id: str, **changes) -> Optional[Dict[str, Any]]:
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        job.update(changes)
+        self.store.save(job)
+
+        event = self._events.get(job_id)
+        if event is not None:
+            event.set()
+            if job["status"] in JOB_FINISHED_STATUSES:
+                self._events.pop(job_id, None)
+        return job
+
+    def _take_runnable(self) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """取出最早提交、且所属提供商还有空闲名额的任务，并占用该名额"""
+        for position, (job_id, request) in enumerate(self._queue):
+            provider = request["provider"]
+            if self._provider_running.get(provider, 0) < self.provider_concurrency:
+                del self._queue[position]
+                self._provider_running[provider] = self._provider_running.get(provider, 0) + 1
+                return job_id, request
+        return None
+
+    async def _worker(self, index: int):
+        while True:
+            job = self._take_runnable()
+            if job is None:
+                # 取任务和等待之间没有await，不会错过唤醒
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            job_id, request = job
+            try:
+                self._update(job_id, status=JOB_RUNNING, started_at=time.time())
+                try:
+                    result = await self.handler(request)
+                    self._update(job_id, status=JOB_SUCCEEDED, result=result, finished_at=time.time())
+                    logger.info(f"图片生成任务完成 - 任务: {job_id}, worker: {index}")
+                except asyncio.CancelledError:
+                    self._update(job_id, status=JOB_FAILED, error="服务关闭，任务被取消", finished_at=time.time())
+                    raise
+                except Exception as e:
+                    self._update(job_id, status=JOB_FAILED, error=str(e), finished_at=time.time())
+                    logger.error(f"图片生成任务失败 - 任务: {job_id}, 错误: {e}")
+            finally:
+                self._provider_running[request["provider"]] -= 1
+                # 释放的名额可能让其他worker取到排在后面的任务
+                self._wakeup.set()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片处理模块
+图片校验和Base64编码等CPU密集操作放到线程池中执行，避免阻塞事件循环
+"""
+
+import os
+import asyncio
+import base64
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+from typing import Any, BinaryIO, Callable, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# 图片处理线程池与并发信号量（首次使用时创建）
+_executor: Optional[ThreadPoolExecutor] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+class ImageTooLargeError(ValueError):
+    """图片超过大小限制"""
+
+    def __init__(self, size: int, max_size: int):
+        super().__init__(f"图片大小 {size} bytes 超过限制 {max_size} bytes")
+        self.size = size
+        self.max_size = max_size
+
+
+class InvalidImageError(ValueError):
+    """无效的图片文件"""
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """获取图片处理线程池"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=Config.IMAGE_WORKERS, thread_name_prefix="image")
+    return _executor
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    """获取图片处理并发信号量"""
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(Config.IMAGE_MAX_CONCURRENCY)
+    return _semaphore
+
+
+async def run_in_image_pool(func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """
+    在图片处理线程池中执行同步函数，并发数受IMAGE_MAX_CONCURRENCY限制
+
+    Args:
+        func: 同步函数
+        *args: 位置参数
+        **kwargs: 关键字参数
+
+    Returns:
+        Any: 函数返回值
+    """
+    async with _get_semaphore():
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), partial(func, *args, **kwargs))
+
+
+def shutdown_image_pool():
+    """关闭图片处理线程池（应用关闭时调用）"""
+    global _executor, _semaphore
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    _semaphore = None
+
+
+def _verify_image(fileobj: BinaryIO):
+    """校验图片完整性，失败时抛出InvalidImageError"""
+    # Pillow较重，首次处理图片时再导入
+    from PIL import Image
+
+    fileobj.seek(0)
+    try:
+        with Image.open(fileobj) as image:
+            image.verify()  # 验证图片完整性
+    except Exception as e:
+        raise InvalidImageError(str(e)) from e
+    fileobj.seek(0)
+
+
+def read_verified_image(fileobj: BinaryIO, max_size: int) -> bytes:
+    """
+    校验图片并读取原始字节（同步函数，应在线程池中调用）
+
+    Args:
+        fileobj: 图片文件对象（可以是落盘的临时文件）
+        max_size: 最大字节数
+
+    Returns:
+        bytes: 图片原始字节
+
+    Raises:
+        ImageTooLargeError: 图片超过大小限制
+        InvalidImageError: 图片无法解析
+    """
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    if size > max_size:
+        raise ImageTooLargeError(size, max_size)
+
+    _verify_image(fileobj)
+    return fileobj.read()
+
+
+def decode_verified_image(image_data: str, max_size: int) -> bytes:
+    """
+    解码客户端提交的Base64图片并校验（同步函数，应在线程池中调用）
+
+    Args:
+        image_data: Base64编码的图片
+        max_size: 最大字节数
+
+    Returns:
+        bytes: 图片原始字节
+
+    Raises:
+        ImageTooLargeError: 图片超过大小限制
+        InvalidImageError: Base64或图片无法解析
+    """
+    try:
+        image_bytes = base64.b64decode(image_data, validate=True)
+    except ValueError as e:
+        raise InvalidImageError(f"无效的Base64数据: {e}") from e
+
+    return read_verified_image(BytesIO(image_bytes), max_size)
+
+
+def encode_image_base64(image_bytes: bytes) -> str:
+    """将图片字节编码为Base64字符串（同步函数，应在线程池中调用）"""
+    return base64.b64encode(image_bytes).decode('ascii')
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片存储模块
+以原始二进制保存用户图片，按内容SHA-256作为图片ID（相同图片只存一份），
+消息中只保存图片ID，Base64编码只在发送给AI提供商时进行
+"""
+
+import hashlib
+import logging
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def get_image_key(image_id: str) -> str:
+    """获取图片在Redis中的键名"""
+    return f"image:{image_id}"
+
+
+def compute_image_id(image_bytes: bytes) -> str:
+    """根据图片内容计算图片ID"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class ImageStore:
+    """图片存储：Redis可用时使用Redis（二进制连接），否则使用内存"""
+
+    def __init__(self, redis_client=None, expire_time: int = 0):
+        """
+        初始化图片存储
+
+        Args:
+            redis_client: decode_responses=False 的Redis客户端，为None时使用内存存储
+            expire_time: Redis中图片的过期时间（秒），0表示不过期
+        """
+        self.redis_client = redis_client
+        self.expire_time = expire_time
+        self._memory: Dict[str, Tuple[bytes, str]] = {}
+
+    def save(self, image_bytes: bytes, image_type: str) -> str:
+        """
+        保存图片
+
+        Args:
+            image_bytes: 图片二进制数据
+            image_type: 图片MIME类型
+
+        Returns:
+            str: 图片ID
+        """
+        image_id = compute_image_id(image_bytes)
+
+        if self.redis_client:
+            key = get_image_key(image_id)
+            pipe = self.redis_client.pipeline()
+            pipe.hset(key, mapping={"data": image_bytes, "type": image_type})
+            if self.expire_time:
+                pipe.expire(key, self.expire_time)
+            pipe.execute()
+        else:
+            self._memory[image_id] = (image_bytes, image_type)
+
+        logger.info(f"图片已保存 - ID: {image_id[:12]}..., 类型: {image_type}, 大小: {len(image_bytes)} bytes")
+        return image_id
+
+    def get(self, image_id: str) -> Optional[Tuple[bytes, str]]:
+        """
+        读取图片
+
+        Args:
+            image_id: 图片ID
+
+        Returns:
+            Optional[Tuple[bytes, str]]: 图片二进制数据和MIME类型，不存在时返回None
+        """
+        if self.redis_client:
+            data, image_type = self.redis_client.hmget(get_image_key(image_id), ["data", "type"])
+            if data is None:
+                return None
+            if self.expire_time:
+                # 图片仍被会话引用，随会话一起续期
+                self.redis_client.expire(get_image_key(image_id), self.expire_time)
+            return data, image_type.decode("utf-8") if image_type else "application/octet-stream"
+
+        return self._memory.get(image_id)
+
+    def get_type(self, image_id: str) -> Optional[str]:
+        """
+        读取图片MIME类型（不读取图片数据），可用于判断图片是否存在
+
+        Args:
+            image_id: 图片ID
+
+        Returns:
+            Optional[str]: 图片MIME类型，不存在时返回None
+        """
+        if self.redis_client:
+            image_type = self.redis_client.hget(get_image_key(image_id), "type")
+            return image_type.decode("utf-8") if image_type else None
+
+        image = self._memory.get(image_id)
+        return image[1] if image else None
+
+    def close(self):
+        """关闭Redis连接"""
+        if self.redis_client:
+            self.redis_client.close()
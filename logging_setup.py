@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+日志配置模块
+业务代码只把日志记录放入内存队列，格式化和磁盘/控制台写入由后台线程完成；
+文件日志为JSON结构化格式，热点路径上的日志可按logger采样
+"""
+
+import json
+import queue
+import random
+import logging
+import logging.handlers
+from datetime import datetime
+from typing import Dict, Optional
+
+# LogRecord的标准属性，其余属性视为通过extra传入的结构化字段
+_STANDARD_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+TEXT_LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    """将日志记录格式化为单行JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_RECORD_ATTRS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    按logger名称采样INFO及以下级别的日志，WARNING及以上级别始终保留
+
+    采样率按logger名称前缀匹配，最长前缀优先，例如 {"main.storage": 0.1}
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._cache: Dict[str, float] = {}
+
+    def _get_rate(self, logger_name: str) -> float:
+        rate = self._cache.get(logger_name)
+        if rate is None:
+            rate = 1.0
+            matched = ""
+            for prefix, prefix_rate in self.rates.items():
+                if (logger_name == prefix or logger_name.startswith(prefix + ".")) and len(prefix) > len(matched):
+                    matched, rate = prefix, prefix_rate
+            self._cache[logger_name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._get_rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    不在调用线程中格式化日志的QueueHandler
+
+    标准QueueHandler.prepare会在调用线程中格式化消息，
+    这里原样入队，格式化由QueueListener线程中的目标handler完成
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0  # 队列满时丢弃的日志数
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_sampling_rates(value: str) -> Dict[str, float]:
+    """
+    解析采样率配置，格式为 "logger名称=采样率,..."
+
+    Args:
+        value: 采样率配置字符串
+
+    Returns:
+        Dict[str, float]: logger名称到采样率的映射
+    """
+    rates = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        name, rate = item.split("=", 1)
+        try:
+            rates[name.strip()] = max(0.0, min(1.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+
+def setup_logging(
+    level: int,
+    log_file: Optional[str],
+    file_format: str = "json",
+    sampling: str = "",
+    queue_size: int = 10000
+) -> logging.handlers.QueueListener:
+    """
+    配置根logger：日志先进入队列，由后台线程写入控制台和文件
+
+    Args:
+        level: 日志级别
+        log_file: 日志文件路径，为None时只输出到控制台
+        file_format: 文件日志格式，json或text
+        sampling: 采样率配置，格式见parse_sampling_rates
+        queue_size: 队列容量，队列满时丢弃新日志而不是阻塞请求
+
+    Returns:
+        logging.handlers.QueueListener: 已启动的后台监听器，应用关闭时需要调用stop()刷新日志
+    """
+    console_handler = logging.StreamHandler()  # 输出到控制台
+    console_handler.setFormatter(logging.Formatter(TEXT_LOG_FORMAT))
+    handlers = [console_handler]
+
+    if log_file:
+        file_handler = logging.FileHandler(log_file, encoding='utf-8')  # 输出到文件
+        file_handler.setFormatter(JsonFormatter() if file_format == "json" else logging.Formatter(TEXT_LOG_FORMAT))
+        handlers.append(file_handler)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = DeferredQueueHandler(log_queue)
+    rates = parse_sampling_rates(sampling)
+    if rates:
+        queue_handler.addFilter(SamplingFilter(rates))
+
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(queue_handler)
+    root_logger.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -8,84 +8,368 @@ FastAPI AI聊天应用演示项目
 import json
 import time
 import uuid
+import base64
 import logging
 import os
-from typing import List, Dict, Any, Optional
+import hashlib
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
-import base64
-from io import BytesIO
-from PIL import Image
 
-from fastapi import FastAPI, HTTPException, Query, File, UploadFile, Form
-from fastapi.responses import StreamingResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, Field
-import redis
+from fastapi import FastAPI, HTTPException, Query, File, UploadFile, Form, Request, WebSocket
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse, RedirectResponse, Response, FileResponse
+from pydantic import BaseModel, Field, ValidationError
+from starlette.datastructures import UploadFile as StarletteUploadFile
 
 from config import Config
+from logging_setup import setup_logging
+from image_processing import (
+    ImageTooLargeError, InvalidImageError, run_in_image_pool, shutdown_image_pool,
+    read_verified_image, decode_verified_image, encode_image_base64
+)
+from image_store import ImageStore
+from generated_image_cache import GeneratedImageCache, make_cache_key
+from image_jobs import ImageJobManager, ImageJobStore, JobQueueFullError, JOB_FINISHED_STATUSES
+from conversation_compaction import ConversationCompactor, SummaryStore
+from usage_ledger import UsageLedger, estimate_usage, usage_day
+from message_writer import MessageWriteBuffer
+from chat_batch import ChatBatchRunner
+from chat_websocket import ChatWebSocketSession
+from config_reload import ConfigReloader
+from static_assets import PrecompressedStaticFiles, etag_matches
+from middlewares import CompressionMiddleware, MetricsMiddleware, RequestSizeLimitMiddleware, TracingMiddleware
+from tracing import configure_tracing, shutdown_tracing, start_span
+from metrics import (
+    CHAT_ACTIVE_STREAMS, CHAT_STREAM_CHUNKS, CHAT_WS_CONNECTIONS, CHAT_STREAM_DURATION, CHAT_TIME_TO_FIRST_TOKEN, CHAT_TOKENS_PER_SECOND,
+    IMAGE_GENERATION_DURATION, PROVIDER_ERRORS, PROVIDER_REQUESTS, UPLOAD_SIZE, InstrumentedRedis,
+    mark_worker_exited, record_prompt_usage, render_metrics
+)
 from ai_providers.factory import AIProviderFactory, MultiProviderManager
 from ai_providers.base import AIMessage, ImageGenerationRequest, ImageGenerationResponse
+from ai_providers.image_preprocessor import configure_image_preprocessor, get_image_preprocessor
 
-# 配置日志系统
 # 创建配置实例
 config = Config()
 
-# 创建日志目录（如果不存在）
-os.makedirs(config.LOG_DIR, exist_ok=True)
+logger = logging.getLogger(__name__)
+# 每条消息都会产生的存储日志单独使用子logger，便于按LOG_SAMPLING采样
+storage_logger = logging.getLogger(f"{__name__}.storage")
+
+# 全局变量声明（在应用lifespan中初始化，避免导入模块时产生I/O）
+redis_client = None
+REDIS_AVAILABLE = False
+image_store = None
+ai_manager = None
+image_job_manager = None
+conversation_compactor = None
+usage_ledger = None
+message_writer = None
+chat_batch_runner = None
+config_reloader = None
+# 预先序列化的 /providers、/roles 响应: (响应体, ETag)，配置加载或重新加载时更新
+providers_response = None
+roles_response = None
+generated_image_cache = None
+log_listener = None
+
+def init_logging():
+    """配置日志系统（队列异步写入，文件日志为JSON格式）"""
+    global log_listener
+
+    # 创建日志目录（如果不存在）
+    os.makedirs(config.LOG_DIR, exist_ok=True)
+
+    log_listener = setup_logging(
+        level=config.get_log_level(),
+        log_file=config.get_log_file_path(),
+        file_format=config.LOG_FILE_FORMAT,
+        sampling=config.LOG_SAMPLING,
+        queue_size=config.LOG_QUEUE_SIZE
+    )
+
+    # 记录应用启动信息
+    logger.info(f"应用启动 - {config.APP_NAME} v{config.APP_VERSION}")
+    logger.info(f"调试模式: {config.DEBUG}")
+    logger.info(f"日志级别: {config.LOG_LEVEL}")
+    logger.info(f"日志文件: {config.get_log_file_path()}")
+
+def init_tracing():
+    """配置链路追踪导出器"""
+    configure_tracing(config.TRACING_EXPORTER, config.get_tracing_file_path(), config.TRACING_SAMPLE_RATE)
+
+def init_redis():
+    """创建Redis连接并检测可用性"""
+    global redis_client, REDIS_AVAILABLE, image_store
+
+    try:
+        redis_client = InstrumentedRedis(**Config.get_redis_config())
+
+        # 测试Redis连接
+        redis_client.ping()
+        logger.info(f"Redis连接成功 - 主机: {Config.REDIS_HOST}:{Config.REDIS_PORT}")
+        REDIS_AVAILABLE = True
+    except Exception as e:
+        logger.error(f"Redis连接失败: {e}")
+        logger.warning("应用将在没有Redis的情况下运行，会话数据将不会持久化")
+        redis_client = None
+        REDIS_AVAILABLE = False
+
+    # 图片以二进制保存，需要单独的不解码响应的连接
+    image_redis_client = InstrumentedRedis(**{**Config.get_redis_config(), 'decode_responses': False}) if REDIS_AVAILABLE else None
+    image_store = ImageStore(image_redis_client, expire_time=config.CONVERSATION_EXPIRE_TIME)
+
+def init_ai_manager():
+    """验证配置并初始化AI提供商管理器"""
+    global ai_manager
+
+    try:
+        Config.validate_config()
+        configure_image_preprocessor(Config.IMAGE_PREPROCESS_WORKERS, Config.IMAGE_PREPROCESS_CACHE_SIZE)
+        if Config.REPLAY_MODE:
+            from ai_providers.replay_provider import ReplayProvider
+            AIProviderFactory.register_provider('replay', ReplayProvider)
+            logger.info(f"录制/回放模式: {Config.REPLAY_MODE}, 夹具目录: {Config.REPLAY_FIXTURE_DIR}")
+        ai_manager = build_ai_manager(Config.get_snapshot())
+        refresh_cached_responses(ai_manager)
+        logger.info(f"AI提供商管理器初始化成功，默认提供商: {ai_manager.default_provider}")
+        logger.info(f"可用提供商: {Config.get_configured_providers()}")
+    except ValueError as e:
+        logger.error(f"配置验证失败: {e}")
+        raise
+
+def build_ai_manager(snapshot, existing: Optional[MultiProviderManager] = None) -> MultiProviderManager:
+    """按配置快照创建提供商管理器，配置未变化的提供商复用原实例"""
+    manager = MultiProviderManager(snapshot.configs, existing=existing.providers if existing else None)
+    if snapshot.default_provider in manager.providers:
+        manager.set_default_provider(snapshot.default_provider)
+    return manager
+
+def reload_ai_providers(reason: str) -> bool:
+    """
+    重新加载提供商配置，有变化时重建提供商管理器并整体替换
+
+    进行中的请求持有原管理器和提供商实例的引用，继续使用原配置完成；之后的请求使用新配置
+    """
+    global ai_manager
+    try:
+        snapshot, changed = Config.reload_snapshot()
+    except ValueError as e:
+        logger.error(f"重新加载配置失败，继续使用原配置（{reason}）: {e}")
+        return False
+    if not changed:
+        logger.info(f"提供商配置无变化（{reason}）")
+        return False
+
+    previous = ai_manager
+    ai_manager = build_ai_manager(snapshot, existing=previous)
+    if previous:
+        # 被替换的旧实例由进行中的请求继续持有，请求结束后即可释放，不再保留在工厂缓存中
+        retained = {id(provider) for provider in ai_manager.providers.values()}
+        AIProviderFactory.remove_instances(provider for provider in previous.providers.values() if id(provider) not in retained)
+    refresh_cached_responses(ai_manager)
+    logger.info(f"提供商配置已重新加载（{reason}）- 版本: {snapshot.version}, 可用提供商: {snapshot.configured_providers}, 默认提供商: {ai_manager.default_provider}")
+    return True
+
+def build_cached_json(payload: Dict[str, Any]) -> Tuple[bytes, str]:
+    """序列化响应体（与FastAPI默认JSON格式一致）并按内容计算ETag"""
+    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return body, f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+
+def build_providers_payload(manager: MultiProviderManager) -> Dict[str, Any]:
+    """构建 /providers 的响应内容"""
+    all_models = manager.get_all_available_models()
+    providers_info = []
+    for provider in Config.get_configured_providers():
+        provider_obj = manager.get_provider(provider)
+        if provider_obj:
+            providers_info.append({
+                "id": provider,
+                "name": provider_obj.get_provider_name(),
+                "models": all_models.get(provider, []),
+                "icon": Config.get_provider_icon(provider),
+                "is_default": provider == manager.default_provider
+            })
+
+    return {
+        "providers": providers_info,
+        "default_provider": manager.default_provider,
+        "all_models": all_models,
+        "provider_icons": Config.get_all_provider_icons()
+    }
+
+def refresh_cached_responses(manager: MultiProviderManager):
+    """配置加载或重新加载后重新生成 /providers、/roles 的响应"""
+    global providers_response, roles_response
+    providers_response = build_cached_json(build_providers_payload(manager))
+    roles_response = build_cached_json({
+        "roles": [
+            {
+                "key": key,
+                "name": value["name"],
+                "description": value["prompt"],
+                "icon": value.get("icon", "🤖")
+            }
+            for key, value in AI_ROLES.items()
+        ]
+    })
+
+def cached_json_response(request: Request, cached: Tuple[bytes, str]) -> Response:
+    """返回预先序列化的响应，ETag匹配时返回304（配置可能热加载，客户端每次重新验证）"""
+    body, etag = cached
+    headers = {"Cache-Control": "no-cache", "ETag": etag}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def init_generated_image_cache():
+    """加载生成图片缓存索引"""
+    global generated_image_cache
+    generated_image_cache = GeneratedImageCache(
+        config.GENERATED_IMAGE_CACHE_DIR,
+        max_bytes=config.GENERATED_IMAGE_CACHE_MAX_BYTES
+    )
 
-logging.basicConfig(
-    level=config.get_log_level(),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),  # 输出到控制台
-        logging.FileHandler(config.get_log_file_path(), encoding='utf-8')  # 输出到文件
+def init_static_files():
+    """载入预压缩的静态资源（源文件有变化时先重新构建）"""
+    static_files.load()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时初始化日志、Redis和AI提供商，关闭时释放连接"""
+    global redis_client, REDIS_AVAILABLE, image_job_manager, conversation_compactor, usage_ledger, message_writer, chat_batch_runner, config_reloader, log_listener
+
+    startup_phases = [
+        ("日志", init_logging),
+        ("链路追踪", init_tracing),
+        ("Redis", init_redis),
+        ("AI提供商", init_ai_manager),
+        ("生成图片缓存", init_generated_image_cache),
+        ("静态资源", init_static_files),
     ]
-)
+    timings = {}
+    startup_started = time.perf_counter()
+    for phase_name, phase in startup_phases:
+        phase_started = time.perf_counter()
+        phase()
+        timings[phase_name] = (time.perf_counter() - phase_started) * 1000
+    timings["总计"] = (time.perf_counter() - startup_started) * 1000
+
+    app.state.startup_timings = timings
+    logger.info("启动耗时 - " + ", ".join(f"{name}: {ms:.1f}ms" for name, ms in timings.items()))
+
+    image_job_manager = ImageJobManager(
+        handler=handle_image_job,
+        store=ImageJobStore(redis_client if REDIS_AVAILABLE else None, ttl=config.IMAGE_JOB_TTL),
+        workers=config.IMAGE_JOB_WORKERS,
+        provider_concurrency=config.IMAGE_JOB_PROVIDER_CONCURRENCY,
+        queue_size=config.IMAGE_JOB_QUEUE_SIZE
+    )
+    await image_job_manager.start()
 
-logger = logging.getLogger(__name__)
+    usage_ledger = UsageLedger(
+        redis_client if REDIS_AVAILABLE else None,
+        flush_interval=config.USAGE_FLUSH_INTERVAL,
+        retention_days=config.USAGE_RETENTION_DAYS
+    )
+    await usage_ledger.start()
+
+    if REDIS_AVAILABLE and config.MESSAGE_WRITE_BEHIND:
+        message_writer = MessageWriteBuffer(
+            redis_client,
+            conversation_key=get_conversation_key,
+            sessions_key=get_user_sessions_key,
+            conversation_expire=config.CONVERSATION_EXPIRE_TIME,
+            session_expire=config.SESSION_EXPIRE_TIME,
+            flush_delay=config.MESSAGE_FLUSH_DELAY,
+            max_batch=config.MESSAGE_FLUSH_BATCH,
+            max_pending=config.MESSAGE_WRITE_MAX_PENDING
+        )
+        await message_writer.start()
 
-# 记录应用启动信息
-logger.info(f"应用启动 - {config.APP_NAME} v{config.APP_VERSION}")
-logger.info(f"调试模式: {config.DEBUG}")
-logger.info(f"日志级别: {config.LOG_LEVEL}")
-logger.info(f"日志文件: {config.get_log_file_path()}")
+    config_reloader = ConfigReloader(reload_ai_providers, config.CONFIG_RELOAD_FILE, interval=config.CONFIG_RELOAD_INTERVAL)
+    await config_reloader.start()
+
+    chat_batch_runner = ChatBatchRunner(
+        handler=run_batch_item,
+        provider_concurrency=config.BATCH_PROVIDER_CONCURRENCY,
+        item_timeout=config.BATCH_ITEM_TIMEOUT
+    )
+
+    if config.COMPACTION_ENABLED:
+        conversation_compactor = ConversationCompactor(
+            summarizer=summarize_conversation,
+            history_loader=get_conversation_history,
+            store=SummaryStore(redis_client if REDIS_AVAILABLE else None, ttl=config.CONVERSATION_EXPIRE_TIME),
+            threshold=config.COMPACTION_THRESHOLD,
+            keep_recent=config.COMPACTION_KEEP_RECENT,
+            # 摘要之后的消息同样经过历史窗口截取，窗口最少发送 MAX_HISTORY_MESSAGES-PROMPT_WINDOW_STEP+1 条
+            max_context=config.MAX_HISTORY_MESSAGES - max(1, min(config.PROMPT_WINDOW_STEP, config.MAX_HISTORY_MESSAGES)) + 1
+        )
+        logger.info(f"对话压缩已启用 - 阈值: {conversation_compactor.threshold}, 保留最近消息: {config.COMPACTION_KEEP_RECENT}")
+
+    yield
+
+    await config_reloader.stop()
+    await image_job_manager.stop()
+    if conversation_compactor:
+        await conversation_compactor.stop()
+    # 在关闭Redis连接前写入缓冲区中的消息和剩余的用量增量
+    if message_writer:
+        await message_writer.stop()
+        message_writer = None
+    await usage_ledger.stop()
+    shutdown_image_pool()
+    get_image_preprocessor().shutdown()
+    if image_store:
+        image_store.close()
+    if redis_client:
+        redis_client.close()
+        redis_client = None
+        REDIS_AVAILABLE = False
+    mark_worker_exited()
+    shutdown_tracing()
+    logger.info("应用已关闭")
+    if log_listener:
+        # 停止后台线程前会写完队列中剩余的日志
+        log_listener.stop()
+        log_listener = None
 
 # 应用配置
 app = FastAPI(
     title=config.APP_NAME,
     description="基于FastAPI和OpenAI的聊天应用",
-    version=config.APP_VERSION
+    version=config.APP_VERSION,
+    lifespan=lifespan
 )
 
-# 挂载静态文件目录
-app.mount("/static", StaticFiles(directory="static"), name="static")
-
-# Redis连接配置
-try:
-    redis_client = redis.Redis(**Config.get_redis_config())
-
-    # 测试Redis连接
-    redis_client.ping()
-    logger.info(f"Redis连接成功 - 主机: {Config.REDIS_HOST}:{Config.REDIS_PORT}")
-    REDIS_AVAILABLE = True
-except Exception as e:
-    logger.error(f"Redis连接失败: {e}")
-    logger.warning("应用将在没有Redis的情况下运行，会话数据将不会持久化")
-    redis_client = None
-    REDIS_AVAILABLE = False
-
-# 全局变量声明
-ai_manager = None
+# 限制上传请求体大小（预留multipart表单头部的余量），超限时在传输过程中即返回413
+app.add_middleware(
+    RequestSizeLimitMiddleware,
+    max_body_size=config.MAX_UPLOAD_SIZE + 64 * 1024,
+    paths=["/upload/image"]
+)
+# /chat/stream 兼容JSON中携带Base64图片，按Base64膨胀后的大小限制
+app.add_middleware(
+    RequestSizeLimitMiddleware,
+    max_body_size=config.MAX_UPLOAD_SIZE * 4 // 3 + 64 * 1024,
+    paths=["/chat/stream"]
+)
+# 按Accept-Encoding压缩JSON响应（流式响应不压缩）
+if config.COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=config.COMPRESSION_MIN_SIZE,
+        offload_size=config.COMPRESSION_OFFLOAD_SIZE
+    )
+# 最后添加的中间件最先执行，请求指标覆盖包括413在内的所有响应
+app.add_middleware(MetricsMiddleware)
+# 根span包含指标中间件在内的完整请求处理
+app.add_middleware(TracingMiddleware)
 
-# 验证配置并初始化AI提供商管理器
-try:
-    Config.validate_config()
-    ai_manager = MultiProviderManager(Config.get_all_ai_configs())
-    logger.info(f"AI提供商管理器初始化成功，默认提供商: {Config.DEFAULT_AI_PROVIDER}")
-    logger.info(f"可用提供商: {Config.get_configured_providers()}")
-except ValueError as e:
-    logger.error(f"配置验证失败: {e}")
-    raise
+# 挂载静态文件目录
+static_files = PrecompressedStaticFiles(directory="static", build_dir=config.STATIC_BUILD_DIR)
+app.mount("/static", static_files, name="static")
 
 # 数据模型定义
 class ChatMessage(BaseModel):
@@ -95,6 +379,7 @@ class ChatMessage(BaseModel):
     timestamp: Optional[float] = Field(None, description="时间戳")
     image_data: Optional[str] = Field(None, description="图片数据 (base64编码)")
     image_type: Optional[str] = Field(None, description="图片类型 (image/jpeg, image/png等)")
+    image_id: Optional[str] = Field(None, description="图片ID")
 
 class ChatRequest(BaseModel):
     """聊天请求模型"""
@@ -104,8 +389,25 @@ class ChatRequest(BaseModel):
     role: Optional[str] = Field("assistant", description="AI角色")
     provider: Optional[str] = Field(None, description="AI提供商")
     model: Optional[str] = Field(None, description="AI模型")
-    image_data: Optional[str] = Field(None, description="图片数据 (base64编码)")
+    image_data: Optional[str] = Field(None, description="图片数据 (base64编码，兼容旧客户端，推荐使用image_id或multipart上传)")
     image_type: Optional[str] = Field(None, description="图片类型 (image/jpeg, image/png等)")
+    image_id: Optional[str] = Field(None, description="已上传图片的ID（/upload/image 返回）")
+
+class BatchChatItem(BaseModel):
+    """批量对话条目模型"""
+    id: Optional[str] = Field(None, description="调用方指定的条目ID，原样返回")
+    message: str = Field(..., description="用户消息")
+    role: Optional[str] = Field(None, description="AI角色，默认使用请求级别的角色")
+    provider: Optional[str] = Field(None, description="AI提供商，默认使用请求级别的提供商")
+    model: Optional[str] = Field(None, description="AI模型，默认使用请求级别的模型")
+
+class BatchChatRequest(BaseModel):
+    """批量对话请求模型"""
+    user_id: str = Field(..., description="用户ID（用于用量统计和额度检查）")
+    items: List[BatchChatItem] = Field(..., description="对话条目")
+    role: Optional[str] = Field("assistant", description="AI角色")
+    provider: Optional[str] = Field(None, description="AI提供商")
+    model: Optional[str] = Field(None, description="AI模型")
 
 class ChatResponse(BaseModel):
     """聊天响应模型"""
@@ -157,7 +459,8 @@ AI_ROLES = {
 # 内存存储（当Redis不可用时使用）
 MEMORY_STORAGE = {
     "conversations": {},  # {user_id: {session_id: [messages]}}
-    "sessions": {}  # {user_id: {session_id: session_info}}
+    "sessions": {},  # {user_id: {session_id: session_info}}
+    "session_providers": {}  # {user_id: {session_id: provider}}
 }
 
 def generate_session_id() -> str:
@@ -174,92 +477,151 @@ def get_user_sessions_key(user_id: str) -> str:
     """获取用户会话列表在Redis中的键名"""
     return f"user_sessions:{user_id}"
 
+def get_session_provider_key(user_id: str, session_id: str) -> str:
+    """获取会话绑定的提供商在Redis中的键名"""
+    return f"session_provider:{user_id}:{session_id}"
+
+async def get_session_provider(user_id: str, session_id: str) -> Optional[str]:
+    """获取会话绑定的提供商（会话固定使用同一提供商，提示词前缀缓存才能命中）"""
+    if REDIS_AVAILABLE and redis_client:
+        return redis_client.get(get_session_provider_key(user_id, session_id))
+    return MEMORY_STORAGE["session_providers"].get(user_id, {}).get(session_id)
+
+async def save_session_provider(user_id: str, session_id: str, provider: str):
+    """绑定会话与提供商"""
+    if REDIS_AVAILABLE and redis_client:
+        redis_client.set(get_session_provider_key(user_id, session_id), provider, ex=config.CONVERSATION_EXPIRE_TIME)
+    else:
+        MEMORY_STORAGE["session_providers"].setdefault(user_id, {})[session_id] = provider
+
+async def delete_session_provider(user_id: str, session_id: str):
+    """解除会话与提供商的绑定"""
+    if REDIS_AVAILABLE and redis_client:
+        redis_client.delete(get_session_provider_key(user_id, session_id))
+    else:
+        MEMORY_STORAGE["session_providers"].get(user_id, {}).pop(session_id, None)
+
+def resolve_session_provider(manager: MultiProviderManager, requested: Optional[str], sticky: Optional[str]) -> Optional[str]:
+    """确定本次使用的提供商：请求指定的优先，其次是会话绑定的，都不可用时使用默认提供商"""
+    for candidate in (requested, sticky):
+        if candidate and candidate in manager.providers:
+            return candidate
+    return manager.default_provider
+
+def get_stable_history_window(messages: List[Dict[str, Any]], max_messages: int, step: int) -> List[Dict[str, Any]]:
+    """截取最近的历史消息，起点按step条对齐
+
+    逐条滑动的窗口每轮都会改变第一条历史消息，使提示词前缀缓存失效；
+    按step对齐后起点每step条消息才移动一次，窗口大小在 max_messages-step+1 到 max_messages 之间
+    """
+    if len(messages) <= max_messages:
+        return messages
+    step = max(1, min(step, max_messages))
+    start = -(-(len(messages) - max_messages) // step) * step
+    return messages[start:]
+
 async def save_message_to_redis(user_id: str, session_id: str, message: ChatMessage):
     """将消息保存到Redis或内存"""
-    try:
-        message_data = {
-            "role": message.role,
-            "content": message.content,
-            "timestamp": message.timestamp,
-            "image_data": getattr(message, 'image_data', None),
-            "image_type": getattr(message, 'image_type', None)
-        }
-
-        if REDIS_AVAILABLE and redis_client:
-            # 使用Redis存储
-            conversation_key = get_conversation_key(user_id, session_id)
-
-            # 将消息添加到对话历史
-            redis_client.lpush(conversation_key, json.dumps(message_data))
-
-            # 设置过期时间
-            redis_client.expire(conversation_key, config.CONVERSATION_EXPIRE_TIME)
+    with start_span("storage.save_message", role=message.role, backend="redis" if REDIS_AVAILABLE and redis_client else "memory"):
+        try:
+            message_data = {
+                "role": message.role,
+                "content": message.content,
+                "timestamp": message.timestamp,
+                "image_data": getattr(message, 'image_data', None),
+                "image_type": getattr(message, 'image_type', None),
+                "image_id": getattr(message, 'image_id', None)
+            }
 
-            # 更新用户会话列表
-            sessions_key = get_user_sessions_key(user_id)
             session_info = {
                 "session_id": session_id,
                 "last_message": message.content[:config.MAX_MESSAGE_LENGTH] + "..." if len(message.content) > config.MAX_MESSAGE_LENGTH else message.content,
                 "last_timestamp": message.timestamp
             }
-            redis_client.hset(sessions_key, session_id, json.dumps(session_info))
-            redis_client.expire(sessions_key, config.SESSION_EXPIRE_TIME)
 
-            logger.info(f"消息已保存到Redis - 用户: {user_id}, 会话: {session_id[:8]}..., 角色: {message.role}, 内容长度: {len(message.content)}")
-        else:
-            # 使用内存存储
-            if user_id not in MEMORY_STORAGE["conversations"]:
-                MEMORY_STORAGE["conversations"][user_id] = {}
-            if session_id not in MEMORY_STORAGE["conversations"][user_id]:
-                MEMORY_STORAGE["conversations"][user_id][session_id] = []
+            if REDIS_AVAILABLE and redis_client and message_writer:
+                # 放入写缓冲区立即返回，由后台任务批量写入Redis
+                if message_writer.is_full:
+                    logger.warning(f"消息写缓冲区已满，先写入一批再放入 - 待写入: {message_writer.max_pending}")
+                    await message_writer.flush()
+                message_writer.enqueue(user_id, session_id, message_data, session_info)
+                storage_logger.info("消息已放入写缓冲区 - 用户: %s, 会话: %.8s..., 角色: %s, 内容长度: %d", user_id, session_id, message.role, len(message.content))
+            elif REDIS_AVAILABLE and redis_client:
+                # 使用Redis存储
+                conversation_key = get_conversation_key(user_id, session_id)
+
+                # 将消息添加到对话历史
+                redis_client.lpush(conversation_key, json.dumps(message_data))
+
+                # 设置过期时间
+                redis_client.expire(conversation_key, config.CONVERSATION_EXPIRE_TIME)
+
+                # 更新用户会话列表
+                sessions_key = get_user_sessions_key(user_id)
+                redis_client.hset(sessions_key, session_id, json.dumps(session_info))
+                redis_client.expire(sessions_key, config.SESSION_EXPIRE_TIME)
+
+                storage_logger.info("消息已保存到Redis - 用户: %s, 会话: %.8s..., 角色: %s, 内容长度: %d", user_id, session_id, message.role, len(message.content))
+            else:
+                # 使用内存存储
+                if user_id not in MEMORY_STORAGE["conversations"]:
+                    MEMORY_STORAGE["conversations"][user_id] = {}
+                if session_id not in MEMORY_STORAGE["conversations"][user_id]:
+                    MEMORY_STORAGE["conversations"][user_id][session_id] = []
 
-            MEMORY_STORAGE["conversations"][user_id][session_id].append(message_data)
+                MEMORY_STORAGE["conversations"][user_id][session_id].append(message_data)
 
-            # 更新会话信息
-            if user_id not in MEMORY_STORAGE["sessions"]:
-                MEMORY_STORAGE["sessions"][user_id] = {}
+                # 更新会话信息
+                if user_id not in MEMORY_STORAGE["sessions"]:
+                    MEMORY_STORAGE["sessions"][user_id] = {}
 
-            MEMORY_STORAGE["sessions"][user_id][session_id] = {
-                "session_id": session_id,
-                "last_message": message.content[:config.MAX_MESSAGE_LENGTH] + "..." if len(message.content) > config.MAX_MESSAGE_LENGTH else message.content,
-                "last_timestamp": message.timestamp
-            }
+                MEMORY_STORAGE["sessions"][user_id][session_id] = session_info
 
-            logger.info(f"消息已保存到内存 - 用户: {user_id}, 会话: {session_id[:8]}..., 角色: {message.role}, 内容长度: {len(message.content)}")
+                storage_logger.info("消息已保存到内存 - 用户: %s, 会话: %.8s..., 角色: %s, 内容长度: %d", user_id, session_id, message.role, len(message.content))
 
-    except Exception as e:
-        logger.error(f"保存消息失败 - 用户: {user_id}, 会话: {session_id[:8]}..., 错误: {e}")
-        raise
+        except Exception as e:
+            logger.error(f"保存消息失败 - 用户: {user_id}, 会话: {session_id[:8]}..., 错误: {e}")
+            raise
 
 async def get_conversation_history(user_id: str, session_id: str) -> List[Dict[str, Any]]:
     """从Redis或内存获取对话历史"""
-    try:
-        if REDIS_AVAILABLE and redis_client:
-            # 从Redis获取
-            conversation_key = get_conversation_key(user_id, session_id)
-            messages = redis_client.lrange(conversation_key, 0, -1)
-
-            # 反转消息顺序（Redis中是倒序存储的）
-            messages.reverse()
-
-            history = [json.loads(msg) for msg in messages]
-            logger.info(f"从Redis获取对话历史 - 用户: {user_id}, 会话: {session_id[:8]}..., 消息数量: {len(history)}")
-            return history
-        else:
-            # 从内存获取
-            if (user_id in MEMORY_STORAGE["conversations"] and
-                session_id in MEMORY_STORAGE["conversations"][user_id]):
-                history = MEMORY_STORAGE["conversations"][user_id][session_id]
-                logger.info(f"从内存获取对话历史 - 用户: {user_id}, 会话: {session_id[:8]}..., 消息数量: {len(history)}")
+    with start_span("storage.get_history", backend="redis" if REDIS_AVAILABLE and redis_client else "memory") as span:
+        try:
+            if REDIS_AVAILABLE and redis_client:
+                # 从Redis获取
+                conversation_key = get_conversation_key(user_id, session_id)
+                # 等待写入中的消息完成，避免同一条消息既从Redis读到又从写缓冲区读到
+                if message_writer:
+                    await message_writer.wait_idle()
+                messages = redis_client.lrange(conversation_key, 0, -1)
+
+                # 反转消息顺序（Redis中是倒序存储的）
+                messages.reverse()
+
+                history = [json.loads(msg) for msg in messages]
+                # 合并写缓冲区中尚未写入的消息
+                if message_writer:
+                    history.extend(message_writer.get_pending_messages(user_id, session_id))
+                span.set_attribute("messages", len(history))
+                storage_logger.info("从Redis获取对话历史 - 用户: %s, 会话: %.8s..., 消息数量: %d", user_id, session_id, len(history))
                 return history
             else:
-                logger.info(f"对话历史为空 - 用户: {user_id}, 会话: {session_id[:8]}...")
-                return []
-    except Exception as e:
-        logger.error(f"获取对话历史失败 - 用户: {user_id}, 会话: {session_id[:8]}..., 错误: {e}")
-        return []
+                # 从内存获取
+                if (user_id in MEMORY_STORAGE["conversations"] and
+                    session_id in MEMORY_STORAGE["conversations"][user_id]):
+                    history = MEMORY_STORAGE["conversations"][user_id][session_id]
+                    span.set_attribute("messages", len(history))
+                    storage_logger.info("从内存获取对话历史 - 用户: %s, 会话: %.8s..., 消息数量: %d", user_id, session_id, len(history))
+                    return history
+                else:
+                    storage_logger.info("对话历史为空 - 用户: %s, 会话: %.8s...", user_id, session_id)
+                    return []
+        except Exception as e:
+            logger.error(f"获取对话历史失败 - 用户: {user_id}, 会话: {session_id[:8]}..., 错误: {e}")
+            span.record_exception(e)
+            return []
 
-async def generate_ai_response(messages: List[Dict[str, Any]], role: str = "assistant", provider: Optional[str] = None) -> str:
+async def generate_ai_response(messages: List[Dict[str, Any]], role: str = "assistant", provider: Optional[str] = None, user_id: str = "anonymous") -> str:
     """调用AI模型生成响应"""
     logger.info(f"开始生成AI响应 - 角色: {role}, 历史消息数: {len(messages)}, 提供商: {provider}")
 
@@ -270,7 +632,7 @@ async def generate_ai_response(messages: List[Dict[str, Any]], role: str = "assi
     formatted_messages = [{"role": "system", "content": system_prompt}]
 
     # 添加历史消息（只保留最近的对话）
-    recent_messages = messages[-config.MAX_HISTORY_MESSAGES:] if len(messages) > config.MAX_HISTORY_MESSAGES else messages
+    recent_messages = get_stable_history_window(messages, config.MAX_HISTORY_MESSAGES, config.PROMPT_WINDOW_STEP)
     for msg in recent_messages:
         if msg["role"] in ["user", "assistant"]:
             formatted_messages.append({
@@ -291,37 +653,171 @@ async def generate_ai_response(messages: List[Dict[str, Any]], role: str = "assi
                 timestamp=time.time()
             ))
 
-        # 使用回退机制生成响应
-        response = await ai_manager.generate_response_with_fallback(
+        # 使用回退机制生成响应（整个请求使用同一个管理器，重新加载配置时不会混用新旧提供商）
+        manager = ai_manager
+        response = await manager.generate_response_with_fallback(
             messages=ai_messages,
             preferred_provider=provider,
             system_prompt=system_prompt
         )
         ai_response = response.content
+        if response.finish_reason != 'error':
+            record_usage(
+                user_id, *get_usage_labels(manager, provider, None), response.usage,
+                [system_prompt] + [msg.content for msg in ai_messages], ai_response
+            )
         logger.info(f"AI响应生成成功 - 响应长度: {len(ai_response)}")
         return ai_response
     except Exception as e:
         logger.error(f"AI响应生成失败: {e}")
         return f"抱歉，AI服务暂时不可用：{str(e)}"
 
-async def generate_streaming_response(user_id: str, session_id: str, user_message: str, role: str = "assistant", provider: Optional[str] = None, model: Optional[str] = None, image_data: Optional[str] = None, image_type: Optional[str] = None):
+async def load_image_bytes(image_id: Optional[str]) -> Optional[bytes]:
+    """读取消息引用的图片原始字节，图片不存在（已过期）时返回None"""
+    if not image_id:
+        return None
+    image = await run_in_image_pool(image_store.get, image_id)
+    if image is None:
+        logger.warning(f"消息引用的图片不存在或已过期 - 图片ID: {image_id[:12]}...")
+        return None
+    return image[0]
+
+async def store_uploaded_image(file: StarletteUploadFile) -> Tuple[str, str]:
+    """校验上传的图片文件并保存，返回图片ID和类型"""
+    if not file.content_type or not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="只支持图片文件")
+
+    image_bytes = await run_in_image_pool(read_verified_image, file.file, config.MAX_UPLOAD_SIZE)
+    UPLOAD_SIZE.labels(endpoint="/chat/stream").observe(len(image_bytes))
+    image_id = await run_in_image_pool(image_store.save, image_bytes, file.content_type)
+    return image_id, file.content_type
+
+async def resolve_chat_image(chat_request: "ChatRequest") -> Tuple[Optional[str], Optional[str]]:
+    """解析JSON聊天请求中的图片，返回图片ID和类型"""
+    if chat_request.image_id:
+        image_type = await run_in_image_pool(image_store.get_type, chat_request.image_id)
+        if image_type is None:
+            raise HTTPException(status_code=400, detail="图片不存在或已过期，请重新上传")
+        return chat_request.image_id, image_type
+
+    if chat_request.image_data:
+        # 兼容旧客户端：解码Base64后以二进制保存
+        image_type = chat_request.image_type or "image/jpeg"
+        image_bytes = await run_in_image_pool(decode_verified_image, chat_request.image_data, config.MAX_UPLOAD_SIZE)
+        UPLOAD_SIZE.labels(endpoint="/chat/stream").observe(len(image_bytes))
+        image_id = await run_in_image_pool(image_store.save, image_bytes, image_type)
+        return image_id, image_type
+
+    return None, None
+
+CONVERSATION_SUMMARY_PROMPT = "以下是本次对话中较早内容的摘要，请结合摘要和后续消息回答："
+
+COMPACTION_SYSTEM_PROMPT = (
+    "你负责压缩对话历史。请把已有摘要和新的对话内容合并为一份简洁的摘要，"
+    "保留用户的目标、偏好、已确认的事实和结论以及未解决的问题，省略寒暄和重复内容。只输出摘要正文。"
+)
+
+async def summarize_conversation(user_id: str, previous_summary: Optional[str], messages: List[Dict[str, Any]]) -> str:
+    """用配置的（低成本）模型把较早的消息合并进滚动摘要，用量计入该用户"""
+    manager = ai_manager
+    provider_obj = manager.get_provider(config.COMPACTION_PROVIDER or None)
+    if provider_obj is None:
+        raise ValueError(f"对话压缩提供商不可用: {config.COMPACTION_PROVIDER or '默认'}")
+
+    lines = []
+    for msg in messages:
+        if msg["role"] in ["user", "assistant"]:
+            speaker = "用户" if msg["role"] == "user" else "助手"
+            image_note = "[图片] " if msg.get("image_id") or msg.get("image_data") else ""
+            lines.append(f"{speaker}: {image_note}{msg['content']}")
+    prompt = f"已有摘要：\n{previous_summary or '（无）'}\n\n新的对话内容：\n" + "\n".join(lines)
+
+    kwargs = {"system_prompt": COMPACTION_SYSTEM_PROMPT, "max_tokens": config.COMPACTION_MAX_TOKENS}
+    if config.COMPACTION_MODEL:
+        kwargs["model"] = config.COMPACTION_MODEL
+    response = await provider_obj.generate_response([AIMessage(role="user", content=prompt, timestamp=time.time())], **kwargs)
+    if response.finish_reason == 'error':
+        raise RuntimeError(response.content)
+    record_usage(
+        user_id, *get_usage_labels(manager, config.COMPACTION_PROVIDER or None, config.COMPACTION_MODEL or None), response.usage,
+        [COMPACTION_SYSTEM_PROMPT, prompt], response.content
+    )
+    return response.content.strip()
+
+def get_usage_labels(manager: MultiProviderManager, provider: Optional[str], model: Optional[str]) -> Tuple[str, str]:
+    """解析用量账本记录的提供商和模型
+
+    模型为请求指定的模型，未指定时为提供商的默认模型；与指标标签不同，不在模型列表中的模型不归并为other。
+    所有调用路径使用同一规则，同一模型的用量记在同一个键下
+    """
+    provider_name = provider if provider and provider in manager.providers else manager.default_provider
+    provider_obj = manager.get_provider(provider_name)
+    default_model = provider_obj.get_config_value('model') if provider_obj else None
+    return provider_name or "unknown", model or default_model or "unknown"
+
+def get_chat_metric_labels(manager: MultiProviderManager, provider: Optional[str], model: Optional[str]) -> Tuple[str, str]:
+    """解析实际使用的提供商和模型作为指标标签，未知模型归为other以限制标签数量"""
+    provider_name = provider if provider and provider in manager.providers else manager.default_provider
+    provider_obj = manager.get_provider(provider_name)
+    if provider_obj is None:
+        return provider_name or "unknown", model or "unknown"
+
+    default_model = provider_obj.get_config_value('model') or "default"
+    if not model or model == default_model:
+        return provider_name, default_model
+    return provider_name, model if model in provider_obj.get_available_models() else "other"
+
+def record_usage(
+    user_id: str,
+    provider: str,
+    model: str,
+    usage: Optional[Dict[str, Any]],
+    prompt_texts: List[str],
+    completion_text: str,
+    images: int = 0
+):
+    """记录一次调用的token用量，提供商未返回用量时按请求和响应文本估算"""
+    if usage_ledger is None:
+        return
+    if usage and usage.get("total_tokens"):
+        usage_ledger.record(user_id, provider, model, usage)
+    else:
+        usage_ledger.record(user_id, provider, model, estimate_usage(prompt_texts, completion_text, images), estimated=True)
+
+def check_usage_quota(user_id: str):
+    """用户今日token用量达到每日额度时拒绝请求（429）"""
+    if config.USAGE_DAILY_TOKEN_QUOTA <= 0:
+        return
+    used = usage_ledger.get_user_day_total(user_id)
+    if used >= config.USAGE_DAILY_TOKEN_QUOTA:
+        logger.warning(f"用户今日token用量已达上限 - 用户: {user_id}, 已用: {used}, 上限: {config.USAGE_DAILY_TOKEN_QUOTA}")
+        raise HTTPException(status_code=429, detail="今日token用量已达上限，请明天再试")
+
+async def generate_streaming_response(user_id: str, session_id: str, user_message: str, role: str = "assistant", provider: Optional[str] = None, model: Optional[str] = None, image_id: Optional[str] = None, image_type: Optional[str] = None):
     """生成流式响应"""
-    logger.info(f"开始流式响应 - 用户: {user_id}, 会话: {session_id[:8]}..., 角色: {role}, 消息长度: {len(user_message)}, 提供商: {provider}")
+    logger.info("开始流式响应 - 用户: %s, 会话: %.8s..., 角色: %s, 消息长度: %d, 提供商: %s", user_id, session_id, role, len(user_message), provider)
 
+    # 整个请求使用同一个管理器，重新加载配置时不会混用新旧提供商
+    manager = ai_manager
     try:
+        # 会话绑定提供商，避免会话在提供商之间切换导致提示词前缀缓存失效
+        sticky_provider = await get_session_provider(user_id, session_id) if config.SESSION_PROVIDER_AFFINITY else None
+        provider = resolve_session_provider(manager, provider, sticky_provider)
+
         # 保存用户消息
         from ai_providers.base import AIMessage
         user_msg = AIMessage(
             role="user",
             content=user_message,
             timestamp=time.time(),
-            image_data=image_data,
-            image_type=image_type
+            image_type=image_type,
+            image_id=image_id
         )
         await save_message_to_redis(user_id, session_id, user_msg)
 
         # 获取对话历史
         history = await get_conversation_history(user_id, session_id)
+        history_length = len(history)
 
         # 构建系统提示
         system_prompt = AI_ROLES.get(role, AI_ROLES["assistant"])["prompt"]
@@ -329,51 +825,122 @@ async def generate_streaming_response(user_id: str, session_id: str, user_messag
         # 构建AIMessage对象列表
         ai_messages = []
 
-        # 添加历史消息
-        recent_messages = history[-config.MAX_HISTORY_MESSAGES:] if len(history) > config.MAX_HISTORY_MESSAGES else history
-        for msg in recent_messages:
-            if msg["role"] in ["user", "assistant"]:
-                ai_messages.append(AIMessage(
-                    role=msg["role"],
-                    content=msg["content"],
-                    timestamp=msg.get("timestamp", time.time()),
-                    image_data=msg.get("image_data"),
-                    image_type=msg.get("image_type")
-                ))
+        # 添加历史消息（启用对话压缩时发送 摘要 + 摘要未覆盖的消息）
+        with start_span("chat.build_context") as context_span:
+            summary = None
+            context_messages = history
+            if conversation_compactor:
+                summary = conversation_compactor.get_summary(user_id, session_id, history)
+                summary_text, context_messages = conversation_compactor.build_context(history, summary)
+                if summary_text:
+                    system_prompt = f"{system_prompt}\n\n{CONVERSATION_SUMMARY_PROMPT}\n{summary_text}"
+                    context_span.set_attribute("summary_covered", summary["covered"])
+            recent_messages = get_stable_history_window(context_messages, config.MAX_HISTORY_MESSAGES, config.PROMPT_WINDOW_STEP)
+            for msg in recent_messages:
+                if msg["role"] in ["user", "assistant"]:
+                    ai_messages.append(AIMessage(
+                        role=msg["role"],
+                        content=msg["content"],
+                        timestamp=msg.get("timestamp", time.time()),
+                        image_data=msg.get("image_data"),
+                        image_type=msg.get("image_type"),
+                        image_id=msg.get("image_id")
+                    ))
+            context_span.set_attribute("messages", len(ai_messages))
 
         # 调用AI流式API
-        logger.info(f"调用AI流式API - 消息数: {len(ai_messages)}, 提供商: {provider or '默认'}, 模型: {model or '默认'}")
+        logger.info("调用AI流式API - 消息数: %d, 提供商: %s, 模型: %s", len(ai_messages), provider or '默认', model or '默认')
 
         full_response = ""
         content_only_response = ""  # 只保存 type: 'content' 的内容
+        reasoning_response = ""  # 深度思考内容，只用于估算用量
         chunk_count = 0
-        async for chunk in ai_manager.generate_streaming_response(
-            messages=ai_messages,
-            provider=provider,
-            model=model,
-            system_prompt=system_prompt
-        ):
-            if chunk:
-                full_response += chunk
-                chunk_count += 1
-
-                # 解析chunk数据，只保留 type: 'content' 的内容到Redis
-                try:
-                    if chunk.startswith("data: "):
-                        json_str = chunk[6:].strip()  # 移除 "data: " 前缀
-                        if json_str:
-                            chunk_data = json.loads(json_str)
-                            # 只累积 type 为 'content' 的内容用于保存到Redis
-                            if chunk_data.get('type') == 'content' and 'content' in chunk_data:
-                                content_only_response += chunk_data['content']
-                except (json.JSONDecodeError, KeyError) as e:
-                    # 如果解析失败，按原来的方式处理（向后兼容）
-                    logger.debug(f"解析chunk数据失败，使用原始内容: {e}")
-                    content_only_response += chunk
-
-                yield chunk
-
-        logger.info(f"流式响应完成 - 用户: {user_id}, 会话: {session_id[:8]}..., 块数: {chunk_count}, 总长度: {len(full_response)}, 内容长度: {len(content_only_response)}")
+        token_count = 0  # 流式增量片段数，每个片段约为一个token
+        provider_failed = False
+        stream_started = time.perf_counter()
+        first_token_at = None
+        metric_provider, metric_model = get_chat_metric_labels(manager, provider, model)
+        PROVIDER_REQUESTS.labels(provider=metric_provider, model=metric_model, endpoint="/chat/stream").inc()
+        CHAT_ACTIVE_STREAMS.labels(provider=metric_provider).inc()
+        client_write_time = 0.0
+        usage = None
+        try:
+            with start_span("chat.stream", provider=metric_provider, model=metric_model) as stream_span:
+                async for chunk in manager.generate_streaming_response(
+                    messages=ai_messages,
+                    provider=provider,
+                    model=model,
+                    system_prompt=system_prompt,
+                    # 图片只在提供商的格式化缓存未命中时读取，避免每轮重新读取整个历史中的图片
+                    image_loader=load_image_bytes
+                ):
+                    if chunk:
+                        # 解析chunk数据，只保留 type: 'content' 的内容到Redis
+                        try:
+                            if chunk.startswith("data: "):
+                                json_str = chunk[6:].strip()  # 移除 "data: " 前缀
+                                if json_str:
+                                    chunk_data = json.loads(json_str)
+                                    if chunk_data.get('type') == 'usage':
+                                        # 用量只在服务端记录，不发送给客户端
+                                        usage = chunk_data['usage']
+                                        record_prompt_usage(metric_provider, metric_model, usage)
+                                        continue
+                                    if chunk_data.get('type') in ('content', 'reasoning'):
+                                        token_count += 1
+                                        if first_token_at is None:
+                                            first_token_at = time.perf_counter()
+                                            stream_span.add_event("first_token")
+                                    # 只累积 type 为 'content' 的内容用于保存到Redis
+                                    if chunk_data.get('type') == 'content' and 'content' in chunk_data:
+                                        content_only_response += chunk_data['content']
+                                    elif chunk_data.get('type') == 'reasoning':
+                                        reasoning_response += chunk_data.get('content', '')
+                            else:
+                                # 提供商出错时返回不带 data: 前缀的错误文本
+                                provider_failed = True
+                        except (json.JSONDecodeError, KeyError) as e:
+                            # 如果解析失败，按原来的方式处理（向后兼容）
+                            logger.debug("解析chunk数据失败，使用原始内容: %s", e)
+                            content_only_response += chunk
+
+                        full_response += chunk
+                        chunk_count += 1
+
+                        # yield期间由StreamingResponse把数据写给客户端，累计客户端写入耗时
+                        write_started = time.perf_counter()
+                        yield chunk
+                        client_write_time += time.perf_counter() - write_started
+
+                stream_span.set_attributes(chunks=chunk_count, tokens=token_count, client_write_ms=round(client_write_time * 1000, 3))
+                if usage:
+                    stream_span.set_attributes(prompt_tokens=usage.get('prompt_tokens', 0), cached_tokens=usage.get('cached_tokens', 0))
+        except Exception:
+            provider_failed = True
+            raise
+        finally:
+            CHAT_ACTIVE_STREAMS.labels(provider=metric_provider).dec()
+            stream_finished = time.perf_counter()
+            if provider_failed:
+                PROVIDER_ERRORS.labels(provider=metric_provider, model=metric_model, endpoint="/chat/stream").inc()
+            CHAT_STREAM_DURATION.labels(provider=metric_provider, model=metric_model).observe(stream_finished - stream_started)
+            CHAT_STREAM_CHUNKS.labels(provider=metric_provider, model=metric_model).observe(chunk_count)
+            if first_token_at is not None:
+                CHAT_TIME_TO_FIRST_TOKEN.labels(provider=metric_provider, model=metric_model).observe(first_token_at - stream_started)
+                if token_count > 1 and stream_finished > first_token_at:
+                    CHAT_TOKENS_PER_SECOND.labels(provider=metric_provider, model=metric_model).observe(
+                        (token_count - 1) / (stream_finished - first_token_at)
+                    )
+            # 客户端中途断开时已生成的token同样计费，在finally中记录；提供商失败且未生成内容时不记录
+            if usage or token_count:
+                record_usage(
+                    user_id, *get_usage_labels(manager, provider, model), usage,
+                    [system_prompt] + [msg.content for msg in ai_messages],
+                    reasoning_response + content_only_response,
+                    images=sum(1 for msg in ai_messages if msg.image_id or msg.image_data)
+                )
+
+        logger.info("流式响应完成 - 用户: %s, 会话: %.8s..., 块数: %d, 总长度: %d, 内容长度: %d", user_id, session_id, chunk_count, len(full_response), len(content_only_response))
 
         # 保存AI响应（只保存 type: 'content' 的内容）
         ai_msg = ChatMessage(
@@ -383,6 +950,13 @@ async def generate_streaming_response(user_id: str, session_id: str, user_messag
         )
         await save_message_to_redis(user_id, session_id, ai_msg)
 
+        if config.SESSION_PROVIDER_AFFINITY and not provider_failed and provider != sticky_provider:
+            await save_session_provider(user_id, session_id, provider)
+
+        # 历史超过阈值时在后台更新摘要，不影响本次响应
+        if conversation_compactor:
+            conversation_compactor.schedule(user_id, session_id, history_length + 1, summary)
+
         # 发送结束信号
         yield f"data: {json.dumps({'type': 'end', 'session_id': session_id})}\n\n"
 
@@ -403,24 +977,92 @@ async def api_info():
     logger.info("获取API信息")
     return {"message": "FastAPI AI聊天应用演示", "version": "1.0.0"}
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus指标（多worker模式下合并所有worker的数据，读取指标文件较慢，在线程池中执行）"""
+    data, content_type = render_metrics()
+    return Response(content=data, media_type=content_type)
+
+
+
+# /chat/stream 同时接受JSON和multipart两种请求体，手动解析后在OpenAPI中声明
+CHAT_STREAM_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {
+                "schema": {"$ref": "#/components/schemas/ChatRequest"}
+            },
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["user_id", "session_id", "message"],
+                    "properties": {
+                        "user_id": {"type": "string"},
+                        "session_id": {"type": "string"},
+                        "message": {"type": "string"},
+                        "role": {"type": "string"},
+                        "provider": {"type": "string"},
+                        "model": {"type": "string"},
+                        "image": {"type": "string", "format": "binary"}
+                    }
+                }
+            }
+        }
+    }
+}
 
+@app.post("/chat/stream", openapi_extra=CHAT_STREAM_OPENAPI)
+async def chat_stream(request: Request):
+    """流式聊天接口
+
+    支持两种请求格式：
+    1. application/json：ChatRequest，图片通过image_id引用已上传的图片（兼容image_data）
+    2. multipart/form-data：ChatRequest字段作为表单字段，图片以二进制文件字段image提交
+    """
+    content_type = request.headers.get("content-type", "")
+
+    try:
+        if content_type.startswith("multipart/form-data"):
+            async with request.form() as form:
+                fields = {key: value for key, value in form.items() if isinstance(value, str)}
+                chat_request = ChatRequest(**fields)
+                image_file = form.get("image")
+                if isinstance(image_file, StarletteUploadFile):
+                    image_id, image_type = await store_uploaded_image(image_file)
+                else:
+                    image_id, image_type = await resolve_chat_image(chat_request)
+        else:
+            chat_request = ChatRequest.model_validate_json(await request.body())
+            image_id, image_type = await resolve_chat_image(chat_request)
+    except ValidationError as e:
+        # 与FastAPI自动校验的错误格式一致：loc以body开头；不回显原始输入（非UTF-8的bytes无法序列化）
+        raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False, include_input=False)])
+    except ImageTooLargeError as e:
+        logger.warning(f"聊天图片大小超出限制 - 大小: {e.size} bytes, 限制: {e.max_size} bytes")
+        raise HTTPException(status_code=413, detail=f"文件大小不能超过{e.max_size / (1024 * 1024):.0f}MB，当前文件大小: {e.size / (1024 * 1024):.2f}MB")
+    except InvalidImageError as e:
+        logger.error(f"聊天图片验证失败: {e}")
+        raise HTTPException(status_code=400, detail="无效的图片文件")
 
-@app.post("/chat/stream")
-async def chat_stream(request: ChatRequest):
-    """流式聊天接口"""
     # 设置默认值
     role = "assistant"
-    provider = request.provider
-    model = getattr(request, 'model', None)
+    provider = chat_request.provider
+    model = chat_request.model
 
-    logger.info(f"流式聊天请求 - 用户: {request.user_id}, 会话: {request.session_id[:8]}..., 角色: {role}, 消息长度: {len(request.message)}, 提供商: {provider}")
+    logger.info(
+        "流式聊天请求 - 用户: %s, 会话: %.8s..., 角色: %s, 消息长度: %d, 提供商: %s, 图片: %.12s",
+        chat_request.user_id, chat_request.session_id, role, len(chat_request.message), provider, image_id or '无'
+    )
 
     if role not in AI_ROLES:
         logger.warning(f"不支持的AI角色: {role}")
         raise HTTPException(status_code=400, detail="不支持的AI角色")
 
+    check_usage_quota(chat_request.user_id)
+
     return StreamingResponse(
-        generate_streaming_response(request.user_id, request.session_id, request.message, role, provider, model, request.image_data, request.image_type),
+        generate_streaming_response(chat_request.user_id, chat_request.session_id, chat_request.message, role, provider, model, image_id, image_type),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -429,6 +1071,117 @@ async def chat_stream(request: ChatRequest):
         }
     )
 
+async def open_websocket_stream(message: Dict[str, Any]):
+    """校验WebSocket中的chat消息，返回与 /chat/stream 相同的流式响应"""
+    chat_request = ChatRequest.model_validate({key: value for key, value in message.items() if key not in ("type", "request_id")})
+    role = chat_request.role or "assistant"
+    if role not in AI_ROLES:
+        raise HTTPException(status_code=400, detail="不支持的AI角色")
+    check_usage_quota(chat_request.user_id)
+    image_id, image_type = await resolve_chat_image(chat_request)
+
+    logger.info(
+        "WebSocket聊天请求 - 用户: %s, 会话: %.8s..., 角色: %s, 消息长度: %d, 提供商: %s",
+        chat_request.user_id, chat_request.session_id, role, len(chat_request.message), chat_request.provider
+    )
+    return generate_streaming_response(
+        chat_request.user_id, chat_request.session_id, chat_request.message, role,
+        chat_request.provider, chat_request.model, image_id, image_type
+    )
+
+@app.websocket("/chat/ws")
+async def chat_websocket(websocket: WebSocket):
+    """WebSocket聊天接口：一个连接上同时进行多个会话的流式对话，协议见 chat_websocket 模块"""
+    await websocket.accept()
+    CHAT_WS_CONNECTIONS.inc()
+    try:
+        await ChatWebSocketSession(
+            websocket,
+            open_stream=open_websocket_stream,
+            max_streams=config.WS_MAX_STREAMS,
+            send_queue_size=config.WS_SEND_QUEUE_SIZE
+        ).run()
+    finally:
+        CHAT_WS_CONNECTIONS.dec()
+
+async def run_batch_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """执行批量对话中的一条（无对话历史，不保存消息），失败时抛出异常由批量执行器记录"""
+    # 每条执行前重新检查每日额度，一个批次最多超出正在执行的几条，超出额度的条目记为失败
+    try:
+        check_usage_quota(item["user_id"])
+    except HTTPException as e:
+        raise RuntimeError(e.detail) from None
+    system_prompt = AI_ROLES[item["role"]]["prompt"]
+    manager = ai_manager
+    metric_provider, metric_model = get_chat_metric_labels(manager, item["provider"], item["model"])
+    PROVIDER_REQUESTS.labels(provider=metric_provider, model=metric_model, endpoint="/chat/batch").inc()
+
+    response = await manager.generate_response(
+        [AIMessage(role="user", content=item["message"], timestamp=time.time())],
+        provider=item["provider"],
+        model=item["model"],
+        system_prompt=system_prompt
+    )
+    if response.finish_reason == 'error':
+        PROVIDER_ERRORS.labels(provider=metric_provider, model=metric_model, endpoint="/chat/batch").inc()
+        raise RuntimeError(response.content)
+
+    record_usage(
+        item["user_id"], *get_usage_labels(manager, item["provider"], item["model"]), response.usage,
+        [system_prompt, item["message"]], response.content
+    )
+    return {
+        "model": response.model,
+        "content": response.content,
+        "finish_reason": response.finish_reason,
+        "usage": response.usage
+    }
+
+async def generate_batch_results(items: List[Dict[str, Any]]):
+    """逐行输出批量对话结果（NDJSON）"""
+    async for result in chat_batch_runner.run(items):
+        yield json.dumps(result, ensure_ascii=False) + "\n"
+
+@app.post("/chat/batch")
+async def chat_batch(batch_request: BatchChatRequest):
+    """批量对话接口
+
+    每个条目独立执行（不使用也不保存对话历史），按提供商限制并发，
+    以NDJSON逐行返回：每条完成后立即输出一行结果（含排队耗时、执行耗时、用量或失败原因），最后一行为汇总
+    """
+    if not batch_request.items:
+        raise HTTPException(status_code=400, detail="批量请求不能为空")
+    if len(batch_request.items) > config.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"单次最多提交{config.BATCH_MAX_ITEMS}条")
+
+    manager = ai_manager
+    items = []
+    for item in batch_request.items:
+        role = item.role or batch_request.role or "assistant"
+        if role not in AI_ROLES:
+            raise HTTPException(status_code=400, detail=f"不支持的AI角色: {role}")
+        provider = item.provider or batch_request.provider
+        if provider and provider not in manager.providers:
+            raise HTTPException(status_code=400, detail=f"不支持的AI提供商: {provider}")
+        items.append({
+            "id": item.id,
+            "user_id": batch_request.user_id,
+            "message": item.message,
+            "role": role,
+            # 提前解析默认提供商，按实际提供商限制并发
+            "provider": provider or manager.default_provider,
+            "model": item.model or batch_request.model
+        })
+
+    check_usage_quota(batch_request.user_id)
+    logger.info(f"批量对话请求 - 用户: {batch_request.user_id}, 条目数: {len(items)}")
+
+    return StreamingResponse(
+        generate_batch_results(items),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache"}
+    )
+
 @app.get("/chat/history")
 async def get_chat_history(
     user_id: str = Query(..., description="用户ID"),
@@ -439,6 +1192,11 @@ async def get_chat_history(
 
     try:
         history = await get_conversation_history(user_id, session_id)
+        # 二进制保存的图片通过图片接口加载，不在历史中内联
+        history = [
+            {**msg, "image_url": f"/images/{msg['image_id']}"} if msg.get("image_id") else msg
+            for msg in history
+        ]
         logger.info(f"聊天历史获取成功 - 用户: {user_id}, 会话: {session_id[:8]}..., 消息数: {len(history)}")
         return {
             "session_id": session_id,
@@ -460,10 +1218,12 @@ async def get_user_sessions(user_id: str = Query(..., description="用户ID")):
         if REDIS_AVAILABLE and redis_client:
             # 从Redis获取
             sessions_key = get_user_sessions_key(user_id)
-            sessions_data = redis_client.hgetall(sessions_key)
+            sessions_data = {session_id: json.loads(session_info) for session_id, session_info in redis_client.hgetall(sessions_key).items()}
+            # 合并写缓冲区中尚未写入的会话信息
+            if message_writer:
+                sessions_data.update(message_writer.get_pending_sessions(user_id))
 
-            for session_id, session_info in sessions_data.items():
-                session_data = json.loads(session_info)
+            for session_id, session_data in sessions_data.items():
                 sessions.append({
                     "session_id": session_id,
                     "last_message": session_data["last_message"],
@@ -494,51 +1254,55 @@ async def get_user_sessions(user_id: str = Query(..., description="用户ID")):
         logger.error(f"获取用户会话列表失败 - 用户: {user_id}, 错误: {e}")
         raise HTTPException(status_code=500, detail="获取会话列表失败")
 
-@app.get("/roles")
-async def get_ai_roles():
-    """获取可用的AI角色列表"""
-    logger.info("获取AI角色列表")
-    return {
-        "roles": [
-            {
-                "key": key,
-                "name": value["name"],
-                "description": value["prompt"],
-                "icon": value.get("icon", "🤖")
-            }
-            for key, value in AI_ROLES.items()
-        ]
-    }
+# 单次用量查询的最大天数
+MAX_USAGE_QUERY_DAYS = 92
 
-@app.get("/providers")
-async def get_providers():
-    """获取可用的AI提供商列表"""
-    logger.info("获取AI提供商列表")
+@app.get("/usage")
+async def get_usage(
+    user_id: Optional[str] = Query(None, description="用户ID，不传时返回全部用户的合计"),
+    start: Optional[str] = Query(None, description="开始日期（UTC，YYYY-MM-DD），默认今天"),
+    end: Optional[str] = Query(None, description="结束日期（UTC，YYYY-MM-DD），默认今天"),
+    provider: Optional[str] = Query(None, description="只返回该提供商"),
+    model: Optional[str] = Query(None, description="只返回该模型")
+):
+    """查询token用量（按日期、提供商、模型分组），用于容量规划和额度检查"""
+    today = usage_day()
     try:
-        configured_providers = Config.get_configured_providers()
-        all_models = ai_manager.get_all_available_models()
-
-        providers_info = []
-        for provider in configured_providers:
-            provider_obj = ai_manager.get_provider(provider)
-            if provider_obj:
-                providers_info.append({
-                    "id": provider,
-                    "name": provider_obj.get_provider_name(),
-                    "models": provider_obj.get_available_models(),
-                    "icon": Config.get_provider_icon(provider),
-                    "is_default": provider == Config.DEFAULT_AI_PROVIDER
-                })
+        start_date = datetime.strptime(start or today, "%Y-%m-%d").date()
+        end_date = datetime.strptime(end or today, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="日期格式应为YYYY-MM-DD")
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="开始日期不能晚于结束日期")
+    if (end_date - start_date).days >= MAX_USAGE_QUERY_DAYS:
+        raise HTTPException(status_code=400, detail=f"单次最多查询{MAX_USAGE_QUERY_DAYS}天")
 
-        return {
-            "providers": providers_info,
-            "default_provider": Config.DEFAULT_AI_PROVIDER,
-            "all_models": all_models,
-            "provider_icons": Config.get_all_provider_icons()
-        }
+    try:
+        result = usage_ledger.query(start_date, end_date, user_id=user_id, provider=provider, model=model)
     except Exception as e:
-        logger.error(f"获取AI提供商列表失败: {e}")
-        raise HTTPException(status_code=500, detail=f"获取提供商列表失败: {str(e)}")
+        logger.error(f"查询用量失败 - 用户: {user_id}, 错误: {e}")
+        raise HTTPException(status_code=500, detail="查询用量失败")
+
+    response = {"user_id": user_id, "start": start_date.isoformat(), "end": end_date.isoformat(), **result}
+    if user_id and config.USAGE_DAILY_TOKEN_QUOTA > 0:
+        used = usage_ledger.get_user_day_total(user_id, today)
+        response["quota"] = {
+            "date": today,
+            "daily_tokens": config.USAGE_DAILY_TOKEN_QUOTA,
+            "used_tokens": used,
+            "remaining_tokens": max(config.USAGE_DAILY_TOKEN_QUOTA - used, 0)
+        }
+    return response
+
+@app.get("/roles")
+async def get_ai_roles(request: Request):
+    """获取可用的AI角色列表（预先生成，支持ETag）"""
+    return cached_json_response(request, roles_response)
+
+@app.get("/providers")
+async def get_providers(request: Request):
+    """获取可用的AI提供商列表（配置加载时预先生成，支持ETag）"""
+    return cached_json_response(request, providers_response)
 
 @app.delete("/chat/session/{session_id}")
 async def delete_session(
@@ -550,7 +1314,9 @@ async def delete_session(
 
     try:
         if REDIS_AVAILABLE and redis_client:
-            # 从Redis删除
+            # 从Redis删除（先丢弃尚未写入的消息，避免之后写入使会话重新出现）
+            if message_writer:
+                await message_writer.discard(user_id, session_id)
             conversation_key = get_conversation_key(user_id, session_id)
             sessions_key = get_user_sessions_key(user_id)
 
@@ -581,6 +1347,10 @@ async def delete_session(
 
             logger.info(f"会话已从内存删除 - 用户: {user_id}, 会话: {session_id[:8]}...")
 
+        if conversation_compactor:
+            conversation_compactor.store.delete(user_id, session_id)
+        await delete_session_provider(user_id, session_id)
+
         return {"message": "会话删除成功", "session_id": session_id}
 
     except Exception as e:
@@ -598,6 +1368,8 @@ async def clear_conversation_history(
     try:
         if REDIS_AVAILABLE and redis_client:
             # 从Redis清除对话历史
+            if message_writer:
+                await message_writer.discard(user_id, session_id)
             conversation_key = get_conversation_key(user_id, session_id)
 
             # 删除对话历史
@@ -633,6 +1405,9 @@ async def clear_conversation_history(
 
             logger.info(f"对话历史已从内存清除 - 用户: {user_id}, 会话: {session_id[:8]}...")
 
+        if conversation_compactor:
+            conversation_compactor.store.delete(user_id, session_id)
+
         return {"message": "对话历史清除成功", "session_id": session_id}
 
     except Exception as e:
@@ -649,27 +1424,21 @@ async def upload_image(file: UploadFile = File(...)):
         if not file.content_type or not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="只支持图片文件")
 
-        # 读取文件内容
-        file_content = await file.read()
-
-        # 检查文件大小（10MB = 10 * 1024 * 1024 bytes）
-        max_size = 10 * 1024 * 1024  # 10MB
-        if len(file_content) > max_size:
-            logger.warning(f"文件大小超出限制 - 文件名: {file.filename}, 大小: {len(file_content)} bytes, 限制: {max_size} bytes")
-            raise HTTPException(status_code=413, detail=f"文件大小不能超过10MB，当前文件大小: {len(file_content) / (1024 * 1024):.2f}MB")
-
-        # 验证图片格式
-        try:
-            image = Image.open(BytesIO(file_content))
-            image.verify()  # 验证图片完整性
-        except Exception as e:
-            logger.error(f"图片验证失败: {e}")
-            raise HTTPException(status_code=400, detail="无效的图片文件")
+        max_size = config.MAX_UPLOAD_SIZE
+        # 上传文件已由Starlette写入临时文件（超过1MB落盘），先用已知大小快速拒绝
+        if file.size is not None and file.size > max_size:
+            raise ImageTooLargeError(file.size, max_size)
 
-        # 转换为base64
-        base64_data = base64.b64encode(file_content).decode('utf-8')
+        # 在线程池中校验、保存图片，避免阻塞事件循环
+        image_bytes = await run_in_image_pool(read_verified_image, file.file, max_size)
+        file_size = len(image_bytes)
+        UPLOAD_SIZE.labels(endpoint="/upload/image").observe(file_size)
+        # 保存二进制图片，聊天时可通过image_id引用，无需再次提交图片数据
+        image_id = await run_in_image_pool(image_store.save, image_bytes, file.content_type)
+        # 图生图接口仍以Base64提交参考图片
+        base64_data = await run_in_image_pool(encode_image_base64, image_bytes)
 
-        logger.info(f"图片上传成功 - 文件名: {file.filename}, 大小: {len(file_content)} bytes")
+        logger.info(f"图片上传成功 - 文件名: {file.filename}, 大小: {file_size} bytes")
 
         return {
             "success": True,
@@ -677,20 +1446,143 @@ async def upload_image(file: UploadFile = File(...)):
             "data": {
                 "filename": file.filename,
                 "content_type": file.content_type,
-                "size": len(file_content),
+                "size": file_size,
+                "image_id": image_id,
                 "base64_data": base64_data
             }
         }
 
+    except ImageTooLargeError as e:
+        logger.warning(f"文件大小超出限制 - 文件名: {file.filename}, 大小: {e.size} bytes, 限制: {e.max_size} bytes")
+        raise HTTPException(status_code=413, detail=f"文件大小不能超过{e.max_size / (1024 * 1024):.0f}MB，当前文件大小: {e.size / (1024 * 1024):.2f}MB")
+    except InvalidImageError as e:
+        logger.error(f"图片验证失败: {e}")
+        raise HTTPException(status_code=400, detail="无效的图片文件")
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"图片上传失败: {e}")
         raise HTTPException(status_code=500, detail=f"图片上传失败: {str(e)}")
 
+@app.get("/images/{image_id}")
+async def get_image(image_id: str):
+    """获取已保存的图片（图片ID为内容哈希，内容不可变，可长期缓存）"""
+    image = await run_in_image_pool(image_store.get, image_id)
+    if image is None:
+        raise HTTPException(status_code=404, detail="图片不存在或已过期")
+
+    image_bytes, image_type = image
+    return Response(
+        content=image_bytes,
+        media_type=image_type,
+        headers={
+            "Cache-Control": "private, max-age=31536000, immutable",
+            "ETag": f'"{image_id}"'
+        }
+    )
+
+def get_image_provider(provider_name: str):
+    """获取图片生成提供商，不存在时抛出400"""
+    provider_obj = ai_manager.get_provider(provider_name)
+    if not provider_obj:
+        raise HTTPException(status_code=400, detail=f"不支持的AI提供商: {provider_name}")
+
+    # 检查提供商是否支持图片生成
+    if not hasattr(provider_obj, 'generate_image'):
+        raise HTTPException(status_code=400, detail=f"提供商 {provider_name} 不支持图片生成功能")
+    return provider_obj
+
+def get_generated_image_url(meta: Dict[str, Any]) -> str:
+    """获取缓存的生成图片访问地址"""
+    return f"/generated-images/{meta['filename']}"
+
+async def run_image_generation(request: ImageGenerationAPIRequest, endpoint: str = "/generate/image") -> Dict[str, Any]:
+    """调用提供商生成图片，返回响应数据
+
+    相同请求（提示词、尺寸、质量、提供商、参考图片）命中缓存时直接返回已生成的图片，
+    生成的图片保存到本地缓存目录并以URL返回，不在响应中内联Base64
+    """
+    started = time.perf_counter()
+    provider_obj = get_image_provider(request.provider)
+    image_model = getattr(provider_obj, 'IMAGE_GENERATION_MODEL', None)
+
+    # 计算缓存键（参考图片按解码后的内容参与计算）
+    reference_image = await run_in_image_pool(base64.b64decode, request.image_data) if request.image_data else None
+    cache_key = await run_in_image_pool(make_cache_key, {
+        "provider": request.provider,
+        "model": image_model,
+        "prompt": request.prompt,
+        "size": request.size,
+        "quality": request.quality,
+        "image_type": request.image_type if request.image_data else None
+    }, reference_image)
+
+    cached = await run_in_image_pool(generated_image_cache.get, cache_key)
+    if cached is not None:
+        logger.info(f"图片生成命中缓存 - 提供商: {request.provider}, 缓存键: {cache_key[:12]}...")
+        IMAGE_GENERATION_DURATION.labels(provider=request.provider, endpoint=endpoint, cached="true").observe(time.perf_counter() - started)
+        return {
+            "image_url": get_generated_image_url(cached),
+            "image_b64": None,
+            "revised_prompt": cached.get("revised_prompt"),
+            "size": request.size,
+            "quality": request.quality,
+            "cached": True
+        }
+
+    # 构建图片生成请求
+    generation_request = ImageGenerationRequest(
+        prompt=request.prompt,
+        size=request.size,
+        quality=request.quality,
+        response_format="b64_json",
+        image_data=request.image_data,
+        image_type=request.image_type,
+        watermark=False
+    )
+
+    # 调用提供商的图片生成方法
+    logger.info(f"开始生成图片 - 提供商: {request.provider}, 模式: {'图片生成图片' if request.image_data else '文本生成图片'}")
+    metric_labels = {"provider": request.provider, "model": image_model or "default", "endpoint": endpoint}
+    PROVIDER_REQUESTS.labels(**metric_labels).inc()
+    try:
+        generation_response = await provider_obj.generate_image(generation_request)
+        if not generation_response.url and not generation_response.b64_json:
+            raise RuntimeError("提供商未返回图片")
+    except Exception:
+        PROVIDER_ERRORS.labels(**metric_labels).inc()
+        raise
+
+    logger.info(f"图片生成成功 - 提供商: {request.provider}, URL: {generation_response.url[:50] if generation_response.url else 'N/A'}...")
+
+    image_url = generation_response.url
+    if generation_response.b64_json:
+        # 保存到缓存目录，以本地URL返回
+        image_bytes = await run_in_image_pool(base64.b64decode, generation_response.b64_json)
+        meta = await run_in_image_pool(
+            generated_image_cache.put, cache_key, image_bytes, {"revised_prompt": generation_response.revised_prompt}
+        )
+        image_url = get_generated_image_url(meta)
+
+    IMAGE_GENERATION_DURATION.labels(provider=request.provider, endpoint=endpoint, cached="false").observe(time.perf_counter() - started)
+
+    # 构建响应数据
+    return {
+        "image_url": image_url,
+        "image_b64": None,
+        "revised_prompt": generation_response.revised_prompt,
+        "size": request.size,
+        "quality": request.quality,
+        "cached": False
+    }
+
+async def handle_image_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """图片生成任务处理函数"""
+    return await run_image_generation(ImageGenerationAPIRequest(**payload), endpoint="/generate/image/jobs")
+
 @app.post("/generate/image", response_model=ImageGenerationAPIResponse)
 async def generate_image(request: ImageGenerationAPIRequest):
-    """图片生成API接口
+    """图片生成API接口（同步等待生成完成，耗时较长时推荐使用 /generate/image/jobs）
 
     支持两种模式：
     1. 纯文本生成图片：仅提供prompt参数
@@ -699,40 +1591,7 @@ async def generate_image(request: ImageGenerationAPIRequest):
     logger.info(f"接收图片生成请求 - 提示词: {request.prompt[:50]}..., 提供商: {request.provider}")
 
     try:
-        # 获取AI提供商
-        provider_obj = ai_manager.get_provider(request.provider)
-        if not provider_obj:
-            raise HTTPException(status_code=400, detail=f"不支持的AI提供商: {request.provider}")
-
-        # 检查提供商是否支持图片生成
-        if not hasattr(provider_obj, 'generate_image'):
-            raise HTTPException(status_code=400, detail=f"提供商 {request.provider} 不支持图片生成功能")
-
-        # 构建图片生成请求
-        generation_request = ImageGenerationRequest(
-            prompt=request.prompt,
-            size=request.size,
-            quality=request.quality,
-            response_format="b64_json",
-            image_data=request.image_data,
-            image_type=request.image_type,
-            watermark=False
-        )
-
-        # 调用提供商的图片生成方法
-        logger.info(f"开始生成图片 - 提供商: {request.provider}, 模式: {'图片生成图片' if request.image_data or request.image_data else '文本生成图片'}")
-        generation_response = await provider_obj.generate_image(generation_request)
-
-        logger.info(f"图片生成成功 - 提供商: {request.provider}, URL: {generation_response.url[:50] if generation_response.url else 'N/A'}...")
-
-        # 构建响应数据
-        response_data = {
-            "image_url": generation_response.url,
-            "image_b64": generation_response.b64_json,
-            "revised_prompt": generation_response.revised_prompt,
-            "size": request.size,
-            "quality": request.quality,
-        }
+        response_data = await run_image_generation(request)
 
         return ImageGenerationAPIResponse(
             success=True,
@@ -753,3 +1612,82 @@ async def generate_image(request: ImageGenerationAPIRequest):
             provider=request.provider,
             timestamp=time.time()
         )
+
+@app.get("/generated-images/{filename}")
+async def get_generated_image(filename: str, request: Request):
+    """获取缓存的生成图片（文件名包含内容键，内容不可变，可长期缓存）"""
+    file_path = generated_image_cache.get_file_path(filename)
+    if file_path is None:
+        raise HTTPException(status_code=404, detail="图片不存在或已过期")
+
+    etag = f'"{filename.split(".")[0]}"'
+    headers = {"Cache-Control": "public, max-age=31536000, immutable", "ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(file_path, headers=headers)
+
+@app.get("/generate/image/cache")
+async def get_generated_image_cache_stats():
+    """获取生成图片缓存统计（条目数、大小、命中率等）"""
+    return generated_image_cache.get_stats()
+
+@app.post("/generate/image/jobs", status_code=202)
+async def submit_image_job(request: ImageGenerationAPIRequest):
+    """提交图片生成任务，立即返回任务ID
+
+    通过 GET /generate/image/jobs/{job_id} 轮询，
+    或 GET /generate/image/jobs/{job_id}/events 订阅SSE获取结果
+    """
+    logger.info(f"接收图片生成任务 - 提示词: {request.prompt[:50]}..., 提供商: {request.provider}")
+
+    get_image_provider(request.provider)
+    try:
+        job = image_job_manager.submit(request.provider, request.model_dump())
+    except JobQueueFullError as e:
+        logger.warning(f"图片生成任务提交失败: {e}")
+        raise HTTPException(status_code=503, detail="图片生成任务繁忙，请稍后重试")
+
+    return job
+
+@app.get("/generate/image/jobs/{job_id}")
+async def get_image_job(job_id: str):
+    """查询图片生成任务状态"""
+    job = image_job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    return job
+
+async def generate_image_job_events(job_id: str):
+    """推送任务状态变化，任务完成或失败后结束"""
+    last_status = None
+    while True:
+        job = image_job_manager.get(job_id)
+        if job is None:
+            yield f"data: {json.dumps({'type': 'error', 'content': '任务不存在或已过期'})}\n\n"
+            return
+
+        if job["status"] != last_status:
+            last_status = job["status"]
+            yield f"data: {json.dumps({'type': 'status', 'job': job})}\n\n"
+
+        if job["status"] in JOB_FINISHED_STATUSES:
+            yield f"data: {json.dumps({'type': 'end', 'job_id': job_id})}\n\n"
+            return
+
+        await image_job_manager.wait_for_change(job_id, timeout=1.0)
+
+@app.get("/generate/image/jobs/{job_id}/events")
+async def image_job_events(job_id: str):
+    """以SSE订阅图片生成任务状态"""
+    if image_job_manager.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+
+    return StreamingResponse(
+        generate_image_job_events(job_id),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "Access-Control-Allow-Origin": "*"
+        }
+    )
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+消息异步写入模块
+对话消息先放入进程内缓冲区立即返回，由后台任务合并为一个Redis事务（MULTI/EXEC）批量写入，
+Redis延迟不再计入流式响应的首token和结束时间。尚未写入的消息在读取历史和会话列表时合并返回，
+关闭时写完缓冲区中剩余的消息
+
+每批在同一事务中记录批次序号，写入失败（如Redis执行后连接断开）重试时先读取序号，
+已提交的批次不再重复写入，对话历史中不会出现重复的消息
+
+缓冲区只在本进程内可见：同一会话的下一轮对话由同一进程处理时一定能读到上一轮的消息；
+多worker部署时下一轮可能落到其他worker，最多在 flush_delay 加一次事务耗时内读不到上一轮的消息，
+需要跨进程立即可见时关闭 MESSAGE_WRITE_BEHIND
+"""
+
+import json
+import uuid
+import asyncio
+import logging
+from collections import deque
+from itertools import islice
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 关闭时写入剩余消息的重试次数
+SHUTDOWN_FLUSH_ATTEMPTS = 3
+# 写入失败后的重试间隔（秒）
+RETRY_DELAY = 1.0
+# 批次序号键的过期时间（秒），每批写入时刷新
+BATCH_MARKER_EXPIRE = 24 * 3600
+
+
+class MessageWriteBuffer:
+    """对话消息写缓冲区：进程内排队 + 后台批量写入Redis"""
+
+    def __init__(
+        self,
+        redis_client,
+        conversation_key,
+        sessions_key,
+        conversation_expire: int,
+        session_expire: int,
+        flush_delay: float = 0.005,
+        max_batch: int = 500,
+        max_pending: int = 10000
+    ):
+        """
+        初始化消息写缓冲区
+
+        Args:
+            redis_client: Redis客户端（decode_responses=True）
+            conversation_key: 由 (用户ID, 会话ID) 生成对话历史键名的函数
+            sessions_key: 由用户ID生成会话列表键名的函数
+            conversation_expire: 对话历史过期时间（秒）
+            session_expire: 会话列表过期时间（秒）
+            flush_delay: 收到消息后等待多久再写入，合并同一时段的多条消息（秒）
+            max_batch: 单个事务最多写入的消息数
+            max_pending: 缓冲区消息数上限，达到后写入方先等待写入一批（Redis故障时不无限增长）
+        """
+        self.redis_client = redis_client
+        self.conversation_key = conversation_key
+        self.sessions_key = sessions_key
+        self.conversation_expire = conversation_expire
+        self.session_expire = session_expire
+        self.flush_delay = flush_delay
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        # 按写入顺序排队的消息: (用户ID, 会话ID, 消息, 会话信息)
+        self._queue: Deque[Tuple[str, str, Dict[str, Any], Dict[str, Any]]] = deque()
+        # 尚未写入的消息，读取时合并: (用户ID, 会话ID) -> [消息]
+        self._pending_messages: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        # 写入失败、尚未确认的批次（序号为 _batch_seq），重试时按序号判断是否已提交
+        self._unacked: Optional[List[Tuple[str, str, Dict[str, Any], Dict[str, Any]]]] = None
+        self._batch_seq = 0
+        self._batch_marker_key = f"message_writer:{uuid.uuid4().hex}:batch"
+        self._wakeup = asyncio.Event()
+        # 同一时间只有一批消息在写入；没有正在写入的批次时为set状态
+        self._flush_lock = asyncio.Lock()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """启动后台写入任务"""
+        self._flush_task = asyncio.create_task(self._flush_loop(), name="message-write-buffer")
+
+    async def stop(self):
+        """停止后台写入任务并写入剩余消息，多次失败后记录丢失的消息数"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        for attempt in range(1, SHUTDOWN_FLUSH_ATTEMPTS + 1):
+            try:
+                while self._queue:
+                    await self.flush()
+                return
+            except Exception as e:
+                logger.error(f"关闭时写入缓冲消息失败（第{attempt}次）- 剩余: {len(self._queue)}, 错误: {e}")
+                if attempt < SHUTDOWN_FLUSH_ATTEMPTS:
+                    await asyncio.sleep(RETRY_DELAY)
+        logger.error(f"缓冲区中 {len(self._queue)} 条消息未能写入Redis")
+
+    @property
+    def is_full(self) -> bool:
+        """缓冲区是否已达上限"""
+        return len(self._queue) >= self.max_pending
+
+    def enqueue(self, user_id: str, session_id: str, message_data: Dict[str, Any], session_info: Dict[str, Any]):
+        """
+        放入一条消息，立即返回，由后台任务写入
+
+        Args:
+            user_id: 用户ID
+            session_id: 会话ID
+            message_data: 对话历史中保存的消息
+            session_info: 会话列表中保存的会话信息
+        """
+        self._queue.append((user_id, session_id, message_data, session_info))
+        self._pending_messages.setdefault((user_id, session_id), []).append(message_data)
+        self._wakeup.set()
+
+    async def wait_idle(self):
+        """
+        等待正在写入的一批消息完成
+
+        写入中的消息可能已经在Redis中，同时仍在缓冲区里；读取Redis之前先调用，
+        返回后到下一个await之前读到的Redis数据与 get_pending_messages 不会重复
+        """
+        while not self._idle.is_set():
+            await self._idle.wait()
+
+    def get_pending_messages(self, user_id: str, session_id: str) -> List[Dict[str, Any]]:
+        """获取会话中尚未写入的消息（按写入顺序），需在 wait_idle 之后、同步读取Redis之后调用"""
+        return list(self._pending_messages.get((user_id, session_id), ()))
+
+    def get_pending_sessions(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        """获取用户尚未写入的最新会话信息: 会话ID -> 会话信息"""
+        sessions = {}
+        for pending_user, session_id, _, session_info in self._queue:
+            if pending_user == user_id:
+                sessions[session_id] = session_info
+        return sessions
+
+    async def discard(self, user_id: str, session_id: str) -> int:
+        """
+        丢弃会话中尚未写入的消息（删除或清空会话时调用，避免之后写入使会话重新出现）
+
+        先等待正在写入的批次完成，写入中的消息不会在写入后又被丢弃
+
+        Returns:
+            int: 丢弃的消息数
+        """
+        await self.wait_idle()
+        if self._pending_messages.pop((user_id, session_id), None) is None:
+            return 0
+        before = len(self._queue)
+        self._queue = deque(item for item in self._queue if (item[0], item[1]) != (user_id, session_id))
+        return before - len(self._queue)
+
+    async def flush(self) -> int:
+        """
+        用一个事务写入队列最前面的一批消息，写入成功后才从缓冲区移除，失败时抛出异常
+
+        事务在线程池中执行，不阻塞事件循环；写入期间这批消息仍留在缓冲区，
+        读取方通过 wait_idle 等待写入完成，不会把同一条消息统计两次。
+        写入失败的批次保留序号，下次调用时重试：事务已提交则直接移除，否则重新写入这批消息
+
+        Returns:
+            int: 写入的消息数
+        """
+        async with self._flush_lock:
+            self._idle.clear()
+            try:
+                if self._unacked is None:
+                    batch = list(islice(self._queue, self.max_batch))
+                    if not batch:
+                        return 0
+                    self._batch_seq += 1
+                else:
+                    # 上次写入失败的批次，期间被丢弃（删除会话）的消息不再写入
+                    batch = self._unacked
+                    front = {id(item) for item in islice(self._queue, len(batch))}
+                    batch = [item for item in batch if id(item) in front]
+                    if not batch:
+                        self._unacked = None
+                        return 0
+                self._unacked = batch
+
+                if not await asyncio.to_thread(self._write_batch, self._batch_seq, batch):
+                    logger.info("上次失败的批次已写入Redis，不再重复写入 - 数量: %d", len(batch))
+                return self._ack(batch)
+            finally:
+                self._idle.set()
+
+    def _write_batch(self, seq: int, batch: List[Tuple[str, str, Dict[str, Any], Dict[str, Any]]]) -> bool:
+        """
+        在一个事务中写入一批消息并记录批次序号
+
+        WATCH批次序号键后redis-py在连接断开时不会自动重发事务（重发可能重复写入），由flush重试；
+        每次写入前先读取序号，已提交的批次不再写入
+
+        Returns:
+            bool: 是否写入了这批消息，False表示此前已提交
+        """
+        with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.watch(self._batch_marker_key)
+            if pipe.get(self._batch_marker_key) == str(seq):
+                return False
+            pipe.multi()
+            touched_conversations, touched_sessions = set(), set()
+            for user_id, session_id, message_data, session_info in batch:
+                conversation_key = self.conversation_key(user_id, session_id)
+                sessions_key = self.sessions_key(user_id)
+                pipe.lpush(conversation_key, json.dumps(message_data))
+                pipe.hset(sessions_key, session_id, json.dumps(session_info))
+                touched_conversations.add(conversation_key)
+                touched_sessions.add(sessions_key)
+            for key in touched_conversations:
+                pipe.expire(key, self.conversation_expire)
+            for key in touched_sessions:
+                pipe.expire(key, self.session_expire)
+            pipe.set(self._batch_marker_key, seq, ex=BATCH_MARKER_EXPIRE)
+            pipe.execute()
+            return True
+
+    def _ack(self, batch: List[Tuple[str, str, Dict[str, Any], Dict[str, Any]]]) -> int:
+        """确认批次已写入，从缓冲区移除（期间被丢弃的消息已不在队列中）"""
+        self._unacked = None
+        written = 0
+        for item in batch:
+            if not self._queue or self._queue[0] is not item:
+                continue
+            self._queue.popleft()
+            user_id, session_id, _, _ = item
+            pending = self._pending_messages[(user_id, session_id)]
+            pending.pop(0)
+            if not pending:
+                del self._pending_messages[(user_id, session_id)]
+            written += 1
+        logger.debug("缓冲消息已写入Redis - 数量: %d, 剩余: %d", written, len(self._queue))
+        return written
+
+    async def _flush_loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self.flush_delay > 0:
+                await asyncio.sleep(self.flush_delay)
+            while self._queue:
+                try:
+                    # 停止时不打断写入中的事务，由stop等待其完成后继续写入剩余消息
+                    await asyncio.shield(self.flush())
+                except Exception as e:
+                    logger.error(f"缓冲消息写入Redis失败，稍后重试 - 待写入: {len(self._queue)}, 错误: {e}")
+                    await asyncio.sleep(RETRY_DELAY)
+                # 每批之间让出事件循环
+                await asyncio.sleep(0)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监控指标模块
+定义聊天流程的Prometheus指标，并通过 /metrics 导出；
+多worker部署时设置 PROMETHEUS_MULTIPROC_DIR，各进程把指标写入共享目录，导出时合并
+"""
+
+import os
+import time
+import logging
+
+import redis
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess
+)
+
+logger = logging.getLogger(__name__)
+
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+# 聊天流式响应
+CHAT_TIME_TO_FIRST_TOKEN = Histogram(
+    "chat_time_to_first_token_seconds", "从调用提供商到收到第一个内容片段的时间",
+    ["provider", "model"],
+    buckets=(0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 8, 13, 20, 30)
+)
+CHAT_TOKENS_PER_SECOND = Histogram(
+    "chat_tokens_per_second", "首个片段之后的输出速度（按流式增量片段数估算token数）",
+    ["provider", "model"],
+    buckets=(1, 5, 10, 20, 30, 50, 75, 100, 150, 250, 500)
+)
+CHAT_STREAM_DURATION = Histogram(
+    "chat_stream_duration_seconds", "流式响应总耗时",
+    ["provider", "model"],
+    buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+)
+CHAT_STREAM_CHUNKS = Histogram(
+    "chat_stream_chunks", "每次流式响应的片段数",
+    ["provider", "model"],
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+)
+CHAT_ACTIVE_STREAMS = Gauge(
+    "chat_active_streams", "进行中的流式响应数",
+    ["provider"],
+    multiprocess_mode="livesum"
+)
+CHAT_WS_CONNECTIONS = Gauge(
+    "chat_ws_connections", "打开的WebSocket聊天连接数",
+    multiprocess_mode="livesum"
+)
+
+# AI提供商调用
+PROVIDER_REQUESTS = Counter(
+    "ai_provider_requests_total", "AI提供商调用次数",
+    ["provider", "model", "endpoint"]
+)
+PROVIDER_ERRORS = Counter(
+    "ai_provider_errors_total", "AI提供商调用失败次数",
+    ["provider", "model", "endpoint"]
+)
+PROVIDER_FALLBACKS = Counter(
+    "ai_provider_fallbacks_total", "提供商失败后切换到备选提供商的次数",
+    ["from_provider", "to_provider"]
+)
+# 提示词前缀缓存：命中率 = 命中token / 全部提示词token
+PROMPT_TOKENS = Counter(
+    "ai_prompt_tokens_total", "提示词token数（cache=hit为提供商前缀缓存命中的部分）",
+    ["provider", "model", "cache"]
+)
+PROMPT_CACHE_HIT_RATIO = Histogram(
+    "ai_prompt_cache_hit_ratio", "每次请求的提示词前缀缓存命中率",
+    ["provider"],
+    buckets=(0, 0.1, 0.25, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99, 1)
+)
+
+# 存储
+REDIS_COMMAND_DURATION = Histogram(
+    "redis_command_duration_seconds", "Redis命令耗时（pipeline按一次计）",
+    ["command"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+)
+
+# 图片
+UPLOAD_SIZE = Histogram(
+    "upload_size_bytes", "上传图片大小",
+    ["endpoint"],
+    buckets=(16 * 1024, 64 * 1024, 256 * 1024, 512 * 1024, 1024 ** 2, 2 * 1024 ** 2, 5 * 1024 ** 2, 10 * 1024 ** 2, 20 * 1024 ** 2)
+)
+IMAGE_GENERATION_DURATION = Histogram(
+    "image_generation_duration_seconds", "图片生成耗时",
+    ["provider", "endpoint", "cached"],
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+)
+
+# HTTP请求
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP请求数",
+    ["method", "endpoint", "status"]
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP请求耗时（流式响应计算到最后一个片段发送完毕）",
+    ["method", "endpoint"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+HTTP_RESPONSE_COMPRESSION_BYTES = Counter(
+    "http_response_compression_bytes_total", "压缩的响应体字节数（stage为original时是压缩前，compressed时是压缩后）",
+    ["encoding", "stage"]
+)
+HTTP_RESPONSE_COMPRESSION_DURATION = Histogram(
+    "http_response_compression_duration_seconds", "单个响应体的压缩耗时",
+    ["encoding"],
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5)
+)
+
+
+def is_multiprocess() -> bool:
+    """是否为多进程指标模式"""
+    return bool(os.environ.get(MULTIPROC_DIR_ENV))
+
+
+def render_metrics() -> tuple:
+    """
+    生成Prometheus文本格式的指标数据（多进程模式下合并所有worker的指标）
+
+    Returns:
+        tuple: (指标文本, Content-Type)
+    """
+    if is_multiprocess():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def record_prompt_usage(provider: str, model: str, usage: dict):
+    """
+    记录提示词token数和前缀缓存命中情况
+
+    Args:
+        provider: 提供商名称
+        model: 模型名称
+        usage: 提供商返回的用量，包含prompt_tokens和cached_tokens
+    """
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    if prompt_tokens <= 0:
+        return
+    cached_tokens = min(usage.get("cached_tokens") or 0, prompt_tokens)
+    PROMPT_TOKENS.labels(provider=provider, model=model, cache="hit").inc(cached_tokens)
+    PROMPT_TOKENS.labels(provider=provider, model=model, cache="miss").inc(prompt_tokens - cached_tokens)
+    PROMPT_CACHE_HIT_RATIO.labels(provider=provider).observe(cached_tokens / prompt_tokens)
+
+
+def mark_worker_exited():
+    """worker进程退出时清理其实时Gauge数据（多进程模式）"""
+    if is_multiprocess():
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    """记录执行耗时的Redis pipeline"""
+
+    def execute(self, raise_on_error: bool = True):
+        started = time.perf_counter()
+        try:
+            return super().execute(raise_on_error)
+        finally:
+            REDIS_COMMAND_DURATION.labels(command="PIPELINE").observe(time.perf_counter() - started)
+
+
+class InstrumentedRedis(redis.Redis):
+    """记录每条命令耗时的Redis客户端"""
+
+    def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            REDIS_COMMAND_DURATION.labels(command=str(args[0]).upper()).observe(time.perf_counter() - started)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ASGI中间件模块
+"""
+
+import json
+import time
+import asyncio
+import logging
+from typing import Iterable, Optional, Tuple
+
+from fastapi import HTTPException
+
+from compression import DYNAMIC_LEVELS, choose_encoding, compress
+from metrics import HTTP_REQUESTS, HTTP_REQUEST_DURATION, HTTP_RESPONSE_COMPRESSION_BYTES, HTTP_RESPONSE_COMPRESSION_DURATION
+from tracing import start_span
+
+logger = logging.getLogger(__name__)
+
+
+def get_route_template(scope, root_path: str) -> str:
+    """路由匹配后从scope中取路由模板（如 /images/{image_id}），挂载的子应用（如静态文件）取挂载路径"""
+    route = scope.get("route")
+    if route is not None and hasattr(route, "path"):
+        return route.path
+    if scope.get("root_path", "") != root_path:
+        return scope["root_path"][len(root_path):] or "/"
+    return "<unmatched>"
+
+
+class RequestSizeLimitMiddleware:
+    """
+    请求体大小限制中间件
+
+    在请求体传输过程中累计字节数，超过限制立即返回413，
+    不必等整个上传完成后再判断大小
+    """
+
+    def __init__(self, app, max_body_size: int, paths: Iterable[str]):
+        """
+        Args:
+            app: ASGI应用
+            max_body_size: 请求体最大字节数
+            paths: 需要限制的路径
+        """
+        self.app = app
+        self.max_body_size = max_body_size
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        # 声明了Content-Length时直接判断，无需读取请求体
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > self.max_body_size:
+                logger.warning(f"请求体超出限制 - 路径: {scope['path']}, Content-Length: {int(value)}, 限制: {self.max_body_size}")
+                await self._send_too_large(send)
+                return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    logger.warning(f"请求体超出限制 - 路径: {scope['path']}, 已接收: {received}, 限制: {self.max_body_size}")
+                    raise HTTPException(status_code=413, detail=self._detail())
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    def _detail(self) -> str:
+        return f"请求体大小不能超过{self.max_body_size / (1024 * 1024):.0f}MB"
+
+    async def _send_too_large(self, send):
+        body = json.dumps({"detail": self._detail()}, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+class MetricsMiddleware:
+    """
+    HTTP请求指标中间件
+
+    按路由模板（如 /images/{image_id}）统计请求数和耗时，避免路径参数导致标签过多；
+    流式响应的耗时计算到响应体发送完毕
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        root_path = scope.get("root_path", "")
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            endpoint = get_route_template(scope, root_path)
+            HTTP_REQUESTS.labels(method=scope["method"], endpoint=endpoint, status=str(status_code)).inc()
+            HTTP_REQUEST_DURATION.labels(method=scope["method"], endpoint=endpoint).observe(time.perf_counter() - started)
+
+
+class TracingMiddleware:
+    """
+    链路追踪中间件
+
+    为每个HTTP请求创建根span（上游携带traceparent时延续上游trace），
+    路由、存储、提供商调用中的span都挂在它下面；响应头X-Trace-Id返回trace ID便于查找
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        root_path = scope.get("root_path", "")
+        traceparent = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+
+        with start_span("http.request", traceparent=traceparent, method=scope["method"], path=scope["path"]) as span:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    span.set_attribute("status_code", message["status"])
+                    message["headers"] = [*message.get("headers", []), (b"x-trace-id", span.trace_id.encode())]
+                elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                    span.add_event("response_sent")
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                span.name = f"{scope['method']} {get_route_template(scope, root_path)}"
+
+
+class CompressionMiddleware:
+    """
+    JSON响应压缩中间件
+
+    按Accept-Encoding协商br或gzip，只压缩一次性发送的JSON响应体（大小不小于minimum_size）；
+    流式响应（SSE、NDJSON等分多次发送的响应体）和已设置Content-Encoding的响应原样转发，
+    避免缓冲导致片段无法及时送达。较大的响应体在线程池中压缩，不阻塞事件循环
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, offload_size: int = 64 * 1024,
+                 media_types: Tuple[str, ...] = ("application/json",)):
+        """
+        Args:
+            app: ASGI应用
+            minimum_size: 小于该大小的响应体不压缩
+            offload_size: 不小于该大小的响应体在线程池中压缩
+            media_types: 需要压缩的内容类型
+        """
+        self.app = app
+        self.minimum_size = minimum_size
+        self.offload_size = offload_size
+        self.media_types = media_types
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = None
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = choose_encoding(accept_encoding)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[dict] = None
+
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                if self._should_compress(message):
+                    # 等到响应体确定是一次性发送后再决定是否压缩
+                    start_message = message
+                    return
+            elif message["type"] == "http.response.body" and start_message is not None:
+                pending_start, start_message = start_message, None
+                body = message.get("body", b"")
+                if message.get("more_body", False) or len(body) < self.minimum_size:
+                    await send(pending_start)
+                else:
+                    compressed = await self._compress(body, encoding)
+                    pending_start["headers"] = self._compressed_headers(pending_start["headers"], encoding, len(compressed))
+                    message = {"type": "http.response.body", "body": compressed}
+                    await send(pending_start)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _should_compress(self, message) -> bool:
+        if message["status"] < 200 or message["status"] in (204, 304):
+            return False
+        content_type = b""
+        for name, value in message.get("headers", []):
+            if name == b"content-encoding":
+                return False
+            if name == b"content-type":
+                content_type = value
+        return content_type.split(b";")[0].strip().decode("latin-1").lower() in self.media_types
+
+    async def _compress(self, body: bytes, encoding: str) -> bytes:
+        started = time.perf_counter()
+        if len(body) >= self.offload_size:
+            compressed = await asyncio.to_thread(compress, body, encoding, DYNAMIC_LEVELS[encoding])
+        else:
+            compressed = compress(body, encoding, DYNAMIC_LEVELS[encoding])
+        HTTP_RESPONSE_COMPRESSION_DURATION.labels(encoding=encoding).observe(time.perf_counter() - started)
+        HTTP_RESPONSE_COMPRESSION_BYTES.labels(encoding=encoding, stage="original").inc(len(body))
+        HTTP_RESPONSE_COMPRESSION_BYTES.labels(encoding=encoding, stage="compressed").inc(len(compressed))
+        return compressed
+
+    @staticmethod
+    def _compressed_headers(headers, encoding: str, length: int) -> list:
+        result = []
+        vary = None
+        for name, value in headers:
+            if name == b"content-length":
+                continue
+            if name == b"etag" and not value.startswith(b"W/"):
+                # 压缩后字节不同，强ETag改为弱ETag
+                value = b"W/" + value
+            if name == b"vary":
+                vary = value
+                continue
+            result.append((name, value))
+        result.append((b"content-encoding", encoding.encode()))
+        result.append((b"content-length", str(length).encode()))
+        result.append((b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"))
+        return result
@@ -2,13 +2,40 @@
 # -*- coding: utf-8 -*-
 """
 服务器启动脚本
-配置uvicorn忽略日志文件的监控
+dev模式：单进程热重载，配置uvicorn忽略日志文件的监控
+prod模式：多worker进程、uvloop/httptools、优雅停机与worker回收
 """
 
+import os
+import shutil
+import argparse
+import tempfile
+import importlib.util
+
 import uvicorn
 from config import config
 
-if __name__ == "__main__":
+
+def _pick_implementation(module_name: str) -> str:
+    """已安装高性能实现（uvloop/httptools）时使用它，否则交给uvicorn自动选择"""
+    return module_name if importlib.util.find_spec(module_name) else "auto"
+
+
+def _prepare_metrics_dir() -> str:
+    """
+    准备多进程指标目录：各worker把指标写入该目录，/metrics 导出时合并。
+    目录中残留的上次运行的数据会导致计数错误，启动前清空
+    """
+    metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR") or os.path.join(tempfile.gettempdir(), f"ai-chat-metrics-{config.PORT}")
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+    # worker进程继承环境变量，需在导入prometheus_client之前设置
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+    return metrics_dir
+
+
+def run_dev_server():
+    """开发模式：单进程 + 代码热重载"""
     # 配置uvicorn，忽略logs目录
     uvicorn.run(
         "main:app",
@@ -23,4 +50,50 @@ if __name__ == "__main__":
             "*.pyc"
         ],
         log_level="info" if not config.DEBUG else "debug"
-    )
\ No newline at end of file
+    )
+
+
+def run_prod_server(workers: int = None):
+    """
+    生产模式：多worker进程
+
+    - worker数默认按CPU核数计算
+    - 使用uvloop事件循环与httptools解析器
+    - 收到SIGTERM后停止接收新连接，进行中的SSE流在GRACEFUL_SHUTDOWN_TIMEOUT内继续完成
+    - worker处理MAX_REQUESTS_PER_WORKER个请求后退出，由主进程拉起新的worker
+    - 多worker时指标写入共享目录，任一worker的 /metrics 都返回所有worker合并后的数据
+    """
+    workers = workers or config.get_worker_count()
+    # 单进程时没有主进程负责重新拉起worker，回收会直接导致服务退出
+    max_requests = config.MAX_REQUESTS_PER_WORKER if workers > 1 and config.MAX_REQUESTS_PER_WORKER > 0 else None
+    if workers > 1:
+        _prepare_metrics_dir()
+
+    uvicorn.run(
+        "main:app",
+        host=config.HOST,
+        port=config.PORT,
+        workers=workers,
+        loop=_pick_implementation("uvloop"),
+        http=_pick_implementation("httptools"),
+        backlog=config.BACKLOG,
+        timeout_keep_alive=config.KEEP_ALIVE_TIMEOUT,
+        timeout_graceful_shutdown=config.GRACEFUL_SHUTDOWN_TIMEOUT,
+        limit_max_requests=max_requests,
+        access_log=config.DEBUG,
+        log_level="info" if not config.DEBUG else "debug"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="启动AI聊天应用服务器")
+    parser.add_argument("--mode", choices=["dev", "prod"], default=config.SERVER_MODE,
+                        help="运行模式：dev（热重载）或 prod（多worker）")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="prod模式的worker数，默认按CPU核数计算")
+    args = parser.parse_args()
+
+    if args.mode == "prod":
+        run_prod_server(args.workers)
+    else:
+        run_dev_server()
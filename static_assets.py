@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+静态资源模块
+构建：为静态资源生成带内容哈希的文件名，改写HTML中的引用，并预先生成gzip/brotli压缩版本，
+清单写入manifest.json。部署时执行 python static_assets.py；服务启动时发现源文件有变化也会自动重新构建
+服务：启动时把构建结果载入内存，按Accept-Encoding返回预压缩版本，带哈希的文件名长期缓存（immutable），
+其他文件（HTML等）每次重新验证，ETag匹配时返回304
+"""
+
+import os
+import re
+import json
+import hashlib
+import logging
+import argparse
+import mimetypes
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+from compression import SUPPORTED_ENCODINGS, choose_encoding, compress, is_compressible
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+# 构建目录中的锁文件，多个worker同时启动时只有一个进行构建
+LOCK_NAME = ".build.lock"
+# 小于该大小的文件不压缩
+COMPRESS_MIN_SIZE = 1024
+# 压缩版本的文件后缀
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+# 带哈希的文件名可长期缓存，其他文件每次重新验证
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+# HTML中对静态资源的引用
+STATIC_REFERENCE_PATTERN = re.compile(r'(["\'(])/static/([^"\'()?#\s]+)')
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """判断If-None-Match请求头是否包含当前ETag（忽略弱校验前缀）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def _content_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def _list_source_files(source_dir: str) -> List[str]:
+    """列出源目录下的所有文件（相对路径，使用/分隔）"""
+    files = []
+    for root, _, names in os.walk(source_dir):
+        for name in names:
+            files.append(os.path.relpath(os.path.join(root, name), source_dir).replace(os.sep, "/"))
+    return sorted(files)
+
+
+def _source_signature(source_dir: str, files: List[str]) -> str:
+    """源文件的路径、大小、修改时间以及可用压缩编码的摘要，用于判断构建结果是否过期"""
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(",".join(SUPPORTED_ENCODINGS).encode())
+    for rel_path in files:
+        stat_result = os.stat(os.path.join(source_dir, rel_path))
+        digest.update(f"{rel_path}:{stat_result.st_size}:{stat_result.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+
+def _fingerprint_path(rel_path: str, data: bytes) -> str:
+    base, ext = os.path.splitext(rel_path)
+    return f"{base}.{_content_hash(data)[:10]}{ext}"
+
+
+def _is_html(rel_path: str) -> bool:
+    return rel_path.endswith((".html", ".htm"))
+
+
+@contextmanager
+def _build_lock(output_dir: str):
+    """持有构建目录的文件锁（进程间互斥），没有fcntl的平台上不加锁"""
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, LOCK_NAME), "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write_file(path: str, data: bytes):
+    """先写临时文件再替换，读取方不会读到写了一半的文件"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build_static_assets(source_dir: str, output_dir: str) -> Dict:
+    """
+    构建静态资源（持有构建目录的文件锁，与其他进程的构建互斥）
+
+    HTML文件保持原文件名，其引用的静态资源改为带哈希的文件名；可压缩且不小于COMPRESS_MIN_SIZE的文件
+    生成 .gz 和 .br（已安装brotli时）版本，压缩后没有变小的不保留
+
+    Args:
+        source_dir: 静态资源源目录
+        output_dir: 构建输出目录
+
+    Returns:
+        Dict: 清单，包含 assets（原路径 -> 带哈希的路径）和 files（输出路径 -> ETag、压缩版本）
+    """
+    with _build_lock(output_dir):
+        return _build(source_dir, output_dir)
+
+
+def _build(source_dir: str, output_dir: str) -> Dict:
+    """执行构建，调用方需持有构建锁"""
+    files = _list_source_files(source_dir)
+    signature = _source_signature(source_dir, files)
+    contents = {}
+    for rel_path in files:
+        with open(os.path.join(source_dir, rel_path), "rb") as f:
+            contents[rel_path] = f.read()
+
+    assets = {
+        rel_path: _fingerprint_path(rel_path, data)
+        for rel_path, data in contents.items() if not _is_html(rel_path)
+    }
+
+    def rewrite_reference(match: re.Match) -> str:
+        rel_path = assets.get(match.group(2))
+        return f"{match.group(1)}/static/{rel_path}" if rel_path else match.group(0)
+
+    outputs = {}
+    for rel_path, data in contents.items():
+        if _is_html(rel_path):
+            text = STATIC_REFERENCE_PATTERN.sub(rewrite_reference, data.decode("utf-8"))
+            outputs[rel_path] = text.encode("utf-8")
+        else:
+            outputs[assets[rel_path]] = data
+
+    manifest_files = {}
+    written = {MANIFEST_NAME}
+    original_size = compressed_size = 0
+    for out_path, data in outputs.items():
+        _write_file(os.path.join(output_dir, out_path), data)
+        written.add(out_path)
+        encodings = []
+        media_type = mimetypes.guess_type(out_path)[0]
+        if len(data) >= COMPRESS_MIN_SIZE and is_compressible(media_type):
+            for encoding in SUPPORTED_ENCODINGS:
+                compressed = compress(data, encoding)
+                if len(compressed) < len(data):
+                    encoded_path = out_path + ENCODING_SUFFIXES[encoding]
+                    _write_file(os.path.join(output_dir, encoded_path), compressed)
+                    written.add(encoded_path)
+                    encodings.append(encoding)
+                    original_size += len(data)
+                    compressed_size += len(compressed)
+        manifest_files[out_path] = {"etag": _content_hash(data), "encodings": encodings}
+
+    # 删除之前构建留下的旧文件（跳过锁文件和其他进程正在写入的临时文件）
+    for rel_path in _list_source_files(output_dir):
+        if rel_path in written or rel_path == LOCK_NAME or rel_path.endswith(".tmp"):
+            continue
+        try:
+            os.remove(os.path.join(output_dir, rel_path))
+        except FileNotFoundError:
+            pass
+
+    manifest = {"source_signature": signature, "assets": assets, "files": manifest_files}
+    _write_file(os.path.join(output_dir, MANIFEST_NAME), json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+    logger.info(
+        f"静态资源构建完成 - 文件数: {len(outputs)}, 压缩编码: {list(SUPPORTED_ENCODINGS)}, "
+        f"压缩前后: {original_size} -> {compressed_size} bytes"
+    )
+    return manifest
+
+
+def load_manifest(source_dir: str, output_dir: str, rebuild_if_stale: bool = True) -> Dict:
+    """
+    读取构建清单，构建结果不存在或源文件有变化时重新构建
+
+    检查和构建都在构建锁内进行：多个worker同时启动时，第一个进程构建，其余进程等待后直接使用其结果
+
+    Args:
+        source_dir: 静态资源源目录
+        output_dir: 构建输出目录
+        rebuild_if_stale: 构建结果过期时是否重新构建
+
+    Returns:
+        Dict: 构建清单
+    """
+    with _build_lock(output_dir):
+        try:
+            with open(os.path.join(output_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = None
+
+        if rebuild_if_stale and (manifest is None or manifest.get("source_signature") != _source_signature(source_dir, _list_source_files(source_dir))):
+            logger.info(f"静态资源构建结果不存在或已过期，重新构建 - 输出目录: {output_dir}")
+            manifest = _build(source_dir, output_dir)
+        return manifest
+
+
+@dataclass
+class StaticAsset:
+    """载入内存的静态资源及其各编码版本"""
+    media_type: str
+    etag: str
+    cache_control: str
+    # 编码（None表示未压缩）-> 内容
+    variants: Dict[Optional[str], bytes] = field(default_factory=dict)
+
+    def select(self, accept_encoding: Optional[str]) -> Tuple[Optional[str], bytes]:
+        """按Accept-Encoding选择返回的版本"""
+        encoding = choose_encoding(accept_encoding, [name for name in SUPPORTED_ENCODINGS if name in self.variants])
+        return encoding, self.variants[encoding]
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """从内存返回预压缩静态资源的StaticFiles，未载入的路径按StaticFiles原有方式从源目录返回"""
+
+    def __init__(self, directory: str, build_dir: str, **kwargs):
+        """
+        初始化静态资源服务
+
+        Args:
+            directory: 静态资源源目录
+            build_dir: 构建输出目录
+        """
+        super().__init__(directory=directory, **kwargs)
+        self.source_dir = directory
+        self.build_dir = build_dir
+        self._assets: Dict[str, StaticAsset] = {}
+
+    def load(self):
+        """载入构建结果（过期时先重新构建），构建失败时继续由源目录提供未压缩的文件"""
+        try:
+            manifest = load_manifest(self.source_dir, self.build_dir)
+        except Exception as e:
+            logger.error(f"静态资源构建失败，使用未压缩的源文件: {e}")
+            return
+
+        assets = {}
+        for out_path, info in manifest["files"].items():
+            file_path = os.path.join(self.build_dir, out_path)
+            media_type = mimetypes.guess_type(out_path)[0] or "application/octet-stream"
+            with open(file_path, "rb") as f:
+                variants = {None: f.read()}
+            for encoding in info["encodings"]:
+                with open(file_path + ENCODING_SUFFIXES[encoding], "rb") as f:
+                    variants[encoding] = f.read()
+            fingerprinted = not _is_html(out_path)
+            assets[out_path] = StaticAsset(
+                media_type=media_type,
+                etag=info["etag"],
+                cache_control=IMMUTABLE_CACHE_CONTROL if fingerprinted else REVALIDATE_CACHE_CONTROL,
+                variants=variants
+            )
+
+        # 原文件名（旧页面或手写的链接）同样返回压缩版本，但需要重新验证
+        for rel_path, out_path in manifest["assets"].items():
+            asset = assets[out_path]
+            assets[rel_path] = StaticAsset(asset.media_type, asset.etag, REVALIDATE_CACHE_CONTROL, asset.variants)
+
+        self._assets = assets
+        total = sum(len(data) for asset in assets.values() for data in asset.variants.values())
+        logger.info(f"静态资源已载入内存 - 路径数: {len(assets)}, 大小: {total} bytes")
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        asset = self._assets.get(path.replace(os.sep, "/"))
+        if asset is None or scope["method"] not in ("GET", "HEAD"):
+            return await super().get_response(path, scope)
+
+        accept_encoding = if_none_match = None
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+            elif name == b"if-none-match":
+                if_none_match = value.decode("latin-1")
+
+        encoding, body = asset.select(accept_encoding)
+        # 不同编码的内容不同，ETag也不同
+        etag = f'"{asset.etag}-{encoding}"' if encoding else f'"{asset.etag}"'
+        headers = {"ETag": etag, "Cache-Control": asset.cache_control, "Vary": "Accept-Encoding"}
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type=asset.media_type, headers=headers)
+
+
+def main():
+    """命令行入口：构建静态资源"""
+    from config import config
+
+    parser = argparse.ArgumentParser(description="构建静态资源（带哈希的文件名 + gzip/brotli预压缩）")
+    parser.add_argument("--source", default="static", help="静态资源源目录")
+    parser.add_argument("--output", default=config.STATIC_BUILD_DIR, help="构建输出目录")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    manifest = build_static_assets(args.source, args.output)
+    for out_path, info in manifest["files"].items():
+        print(f"{out_path}: {', '.join(info['encodings']) or '不压缩'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求链路追踪模块
+每个请求生成一条trace，各处理阶段（存储读写、提供商连接、首个token等）记录为span；
+当前span保存在contextvars中，随调用链（包括MultiProviderManager和提供商）自动传递，
+结束的span由后台线程批量交给可插拔的exporter输出
+"""
+
+import sys
+import json
+import asyncio
+import time
+import queue
+import random
+import secrets
+import logging
+import importlib
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """一个处理阶段的耗时记录"""
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str],
+        sampled: bool,
+        attributes: Optional[Dict[str, Any]] = None
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = dict(attributes or {})
+        self.events: List[Dict[str, Any]] = []
+        self.status = "ok"
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+
+    @property
+    def traceparent(self) -> str:
+        """W3C traceparent格式的追踪上下文"""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def elapsed_ms(self) -> float:
+        """span开始至今的毫秒数"""
+        return (time.perf_counter() - self._started) * 1000
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes: Any):
+        self.attributes.update(attributes)
+
+    def add_event(self, name: str, **attributes: Any):
+        """记录span内的时间点（如首个token到达）"""
+        self.events.append({"name": name, "offset_ms": round(self.elapsed_ms(), 3), **attributes})
+
+    def record_exception(self, error: BaseException):
+        self.status = "error"
+        self.attributes["error.type"] = type(error).__name__
+        self.attributes["error.message"] = str(error)
+
+    def end(self):
+        """结束span，已采样的span交给exporter"""
+        if self.duration_ms is not None:
+            return
+        self.duration_ms = self.elapsed_ms()
+        if self.sampled and _processor is not None:
+            _processor.on_end(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration_ms": round(self.duration_ms, 3) if self.duration_ms is not None else None,
+            "status": self.status,
+            "attributes": self.attributes,
+            "events": self.events
+        }
+
+
+class SpanExporter:
+    """span导出器基类，自定义导出器继承此类并通过 TRACING_EXPORTER=模块路径:类名 启用"""
+
+    def export(self, spans: List[Dict[str, Any]]):
+        """导出一批span（在后台线程中调用）"""
+        raise NotImplementedError
+
+    def shutdown(self):
+        """关闭导出器"""
+
+
+class ConsoleSpanExporter(SpanExporter):
+    """以JSON行输出到标准输出"""
+
+    def export(self, spans: List[Dict[str, Any]]):
+        for span in spans:
+            sys.stdout.write(json.dumps(span, ensure_ascii=False, default=str) + "\n")
+        sys.stdout.flush()
+
+
+class FileSpanExporter(SpanExporter):
+    """以JSON行追加到本地文件，便于离线分析"""
+
+    def __init__(self, path: str):
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, spans: List[Dict[str, Any]]):
+        for span in spans:
+            self._file.write(json.dumps(span, ensure_ascii=False, default=str) + "\n")
+        self._file.flush()
+
+    def shutdown(self):
+        self._file.close()
+
+
+class BatchSpanProcessor:
+    """结束的span先进入队列，由后台线程批量导出，不阻塞请求处理"""
+
+    def __init__(self, exporter: SpanExporter, queue_size: int = 10000, batch_size: int = 256):
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.dropped = 0  # 队列满时丢弃的span数
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def on_end(self, span: Span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            span = self._queue.get()
+            if span is None:
+                return
+            batch = [span]
+            while len(batch) < self.batch_size:
+                try:
+                    span = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if span is None:
+                    self._export(batch)
+                    return
+                batch.append(span)
+            self._export(batch)
+
+    def _export(self, batch: List[Span]):
+        try:
+            self.exporter.export([span.to_dict() for span in batch])
+        except Exception as e:
+            logger.warning(f"导出span失败: {e}")
+
+    def shutdown(self):
+        """导出队列中剩余的span并关闭导出器"""
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self.exporter.shutdown()
+
+
+_processor: Optional[BatchSpanProcessor] = None
+_sample_rate: float = 1.0
+
+
+def _create_exporter(name: str, file_path: str) -> Optional[SpanExporter]:
+    """根据配置创建导出器：none、stdout、file 或 "模块路径:类名" """
+    if name in ("", "none"):
+        return None
+    if name == "stdout":
+        return ConsoleSpanExporter()
+    if name == "file":
+        return FileSpanExporter(file_path)
+
+    module_name, class_name = name.split(":", 1)
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def configure_tracing(exporter: str, file_path: str, sample_rate: float = 1.0):
+    """
+    配置链路追踪（应用启动时调用）
+
+    Args:
+        exporter: 导出器名称：none（关闭）、stdout、file，或自定义导出器 "模块路径:类名"
+        file_path: file导出器的输出文件
+        sample_rate: 新trace的采样率（0~1），携带traceparent的请求沿用上游的采样决定
+    """
+    global _processor, _sample_rate
+    shutdown_tracing()
+    _sample_rate = sample_rate
+    span_exporter = _create_exporter(exporter, file_path)
+    if span_exporter is not None:
+        _processor = BatchSpanProcessor(span_exporter)
+        logger.info(f"链路追踪已启用 - 导出器: {exporter}, 采样率: {sample_rate}")
+
+
+def shutdown_tracing():
+    """导出剩余的span并关闭导出器（应用关闭时调用）"""
+    global _processor
+    if _processor is not None:
+        _processor.shutdown()
+        _processor = None
+
+
+def get_current_span() -> Optional[Span]:
+    """获取当前上下文中的span"""
+    return _current_span.get()
+
+
+def _parse_traceparent(traceparent: Optional[str]) -> Optional[tuple]:
+    """解析W3C traceparent，返回 (trace_id, parent_id, sampled)"""
+    if not traceparent:
+        return None
+    parts = traceparent.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16), int(parts[3], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2], bool(int(parts[3], 16) & 1)
+
+
+@contextmanager
+def start_span(name: str, traceparent: Optional[str] = None, **attributes: Any) -> Iterator[Span]:
+    """
+    开始一个span并设为当前span，退出with块时结束
+
+    Args:
+        name: span名称
+        traceparent: 上游传入的追踪上下文（仅在没有当前span时使用）
+        **attributes: span属性
+
+    Yields:
+        Span: 新的span
+    """
+    parent = _current_span.get()
+    if parent is not None:
+        span = Span(name, parent.trace_id, parent.span_id, parent.sampled, attributes)
+    else:
+        upstream = _parse_traceparent(traceparent)
+        if upstream is not None:
+            trace_id, parent_id, sampled = upstream
+        else:
+            trace_id, parent_id = secrets.token_hex(16), None
+            sampled = _processor is not None and random.random() < _sample_rate
+        span = Span(name, trace_id, parent_id, sampled and _processor is not None, attributes)
+
+    token = _current_span.set(span)
+    try:
+        yield span
+    except (GeneratorExit, asyncio.CancelledError):
+        # 客户端断开导致流式响应提前结束
+        span.status = "cancelled"
+        raise
+    except BaseException as e:
+        span.record_exception(e)
+        raise
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # 异步生成器在其他任务中被关闭时，上下文已不是创建span时的上下文
+            pass
+        span.end()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+token用量账本模块
+按 日期 + 用户 + 提供商 + 模型 累计请求数和token数。记录先累加在进程内，
+由后台任务定期用一个Redis pipeline批量HINCRBY写入（多worker的增量直接相加）；
+Redis不可用时累计在内存中。提供商未返回用量时按文本长度估算
+"""
+
+import time
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 累计的计数项
+USAGE_METRICS = ("requests", "prompt_tokens", "completion_tokens", "cached_tokens", "total_tokens", "estimated_requests")
+# 每条消息的格式开销（角色、分隔符）和每张图片的估算token数
+MESSAGE_TOKEN_OVERHEAD = 4
+IMAGE_TOKEN_ESTIMATE = 765
+
+
+def get_usage_key(day: str, user_id: str) -> str:
+    """获取用户某天用量在Redis中的键名"""
+    return f"usage:{day}:{user_id}"
+
+
+def get_usage_total_key(day: str) -> str:
+    """获取某天全部用户用量在Redis中的键名"""
+    return f"usage_total:{day}"
+
+
+def usage_day(timestamp: Optional[float] = None) -> str:
+    """用量归属的日期（UTC，多实例部署时保持一致）"""
+    return datetime.fromtimestamp(timestamp if timestamp is not None else time.time(), timezone.utc).strftime("%Y-%m-%d")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数：中日韩字符约每字1个token，其他字符约每4个字符1个token
+
+    Args:
+        text: 文本
+
+    Returns:
+        int: 估算的token数
+    """
+    if not text:
+        return 0
+    wide = sum(1 for ch in text if '\u3040' <= ch <= '\u30ff' or '\u4e00' <= ch <= '\u9fff' or '\uac00' <= ch <= '\ud7af')
+    return wide + (len(text) - wide + 3) // 4
+
+
+def estimate_usage(prompt_texts: Iterable[str], completion_text: str, images: int = 0) -> Dict[str, int]:
+    """
+    提供商未返回用量时在本地估算
+
+    Args:
+        prompt_texts: 发送给模型的各条消息文本（含系统提示）
+        completion_text: 模型输出的文本（含深度思考内容）
+        images: 请求中的图片数
+
+    Returns:
+        Dict[str, int]: prompt_tokens、completion_tokens、total_tokens、cached_tokens
+    """
+    prompt_tokens = sum(estimate_tokens(text) + MESSAGE_TOKEN_OVERHEAD for text in prompt_texts) + images * IMAGE_TOKEN_ESTIMATE
+    completion_tokens = estimate_tokens(completion_text)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "cached_tokens": 0
+    }
+
+
+class UsageLedger:
+    """token用量账本：进程内累加 + 定期批量写入Redis"""
+
+    def __init__(self, redis_client=None, flush_interval: float = 1.0, retention_days: int = 90):
+        """
+        初始化用量账本
+
+        Args:
+            redis_client: Redis客户端（decode_responses=True），为None时累计在内存中
+            flush_interval: 批量写入Redis的间隔（秒）
+            retention_days: 用量数据保留天数
+        """
+        self.redis_client = redis_client
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        # 待写入的增量: (日期, 用户, 提供商, 模型) -> {计数项: 增量}
+        self._pending: Dict[Tuple[str, str, str, str], Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        # 内存存储: 日期 -> 用户 -> "提供商|模型|计数项" -> 值
+        self._memory: Dict[str, Dict[str, Dict[str, int]]] = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """启动定期写入任务"""
+        self._flush_task = asyncio.create_task(self._flush_loop(), name="usage-ledger-flush")
+
+    async def stop(self):
+        """停止定期写入任务并写入剩余增量"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        self.flush()
+
+    def record(self, user_id: str, provider: str, model: str, usage: Dict[str, Any], estimated: bool = False):
+        """
+        记录一次调用的用量（只累加在进程内，由后台任务批量写入）
+
+        Args:
+            user_id: 用户ID
+            provider: 提供商名称
+            model: 模型名称
+            usage: 用量，包含prompt_tokens、completion_tokens、total_tokens、cached_tokens
+            estimated: 用量是否为本地估算
+        """
+        counters = self._pending[(usage_day(), user_id, provider, model)]
+        counters["requests"] += 1
+        counters["estimated_requests"] += int(estimated)
+        for metric in ("prompt_tokens", "completion_tokens", "cached_tokens", "total_tokens"):
+            counters[metric] += int(usage.get(metric) or 0)
+
+    def flush(self):
+        """把进程内累加的增量写入存储，Redis写入失败时保留增量等待下次写入"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, defaultdict(lambda: defaultdict(int))
+
+        if not self.redis_client:
+            for (day, user_id, provider, model), counters in pending.items():
+                for metric, value in counters.items():
+                    self._memory[day][user_id][f"{provider}|{model}|{metric}"] += value
+            return
+
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            expire_seconds = self.retention_days * 24 * 3600
+            for (day, user_id, provider, model), counters in pending.items():
+                for key in (get_usage_key(day, user_id), get_usage_total_key(day)):
+                    for metric, value in counters.items():
+                        if value:
+                            pipe.hincrby(key, f"{provider}|{model}|{metric}", value)
+                    pipe.expire(key, expire_seconds)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"用量写入Redis失败，稍后重试: {e}")
+            for group, counters in pending.items():
+                for metric, value in counters.items():
+                    self._pending[group][metric] += value
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    def _read_days(self, days: List[str], user_id: Optional[str]) -> List[Dict[str, int]]:
+        """读取多天的用量字段（Redis时一次pipeline读取）"""
+        if self.redis_client:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for day in days:
+                pipe.hgetall(get_usage_key(day, user_id) if user_id else get_usage_total_key(day))
+            return [{field: int(value) for field, value in fields.items()} for fields in pipe.execute()]
+
+        results = []
+        for day in days:
+            if user_id:
+                results.append(dict(self._memory.get(day, {}).get(user_id, {})))
+                continue
+            totals: Dict[str, int] = defaultdict(int)
+            for fields in self._memory.get(day, {}).values():
+                for field, value in fields.items():
+                    totals[field] += value
+            results.append(totals)
+        return results
+
+    def query(
+        self,
+        start: date,
+        end: date,
+        user_id: Optional[str] = None,
+        provider: Optional[str] = None,
+        model: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        查询用量（先写入进程内的增量）
+
+        Args:
+            start: 开始日期（含）
+            end: 结束日期（含）
+            user_id: 用户ID，为None时查询全部用户的合计
+            provider: 只返回该提供商
+            model: 只返回该模型
+
+        Returns:
+            Dict[str, Any]: 按日期和 提供商/模型 分组的用量及合计
+        """
+        self.flush()
+        day_names = [(start + timedelta(days=offset)).isoformat() for offset in range((end - start).days + 1)]
+        days = []
+        totals = dict.fromkeys(USAGE_METRICS, 0)
+        for day, fields in zip(day_names, self._read_days(day_names, user_id)):
+            items: Dict[Tuple[str, str], Dict[str, Any]] = {}
+            for field, value in fields.items():
+                item_provider, item_model, metric = field.rsplit("|", 2)
+                if (provider and item_provider != provider) or (model and item_model != model):
+                    continue
+                item = items.setdefault((item_provider, item_model), {
+                    "provider": item_provider, "model": item_model, **dict.fromkeys(USAGE_METRICS, 0)
+                })
+                item[metric] = value
+                totals[metric] += value
+            if items:
+                days.append({"date": day, "items": sorted(items.values(), key=lambda item: (item["provider"], item["model"]))})
+        return {"days": days, "totals": totals}
+
+    def get_user_day_total(self, user_id: str, day: Optional[str] = None) -> int:
+        """获取用户某天（默认今天）已使用的token总数，包含尚未写入存储的增量"""
+        day = day or usage_day()
+        used = sum(value for field, value in self._read_days([day], user_id)[0].items() if field.endswith("|total_tokens"))
+        used += sum(counters["total_tokens"] for (pending_day, pending_user, _, _), counters in self._pending.items()
+                    if pending_day == day and pending_user == user_id)
+        return used